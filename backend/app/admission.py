@@ -0,0 +1,206 @@
+"""
+Admission control for expensive endpoints.
+
+Routes are tagged with an endpoint class via ``Depends(limit("export"))``.
+Each class has:
+
+- a token bucket per user (``rate`` requests per minute, ``burst`` at once),
+  so one user cannot monopolise a class, and
+- a process-wide concurrency gate (``concurrency`` slots) with a short
+  bounded queue (``max_queue`` waiters for at most ``max_wait`` seconds), so
+  heavy work cannot starve cheap requests.
+
+Anything over a limit is answered immediately with ``429`` and
+``Retry-After``. Active requests, queue depths, waits and rejections are
+exported as ``admission_*`` metrics. Limits can be overridden per class with
+``ADMISSION_<CLASS>=rate,burst,concurrency,max_queue,max_wait``.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, NamedTuple, Tuple
+
+from fastapi import Depends, HTTPException
+
+from .auth import get_current_user
+from .metrics import counter, gauge, histogram
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1") != "0"
+MAX_TRACKED_BUCKETS = 50000
+
+
+class ClassLimits(NamedTuple):
+    rate: float  # requests per minute per user
+    burst: int
+    concurrency: int  # per process
+    max_queue: int
+    max_wait: float  # seconds
+
+
+DEFAULT_LIMITS: Dict[str, ClassLimits] = {
+    "read": ClassLimits(rate=300, burst=60, concurrency=64, max_queue=128, max_wait=1.0),
+    "analytics": ClassLimits(rate=60, burst=20, concurrency=8, max_queue=16, max_wait=2.0),
+    "export": ClassLimits(rate=6, burst=3, concurrency=2, max_queue=4, max_wait=5.0),
+    "ocr": ClassLimits(rate=10, burst=5, concurrency=2, max_queue=4, max_wait=10.0),
+}
+
+
+def _load_limits() -> Dict[str, ClassLimits]:
+    limits = dict(DEFAULT_LIMITS)
+    for name in limits:
+        override = os.environ.get(f"ADMISSION_{name.upper()}")
+        if override:
+            rate, burst, concurrency, max_queue, max_wait = override.split(",")
+            limits[name] = ClassLimits(float(rate), int(burst), int(concurrency), int(max_queue), float(max_wait))
+    return limits
+
+
+ADMISSION_ACTIVE = gauge("admission_active_requests", "Requests holding a concurrency slot.", ("endpoint_class",))
+ADMISSION_QUEUED = gauge("admission_queue_depth", "Requests waiting for a concurrency slot.", ("endpoint_class",))
+ADMISSION_REJECTED = counter("admission_rejected_total", "Requests rejected with 429.", ("endpoint_class", "reason"))
+ADMISSION_WAIT = histogram("admission_wait_seconds", "Time spent queued before admission.", ("endpoint_class",))
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# =====================================================
+# Token Buckets
+# =====================================================
+class TokenBuckets:
+    """Per-key token buckets, least recently used keys evicted first."""
+
+    def __init__(self, max_keys: int = MAX_TRACKED_BUCKETS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Tuple, list]" = OrderedDict()
+
+    def take(self, key, rate_per_min: float, burst: int, now: float = None) -> float:
+        """Take a token; returns 0 on success, else seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        rate = rate_per_min / 60.0
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(burst), now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / rate
+
+
+# =====================================================
+# Concurrency Gate
+# =====================================================
+class Gate:
+    """Counting semaphore with a bounded FIFO queue and per-waiter deadline."""
+
+    def __init__(self, name: str, limits: ClassLimits):
+        self.name = name
+        self.limits = limits
+        self.active = 0
+        self._waiters: deque = deque()
+
+    def _update_metrics(self):
+        ADMISSION_ACTIVE.set(self.active, endpoint_class=self.name)
+        ADMISSION_QUEUED.set(sum(not w.done() for w in self._waiters), endpoint_class=self.name)
+
+    async def acquire(self):
+        if self.active < self.limits.concurrency and not self._waiters:
+            self.active += 1
+            self._update_metrics()
+            return
+        self._waiters = deque(w for w in self._waiters if not w.done())
+        if len(self._waiters) >= self.limits.max_queue:
+            raise Rejected("queue_full", self.limits.max_wait)
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        timer = loop.call_later(self.limits.max_wait, lambda: waiter.done() or waiter.set_result(False))
+        self._update_metrics()
+        start = time.perf_counter()
+        try:
+            granted = await waiter
+        except asyncio.CancelledError:
+            # Client went away; give back a slot that was already handed over
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.release()
+            raise
+        finally:
+            timer.cancel()
+            ADMISSION_WAIT.observe(time.perf_counter() - start, endpoint_class=self.name)
+            self._update_metrics()
+        if not granted:
+            raise Rejected("queue_timeout", self.limits.max_wait)
+
+    def release(self):
+        # Hand the slot straight to the next live waiter, else free it
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                self._update_metrics()
+                return
+        self.active -= 1
+        self._update_metrics()
+
+
+# =====================================================
+# Controller
+# =====================================================
+class AdmissionController:
+    def __init__(self, limits: Dict[str, ClassLimits]):
+        self.limits = limits
+        self.buckets = TokenBuckets()
+        self.gates = {name: Gate(name, l) for name, l in limits.items()}
+
+    @asynccontextmanager
+    async def admit(self, user_key: str, endpoint_class: str):
+        limits = self.limits[endpoint_class]
+        wait = self.buckets.take((user_key, endpoint_class), limits.rate, limits.burst)
+        if wait > 0:
+            raise Rejected("rate_limited", wait)
+        gate = self.gates[endpoint_class]
+        await gate.acquire()
+        try:
+            yield
+        finally:
+            gate.release()
+
+
+controller = AdmissionController(_load_limits())
+
+
+def limit(endpoint_class: str):
+    """Route dependency admitting the current user into ``endpoint_class``."""
+    if endpoint_class not in controller.limits:
+        raise ValueError(f"Unknown endpoint class: {endpoint_class}")
+
+    async def admission(current_user: dict = Depends(get_current_user)):
+        if not ADMISSION_ENABLED:
+            yield
+            return
+        try:
+            async with controller.admit(current_user["clerk_id"], endpoint_class):
+                yield
+        except Rejected as e:
+            ADMISSION_REJECTED.inc(endpoint_class=endpoint_class, reason=e.reason)
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many {endpoint_class} requests ({e.reason.replace('_', ' ')}), retry later",
+                headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+            )
+
+    return admission
@@ -0,0 +1,257 @@
+"""
+Expense anomaly scoring with robust per-category statistics.
+
+Every expense is compared with the ``WINDOW`` expenses of the same user and
+category (``category_id``, so "food" and "Food" share a history) that
+precede it (ordered by date, then id): its score is the distance from their
+median in units of the scaled MAD (median absolute deviation), so a few
+earlier outliers do not hide the next one. Expenses with fewer than
+``MIN_HISTORY`` predecessors are not scored.
+
+``score_sequences`` scores many users' histories at once with NumPy. The
+batch job (``python -m backend.app.anomalies``) uses it to rescore full
+histories across a process pool; ``rescore_around`` uses the same function
+on the rows whose window a write (or a group-committed batch of writes)
+changed, so incremental and batch scores agree.
+"""
+import argparse
+import logging
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+WINDOW = 50  # preceding expenses in the category the median/MAD is taken over
+MIN_HISTORY = 5
+THRESHOLD = 3.5  # robust z-score above which an expense is flagged
+MIN_AMOUNT = 20.0  # never flag small amounts, however unusual
+MAD_SCALE = 1.4826  # makes the MAD comparable to a standard deviation
+MIN_SPREAD = 0.1  # spread floor as a fraction of the median (identical amounts have MAD 0)
+CHUNK_SIZE = 2000  # users per worker task
+
+
+# =====================================================
+# Scoring (vectorized)
+# =====================================================
+def score_sequences(amounts: np.ndarray, groups: np.ndarray):
+    """
+    Score rows sorted by (group, date, id). ``groups`` labels each row's
+    (user, category); a row's window never reaches into another group.
+    Returns ``(scores, medians, counts)``; scores are NaN where the history
+    is too short.
+    """
+    n = len(amounts)
+    pad_amounts = np.concatenate([np.full(WINDOW, np.nan), amounts.astype(float)])
+    pad_groups = np.concatenate([np.full(WINDOW, -1), groups])
+    # Row i sees positions i-WINDOW .. i-1 of the unpadded array
+    windows = sliding_window_view(pad_amounts, WINDOW)[:n]
+    window_groups = sliding_window_view(pad_groups, WINDOW)[:n]
+    values = np.where(window_groups == groups[:, None], windows, np.nan)
+
+    counts = np.count_nonzero(~np.isnan(values), axis=1)
+    medians = np.full(n, np.nan)
+    mads = np.full(n, np.nan)
+    # Full windows (the common case) take the much faster NaN-free median
+    full = counts == WINDOW
+    if full.any():
+        medians[full] = np.median(values[full], axis=1)
+        mads[full] = np.median(np.abs(values[full] - medians[full, None]), axis=1)
+    partial = ~full & (counts > 0)
+    if partial.any():
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            medians[partial] = np.nanmedian(values[partial], axis=1)
+            mads[partial] = np.nanmedian(np.abs(values[partial] - medians[partial, None]), axis=1)
+    spread = np.maximum(MAD_SCALE * mads, np.maximum(MIN_SPREAD * np.abs(medians), 1.0))
+    scores = np.where(counts >= MIN_HISTORY, (amounts - medians) / spread, np.nan)
+    return scores, medians, counts
+
+
+def _assess(amount: float, category: str, score: float, median: float) -> dict:
+    """Column values for one scored expense."""
+    if np.isnan(score):
+        return {"is_anomaly": False, "anomaly_score": None, "anomaly_reason": None}
+    score = round(float(score), 2)
+    flagged = score >= THRESHOLD and amount >= MIN_AMOUNT
+    reason = None
+    if flagged:
+        reason = f"{amount / median:.1f}x your usual {category} expense (median {median:.2f})" if median > 0 \
+            else f"Unusually large for {category}"
+    return {"is_anomaly": flagged, "anomaly_score": score, "anomaly_reason": reason}
+
+
+def _group_labels(*keys: np.ndarray) -> np.ndarray:
+    """Integer label that changes whenever any key changes (rows are pre-sorted)."""
+    n = len(keys[0])
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    changed = np.zeros(n, dtype=bool)
+    for k in keys:
+        changed[1:] |= k[1:] != k[:-1]
+    return np.cumsum(changed)
+
+
+# =====================================================
+# Incremental (write path)
+# =====================================================
+def _position(pivot_date: date, pivot_id: int, before: bool):
+    """Rows ordered (date, id) strictly before, or else at or after, the pivot."""
+    d, i = models.Expense.date, models.Expense.id
+    if before:
+        return or_(d < pivot_date, and_(d == pivot_date, i < pivot_id))
+    return or_(d > pivot_date, and_(d == pivot_date, i >= pivot_id))
+
+
+def _window_rows(db: Session, user_id: int, category_id: int, first: tuple, last: tuple):
+    """The ``WINDOW`` rows before ``first``, then the rows from ``first`` to ``WINDOW`` rows past ``last``."""
+    cols = (models.Expense.id, models.Expense.amount)
+    base = db.query(*cols).filter(models.Expense.user_id == user_id, models.Expense.category_id == category_id)
+    d, i = models.Expense.date, models.Expense.id
+    before = base.filter(_position(*first, before=True)).order_by(d.desc(), i.desc()).limit(WINDOW).all()
+    if first == last:
+        after = base.filter(_position(*first, before=False)).order_by(d, i).limit(WINDOW + 1).all()
+    else:
+        after = base.filter(_position(*first, before=False), _position(*last, before=True)) \
+            .order_by(d, i).all()
+        after += base.filter(_position(*last, before=False)).order_by(d, i).limit(WINDOW + 1).all()
+    return before[::-1], after
+
+
+def rescore_around(db: Session, pivots: Iterable[tuple]):
+    """
+    Rescore the expenses whose window includes one of ``pivots``, positions
+    ``(user_id, category_id, date, id)``: the row there (if any) and the
+    ``WINDOW`` rows after it. Pivots in one (user, category) are read as one
+    range and all of them are scored in one ``score_sequences`` call. Call
+    after flushing the inserts, updates or deletes. Returns the new values
+    by expense id.
+    """
+    ranges = {}
+    for user_id, category_id, pivot_date, pivot_id in pivots:
+        position = (pivot_date, pivot_id)
+        first, last = ranges.get((user_id, category_id), (position, position))
+        ranges[(user_id, category_id)] = (min(first, position), max(last, position))
+
+    amounts, groups, scored = [], [], []  # scored: (row index, expense id, amount, category_id)
+    for label, ((user_id, category_id), (first, last)) in enumerate(ranges.items()):
+        before, after = _window_rows(db, user_id, category_id, first, last)
+        offset = len(amounts)
+        amounts += [a for _, a in before + after]
+        groups += [label] * (len(before) + len(after))
+        scored += [(offset + len(before) + k, expense_id, amount, category_id)
+                   for k, (expense_id, amount) in enumerate(after)]
+    if not scored:
+        return {}
+
+    names = dict(db.query(models.Category.id, models.Category.name)
+                 .filter(models.Category.id.in_({c for *_, c in scored})).all())
+    scores, medians, _ = score_sequences(np.array(amounts, dtype=float), np.array(groups))
+    updates = {
+        expense_id: _assess(amount, names.get(category_id), scores[row], medians[row])
+        for row, expense_id, amount, category_id in scored
+    }
+    db.bulk_update_mappings(models.Expense, [{"id": k, **v} for k, v in updates.items()])
+    return updates
+
+
+# =====================================================
+# Batch Job
+# =====================================================
+def _score_chunk(args):
+    amounts, groups = args
+    scores, medians, _ = score_sequences(amounts, groups)
+    return scores, medians
+
+
+def rescore(db: Session, user_ids: Optional[Iterable[int]] = None, workers: Optional[int] = None) -> int:
+    """Rescore the full history of the given users (default: everyone). Returns rows changed."""
+    q = db.query(
+        models.Expense.id, models.Expense.user_id, models.Expense.category_id, models.Expense.amount,
+        models.Expense.is_anomaly, models.Expense.anomaly_score, models.Expense.anomaly_reason,
+        models.Category.name,
+    ).outerjoin(models.Category, models.Category.id == models.Expense.category_id)
+    if user_ids is not None:
+        q = q.filter(models.Expense.user_id.in_(list(user_ids)))
+    rows = q.order_by(
+        models.Expense.user_id, models.Expense.category_id, models.Expense.date, models.Expense.id
+    ).all()
+    if not rows:
+        return 0
+
+    owners = np.array([r[1] for r in rows])
+    amounts = np.array([r[3] for r in rows], dtype=float)
+    groups = _group_labels(owners, np.array([r[2] for r in rows], dtype=object))
+
+    # Shard on user boundaries so no (user, category) group is split
+    user_starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    bounds = list(user_starts[::CHUNK_SIZE]) + [len(rows)]
+    chunks = [(amounts[s:e], groups[s:e]) for s, e in zip(bounds, bounds[1:])]
+    if len(chunks) == 1 or workers == 1:
+        results = [_score_chunk(c) for c in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_score_chunk, chunks))
+    scores = np.concatenate([r[0] for r in results])
+    medians = np.concatenate([r[1] for r in results])
+
+    updates = []
+    for i, (expense_id, _, _, amount, is_anomaly, score, reason, category) in enumerate(rows):
+        new = _assess(amount, category, scores[i], medians[i])
+        if (new["is_anomaly"], new["anomaly_score"], new["anomaly_reason"]) != (bool(is_anomaly), score, reason):
+            updates.append({"id": expense_id, **new})
+    for i in range(0, len(updates), 1000):
+        db.bulk_update_mappings(models.Expense, updates[i:i + 1000])
+    db.commit()
+    return len(updates)
+
+
+# =====================================================
+# Reads
+# =====================================================
+def recent(db: Session, user_id: int, limit: int = 5) -> List[Dict]:
+    """Latest flagged expenses with their score and reason."""
+    rows = db.query(models.Expense).filter(
+        models.Expense.user_id == user_id,
+        models.Expense.is_anomaly == True
+    ).order_by(models.Expense.date.desc()).limit(limit).all()
+    return [
+        {
+            "id": e.id,
+            "date": e.date,
+            "description": e.description,
+            "amount": e.amount,
+            "category": e.category,
+            "is_anomaly": True,
+            "score": e.anomaly_score,
+            "reason": e.anomaly_reason,
+        }
+        for e in rows
+    ]
+
+
+if __name__ == "__main__":
+    from .shards import session_factories
+
+    parser = argparse.ArgumentParser(description="Rescore expense anomalies over full history.")
+    parser.add_argument("--user-id", type=int, action="append", default=None, help="limit to these users (repeatable)")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    count = 0
+    for open_session in session_factories():  # main file, then each tenant shard
+        session = open_session()
+        try:
+            count += rescore(session, args.user_id, args.workers)
+        finally:
+            session.close()
+    logger.info("Updated anomaly scores of %d expenses", count)
@@ -0,0 +1,272 @@
+"""
+Cold-data archival: old years move out of the hot ``expenses`` table.
+
+``archive_old`` packs each user's expenses of every calendar year older than
+``ARCHIVE_HORIZON_YEARS`` into one ``expense_archives`` row: the columns
+(ids, day offsets, amounts, dictionary-encoded categories, ...) as JSON,
+zlib-compressed. It also writes exact month x category totals to
+``archived_summaries``, then deletes the rows from ``expenses``, so
+everything that scans hot rows (the expense list, search, anomaly windows,
+the dashboard) stops paying for them.
+
+``/reports/history`` and the CSV exports read archived years transparently:
+totals from the summary rows, individual rows (exports, the daily heatmap)
+by unpacking only the years a request overlaps. Expenses back-dated into an
+archived year stay hot until the next run folds them into the archive.
+``restore`` moves a year back into ``expenses``.
+
+Anomaly windows and recurring charge series only cover hot rows, so moving
+a year either way rescores the user's anomalies and re-detects their
+recurring charges after the move commits.
+
+Run ``python -m backend.app.archive archive`` periodically (e.g. nightly).
+"""
+import argparse
+import json
+import logging
+import os
+import zlib
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_HORIZON_YEARS = int(os.environ.get("ARCHIVE_HORIZON_YEARS", "2"))  # full years kept hot before the current one
+COMPRESSION_LEVEL = 9
+
+
+class ArchivedExpense(NamedTuple):
+    """An unpacked archived expense; same attributes as ``models.Expense`` rows."""
+    id: int
+    date: date
+    description: str
+    amount: float
+    category: str
+    is_anomaly: bool
+    anomaly_score: Optional[float]
+    anomaly_reason: Optional[str]
+
+
+# =====================================================
+# Packing
+# =====================================================
+def pack(year: int, rows: List[ArchivedExpense]) -> bytes:
+    rows = sorted(rows, key=lambda r: (r.date, r.id))
+    start = date(year, 1, 1).toordinal()
+    categories = sorted({r.category for r in rows})
+    index = {c: i for i, c in enumerate(categories)}
+    columns = {
+        "id": [r.id for r in rows],
+        "day": [r.date.toordinal() - start for r in rows],
+        "amount": [r.amount for r in rows],
+        "categories": categories,
+        "category": [index[r.category] for r in rows],
+        "description": [r.description for r in rows],
+        "is_anomaly": [int(bool(r.is_anomaly)) for r in rows],
+        "anomaly_score": [r.anomaly_score for r in rows],
+        "anomaly_reason": [r.anomaly_reason for r in rows],
+    }
+    return zlib.compress(json.dumps(columns, separators=(",", ":")).encode(), COMPRESSION_LEVEL)
+
+
+def unpack(year: int, payload: bytes) -> List[ArchivedExpense]:
+    columns = json.loads(zlib.decompress(payload))
+    start = date(year, 1, 1).toordinal()
+    categories = columns["categories"]
+    return [
+        ArchivedExpense(i, date.fromordinal(start + day), desc, amount, categories[cat], bool(flag), score, reason)
+        for i, day, desc, amount, cat, flag, score, reason in zip(
+            columns["id"], columns["day"], columns["description"], columns["amount"], columns["category"],
+            columns["is_anomaly"], columns["anomaly_score"], columns["anomaly_reason"],
+        )
+    ]
+
+
+def _summaries(user_id: int, rows: Iterable[ArchivedExpense]) -> List[dict]:
+    totals = defaultdict(lambda: [0.0, 0])
+    for r in rows:
+        t = totals[(r.date.strftime("%Y-%m"), r.category)]
+        t[0] += r.amount
+        t[1] += 1
+    return [
+        {"user_id": user_id, "month": month, "category": category, "total": total, "count": count}
+        for (month, category), (total, count) in sorted(totals.items())
+    ]
+
+
+def _year_bounds(year: int) -> Tuple[date, date]:
+    return date(year, 1, 1), date(year, 12, 31)
+
+
+# =====================================================
+# Archive / Restore
+# =====================================================
+def _hot_rows_changed(db: Session, user_id: int):
+    """Rebuild what is derived from the user's hot rows (after the move committed)."""
+    from . import anomalies, recurring
+
+    anomalies.rescore(db, [user_id], workers=1)
+    recurring.detect_all(db, [user_id])
+
+
+def archive_year(db: Session, user_id: int, year: int, refresh: bool = True) -> int:
+    """
+    Move the user's hot expenses of ``year`` into its archive; returns rows
+    moved. ``refresh=False`` leaves rescoring to the caller (``archive_old``
+    does it once per user).
+    """
+    from .crud import touch_user_data
+
+    start, end = _year_bounds(year)
+    hot = db.query(models.Expense).filter(
+        models.Expense.user_id == user_id, models.Expense.date >= start, models.Expense.date <= end
+    ).all()
+    if not hot:
+        return 0
+    rows = [
+        ArchivedExpense(e.id, e.date, e.description, e.amount, e.category, bool(e.is_anomaly),
+                        e.anomaly_score, e.anomaly_reason)
+        for e in hot
+    ]
+    archive = db.query(models.ExpenseArchive).filter(
+        models.ExpenseArchive.user_id == user_id, models.ExpenseArchive.year == year
+    ).first()
+    if archive is None:
+        archive = models.ExpenseArchive(user_id=user_id, year=year)
+        db.add(archive)
+    else:
+        rows = unpack(year, archive.payload) + rows  # back-dated rows joining an archived year
+    archive.payload = pack(year, rows)
+    archive.row_count = len(rows)
+    archive.total = sum(r.amount for r in rows)
+    archive.archived_at = datetime.now()
+
+    db.query(models.ArchivedSummary).filter(
+        models.ArchivedSummary.user_id == user_id,
+        models.ArchivedSummary.month.between(f"{year}-01", f"{year}-12"),
+    ).delete(synchronize_session=False)
+    db.bulk_insert_mappings(models.ArchivedSummary, _summaries(user_id, rows))
+
+    for e in hot:
+        db.delete(e)
+    touch_user_data(db, user_id)
+    db.commit()
+    if refresh:
+        _hot_rows_changed(db, user_id)
+    return len(hot)
+
+
+def archive_old(db: Session, today: Optional[date] = None, horizon_years: int = ARCHIVE_HORIZON_YEARS,
+                user_ids: Optional[Iterable[int]] = None) -> int:
+    """Archive every (user, year) older than the horizon, one transaction each; returns rows moved."""
+    today = today or date.today()
+    cutoff = date(today.year - horizon_years, 1, 1)
+    year_col = func.cast(func.strftime("%Y", models.Expense.date), models.Integer)
+    q = db.query(models.Expense.user_id, year_col).filter(models.Expense.date < cutoff)
+    if user_ids is not None:
+        q = q.filter(models.Expense.user_id.in_(list(user_ids)))
+    moved = 0
+    touched = []
+    for user_id, year in q.distinct().order_by(models.Expense.user_id, year_col).all():
+        count = archive_year(db, user_id, year, refresh=False)
+        logger.info("Archived %d expenses of user %d for %d", count, user_id, year)
+        moved += count
+        if count and user_id not in touched:
+            touched.append(user_id)
+    for user_id in touched:
+        _hot_rows_changed(db, user_id)
+    return moved
+
+
+def restore(db: Session, user_id: int, year: int) -> int:
+    """Move an archived year back into ``expenses``; returns rows restored."""
+    from .crud import touch_user_data
+
+    archive = db.query(models.ExpenseArchive).filter(
+        models.ExpenseArchive.user_id == user_id, models.ExpenseArchive.year == year
+    ).first()
+    if archive is None:
+        return 0
+    rows = unpack(year, archive.payload)
+    taken = {i for (i,) in db.query(models.Expense.id).filter(models.Expense.id.in_([r.id for r in rows])).all()}
+    for r in rows:
+        values = r._asdict()
+        if r.id in taken:
+            del values["id"]  # id reused since archiving
+        db.add(models.Expense(user_id=user_id, **values))
+    db.query(models.ArchivedSummary).filter(
+        models.ArchivedSummary.user_id == user_id,
+        models.ArchivedSummary.month.between(f"{year}-01", f"{year}-12"),
+    ).delete(synchronize_session=False)
+    db.delete(archive)
+    touch_user_data(db, user_id)
+    db.commit()
+    _hot_rows_changed(db, user_id)
+    return len(rows)
+
+
+# =====================================================
+# Reads
+# =====================================================
+def archived_years(db: Session, user_id: int) -> List[dict]:
+    return [
+        {"year": a.year, "count": a.row_count, "total": round(a.total, 2), "archived_at": a.archived_at}
+        for a in db.query(models.ExpenseArchive).filter(
+            models.ExpenseArchive.user_id == user_id
+        ).order_by(models.ExpenseArchive.year)
+    ]
+
+
+def expenses_between(db: Session, user_id: int, start: date, end: date) -> List[ArchivedExpense]:
+    """Archived expenses dated ``start``..``end``, by date (unpacks only overlapping years)."""
+    archives = db.query(models.ExpenseArchive.year, models.ExpenseArchive.payload).filter(
+        models.ExpenseArchive.user_id == user_id,
+        models.ExpenseArchive.year >= start.year,
+        models.ExpenseArchive.year <= end.year,
+    ).order_by(models.ExpenseArchive.year).all()
+    return [r for year, payload in archives for r in unpack(year, payload) if start <= r.date <= end]
+
+
+def month_category_totals(db: Session, user_id: int, from_month: str, to_month: str) -> List[Tuple[str, str, float, int]]:
+    """(month, category, total, count) of archived expenses, like a GROUP BY over the hot table."""
+    return db.query(
+        models.ArchivedSummary.month, models.ArchivedSummary.category,
+        models.ArchivedSummary.total, models.ArchivedSummary.count,
+    ).filter(
+        models.ArchivedSummary.user_id == user_id,
+        models.ArchivedSummary.month >= from_month,
+        models.ArchivedSummary.month <= to_month,
+    ).all()
+
+
+if __name__ == "__main__":
+    from .shards import session_factories
+
+    parser = argparse.ArgumentParser(description="Archive or restore old expenses.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    arc = sub.add_parser("archive", help="archive every year older than the horizon")
+    arc.add_argument("--horizon-years", type=int, default=ARCHIVE_HORIZON_YEARS)
+    arc.add_argument("--user-id", type=int, action="append", default=None, help="limit to these users (repeatable)")
+    res = sub.add_parser("restore", help="move an archived year back into expenses")
+    res.add_argument("--user-id", type=int, required=True)
+    res.add_argument("--year", type=int, required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    count = 0
+    for open_session in session_factories():  # main file, then each tenant shard
+        session = open_session()
+        try:
+            if args.command == "archive":
+                count += archive_old(session, horizon_years=args.horizon_years, user_ids=args.user_id)
+            else:
+                count += restore(session, args.user_id, args.year)
+        finally:
+            session.close()
+    logger.info("%s %d expenses", "Archived" if args.command == "archive" else "Restored", count)
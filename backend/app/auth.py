@@ -1,8 +1,10 @@
-import httpx
 from jose import jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
+from .cache import cache
+from .metrics import track_external
+
 # Replace with your actual Clerk domain!!
 CLERK_ISSUER="https://glorious-cicada-91.clerk.accounts.dev"
 CLERK_JWKS_URL = "https://glorious-cicada-91.clerk.accounts.dev/.well-known/jwks.json"
@@ -10,19 +12,53 @@ CLERK_API_URL = "https://api.clerk.com/v1/users"
 CLERK_SECRET_KEY = "sk_test_ydR5mlLnUrufnI0RcWGRh4twj9iuIuMnh2Q5hZhVhn"
 
 security = HTTPBearer()
-jwks_cache = None
+JWKS_TTL = 3600
+CLERK_USER_TTL = 600
 
 async def get_clerk_public_keys():
-    global jwks_cache
-    if jwks_cache is None:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(CLERK_JWKS_URL)
-            resp.raise_for_status()
-            jwks_cache = resp.json()["keys"]
-    return jwks_cache
+    jwks = cache.get("jwks", "clerk")
+    if jwks is None:
+        import httpx  # slow import, only needed when the JWKS cache is cold
+        with track_external("clerk", "jwks"):
+            async with httpx.AsyncClient() as client:
+                resp = await client.get(CLERK_JWKS_URL)
+                resp.raise_for_status()
+                jwks = resp.json()["keys"]
+        cache.set("jwks", "clerk", jwks, ttl=JWKS_TTL)
+    return jwks
+
+async def get_clerk_email(clerk_user_id: str) -> str:
+    email = cache.get("clerk_user", clerk_user_id)
+    if email is None:
+        # Fetch user details from Clerk API
+        import httpx
+        with track_external("clerk", "get_user"):
+            async with httpx.AsyncClient() as client:
+                headers = {"Authorization": f"Bearer {CLERK_SECRET_KEY}"}
+                resp = await client.get(f"{CLERK_API_URL}/{clerk_user_id}", headers=headers)
+                resp.raise_for_status()
+                user_data = resp.json()
+
+        # extract email from user_data
+        email = user_data.get("email_addresses")[0].get("email_address")
+        cache.set("clerk_user", clerk_user_id, email, ttl=CLERK_USER_TTL)
+    return email
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
+    return await verify_token(credentials.credentials)
+
+async def get_current_user_for_stream(
+    token: str = Query(None),
+    credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer(auto_error=False)),
+):
+    # EventSource cannot send headers, so streams also accept ?token=
+    if credentials:
+        return await verify_token(credentials.credentials)
+    if token:
+        return await verify_token(token)
+    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+
+async def verify_token(token: str):
     headers = jwt.get_unverified_header(token)
     jwks = await get_clerk_public_keys()
 
@@ -39,16 +75,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         # Verify jwt
         payload = jwt.decode(token, key, issuer=CLERK_ISSUER, algorithms=["RS256"])
         clerk_user_id = payload["sub"]
-
-        # Fetch user details from Clerk API
-        async with httpx.AsyncClient() as client:
-            headers = {"Authorization": f"Bearer {CLERK_SECRET_KEY}"}
-            resp = await client.get(f"{CLERK_API_URL}/{clerk_user_id}", headers=headers)
-            resp.raise_for_status()
-            user_data = resp.json()
-
-        # extract email from user_data
-        email = user_data.get("email_addresses")[0].get("email_address")
+        email = await get_clerk_email(clerk_user_id)
 
         return {"clerk_id": payload["sub"], "email": email}
     except Exception as e:
@@ -0,0 +1,501 @@
+"""
+Shared cache with pluggable backends.
+
+``cache`` is configured from ``CACHE_URL``:
+
+- ``memory://?max_entries=10000`` (default): in-process LRU. Each worker has
+  its own copy, so only suitable for a single worker.
+- ``redis://[:password@]host:port/db``: any server speaking the Redis
+  protocol, shared by all workers. ``python -m backend.app.cache --port 6380``
+  runs a small in-memory stand-in for local development.
+
+Values are stored as JSON under ``<prefix>:<namespace>:<key>``. Per-user
+entries also carry the user's generation number, so
+``invalidate_user`` (one INCR) makes all of a user's entries unreachable on
+every worker at once. ``crud.touch_user_data`` marks users changed and they
+are invalidated when the session commits. ``get_or_set`` lets only one
+caller per key compute a missing value, within a process and across workers.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from sqlalchemy import event
+
+from .metrics import counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = float(os.environ.get("CACHE_TTL", "300"))
+LOCK_TTL = 10.0  # seconds a computing worker holds a key's lock at most
+LOCK_WAIT = 2.0  # seconds other workers wait for it before computing themselves
+
+CACHE_REQUESTS = counter("cache_requests_total", "Cache lookups.", ("namespace", "result"))
+
+_MISSING = object()
+
+
+class CacheError(Exception):
+    pass
+
+
+# =====================================================
+# Backends
+# =====================================================
+class CacheBackend:
+    """Raw string store. Errors raise ``OSError`` or ``CacheError``."""
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def incr(self, key: str) -> int:
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[Optional[float], str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires is not None and expires <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key):
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key, value, ttl=None, nx=False):
+        with self._lock:
+            if nx and self._live(key) is not None:
+                return False
+            self._data[key] = (time.monotonic() + ttl if ttl else None, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._live(key) or 0) + 1
+            expires = self._data[key][0] if key in self._data else None
+            self._data[key] = (expires, str(value))
+            return value
+
+    def expire(self, key, ttl):
+        with self._lock:
+            value = self._live(key)
+            if value is None:
+                return False
+            self._data[key] = (time.monotonic() + ttl, value)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisBackend(CacheBackend):
+    """Minimal RESP client; one connection per thread."""
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0,
+                 password: Optional[str] = None, timeout: float = 0.5):
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.sock, self._local.reader = sock, sock.makefile("rb")
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.db:
+            self._send("SELECT", self.db)
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = self._local.reader = None
+
+    def _send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._local.sock.sendall(b"".join(parts))
+        return self._read()
+
+    def _read(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by cache server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise CacheError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._local.reader.read(length + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise CacheError(f"Unexpected reply: {line!r}")
+
+    def command(self, *args):
+        for attempt in (1, 2):
+            try:
+                if getattr(self._local, "sock", None) is None:
+                    self._connect()
+                return self._send(*args)
+            except OSError:
+                self._close()
+                if attempt == 2:
+                    raise
+
+    def get(self, key):
+        return self.command("GET", key)
+
+    def set(self, key, value, ttl=None, nx=False):
+        args = ["SET", key, value]
+        if ttl:
+            args += ["PX", int(ttl * 1000)]
+        if nx:
+            args.append("NX")
+        return self.command(*args) == "OK"
+
+    def delete(self, key):
+        self.command("DEL", key)
+
+    def incr(self, key):
+        return self.command("INCR", key)
+
+    def clear(self):
+        self.command("FLUSHDB")
+
+
+def backend_from_url(url: str) -> CacheBackend:
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        params = parse_qs(parsed.query)
+        return MemoryBackend(int(params.get("max_entries", ["10000"])[0]))
+    if parsed.scheme == "redis":
+        db = int(parsed.path.lstrip("/") or 0)
+        return RedisBackend(parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password)
+    raise ValueError(f"Unsupported CACHE_URL scheme: {parsed.scheme}")
+
+
+# =====================================================
+# Cache
+# =====================================================
+class Cache:
+    def __init__(self, backend: CacheBackend, prefix: str = "et", default_ttl: float = DEFAULT_TTL):
+        self.backend = backend
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self._locks: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+        self._locks_guard = threading.Lock()
+
+    # --- keys ---
+    def _generation(self, user_id: int) -> str:
+        return self.backend.get(f"{self.prefix}:gen:u{user_id}") or "0"
+
+    def _key(self, namespace: str, key: str, user_id: Optional[int]) -> str:
+        if user_id is None:
+            return f"{self.prefix}:{namespace}:{key}"
+        return f"{self.prefix}:u{user_id}.{self._generation(user_id)}:{namespace}:{key}"
+
+    # --- raw access, failures degrade to misses ---
+    def _load(self, namespace: str, full_key: str):
+        try:
+            raw = self.backend.get(full_key)
+        except (OSError, CacheError) as e:
+            logger.warning("Cache get failed: %s", e)
+            CACHE_REQUESTS.inc(namespace=namespace, result="error")
+            return _MISSING
+        CACHE_REQUESTS.inc(namespace=namespace, result="miss" if raw is None else "hit")
+        return _MISSING if raw is None else json.loads(raw)
+
+    def _store(self, full_key: str, value, ttl: Optional[float]):
+        try:
+            self.backend.set(full_key, json.dumps(value, default=str), ttl or self.default_ttl)
+        except (OSError, CacheError) as e:
+            logger.warning("Cache set failed: %s", e)
+
+    def _resolve(self, namespace: str, key: str, user_id: Optional[int]) -> Optional[str]:
+        try:
+            return self._key(namespace, key, user_id)
+        except (OSError, CacheError) as e:
+            logger.warning("Cache unavailable: %s", e)
+            CACHE_REQUESTS.inc(namespace=namespace, result="error")
+            return None
+
+    # --- public API ---
+    def generation(self, user_id: int) -> Optional[str]:
+        """The user's invalidation counter, bumped by every committed write; None if unavailable."""
+        try:
+            return self._generation(user_id)
+        except (OSError, CacheError) as e:
+            logger.warning("Cache unavailable: %s", e)
+            return None
+
+    def get(self, namespace: str, key: str, default=None, user_id: Optional[int] = None):
+        full_key = self._resolve(namespace, key, user_id)
+        value = _MISSING if full_key is None else self._load(namespace, full_key)
+        return default if value is _MISSING else value
+
+    def set(self, namespace: str, key: str, value, ttl: Optional[float] = None, user_id: Optional[int] = None):
+        full_key = self._resolve(namespace, key, user_id)
+        if full_key is not None:
+            self._store(full_key, value, ttl)
+
+    def delete(self, namespace: str, key: str, user_id: Optional[int] = None):
+        full_key = self._resolve(namespace, key, user_id)
+        try:
+            if full_key is not None:
+                self.backend.delete(full_key)
+        except (OSError, CacheError) as e:
+            logger.warning("Cache delete failed: %s", e)
+
+    def _local_lock(self, full_key: str) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._locks.get(full_key)
+            if lock is None:
+                lock = self._locks[full_key] = threading.Lock()
+            return lock
+
+    def get_or_set(self, namespace: str, key: str, compute: Callable[[], Any],
+                   ttl: Optional[float] = None, user_id: Optional[int] = None):
+        """
+        Cached value, or ``compute()`` stored for ``ttl`` seconds. Concurrent
+        misses on the same key wait for the first caller instead of all
+        computing it (stampede protection); the value must be JSON-serializable.
+        """
+        full_key = self._resolve(namespace, key, user_id)
+        if full_key is None:
+            return compute()
+        value = self._load(namespace, full_key)
+        if value is not _MISSING:
+            return value
+
+        with self._local_lock(full_key):
+            value = self._load(namespace, full_key)
+            if value is not _MISSING:
+                return value
+            lock_key = full_key + ":lock"
+            try:
+                owner = self.backend.set(lock_key, "1", LOCK_TTL, nx=True)
+            except (OSError, CacheError):
+                owner = True
+            if not owner:
+                # Another worker is computing it; wait a little for its result
+                deadline = time.monotonic() + LOCK_WAIT
+                while time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    value = self._load(namespace, full_key)
+                    if value is not _MISSING:
+                        return value
+            try:
+                value = compute()
+                self._store(full_key, value, ttl)
+            finally:
+                if owner:
+                    try:
+                        self.backend.delete(lock_key)
+                    except (OSError, CacheError):
+                        pass
+            return value
+
+    def claim(self, namespace: str, key: str, ttl: float) -> bool:
+        """
+        Mark ``key`` as used for ``ttl`` seconds. True only for the first
+        caller (across workers with a shared backend); False if the key was
+        already claimed or the backend is unavailable.
+        """
+        try:
+            return bool(self.backend.set(self._key(namespace, key, None), "1", ttl, nx=True))
+        except (OSError, CacheError) as e:
+            logger.warning("Cache claim failed: %s", e)
+            return False
+
+    def invalidate_user(self, user_id: int):
+        try:
+            self.backend.incr(f"{self.prefix}:gen:u{user_id}")
+        except (OSError, CacheError) as e:
+            logger.warning("Cache invalidation failed for user %s: %s", user_id, e)
+
+    def clear(self):
+        self.backend.clear()
+
+
+cache = Cache(backend_from_url(os.environ.get("CACHE_URL", "memory://")))
+
+
+def set_backend(backend: CacheBackend):
+    cache.backend = backend
+
+
+# =====================================================
+# Invalidation on commit
+# =====================================================
+def mark_user_changed(db, user_id: int):
+    """Invalidate the user's cached entries once ``db`` commits."""
+    db.info.setdefault("cache_changed_users", set()).add(user_id)
+
+
+def _after_commit(session):
+    for user_id in session.info.pop("cache_changed_users", ()):
+        cache.invalidate_user(user_id)
+
+
+def _after_rollback(session):
+    session.info.pop("cache_changed_users", None)
+
+
+def track_sessions(session_factory):
+    if not event.contains(session_factory, "after_commit", _after_commit):
+        event.listen(session_factory, "after_commit", _after_commit)
+        event.listen(session_factory, "after_rollback", _after_rollback)
+
+
+# =====================================================
+# Local Stand-in Server
+# =====================================================
+class StandInServer:
+    """Redis-protocol server over a MemoryBackend (GET/SET/DEL/INCR/EXPIRE/FLUSHDB)."""
+
+    def __init__(self, max_entries: int = 100000):
+        self.store = MemoryBackend(max_entries)
+
+    @staticmethod
+    def _encode(reply) -> bytes:
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, bool):
+            return b":%d\r\n" % int(reply)
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, Exception):
+            return f"-ERR {reply}\r\n".encode()
+        if reply == "OK" or reply == "PONG":
+            return f"+{reply}\r\n".encode()
+        data = reply.encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def execute(self, args):
+        cmd = args[0].upper()
+        store = self.store
+        if cmd == "PING":
+            return "PONG"
+        if cmd in ("SELECT", "AUTH"):
+            return "OK"
+        if cmd == "GET":
+            return store.get(args[1])
+        if cmd == "SET":
+            ttl, nx, opts = None, False, [a.upper() for a in args[3:]]
+            for i, opt in enumerate(opts):
+                if opt == "EX":
+                    ttl = float(args[4 + i])
+                elif opt == "PX":
+                    ttl = float(args[4 + i]) / 1000
+                elif opt == "NX":
+                    nx = True
+            return "OK" if store.set(args[1], args[2], ttl, nx) else None
+        if cmd == "DEL":
+            count = 0
+            for key in args[1:]:
+                count += store.get(key) is not None
+                store.delete(key)
+            return count
+        if cmd == "INCR":
+            return store.incr(args[1])
+        if cmd == "EXPIRE":
+            return store.expire(args[1], float(args[2]))
+        if cmd == "FLUSHDB":
+            store.clear()
+            return "OK"
+        return CacheError(f"unknown command '{cmd}'")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.startswith(b"*"):
+                    args = line.decode().split()  # inline command (redis-cli / telnet)
+                else:
+                    args = []
+                    for _ in range(int(line[1:-2])):
+                        length = int((await reader.readline())[1:-2])
+                        args.append((await reader.readexactly(length + 2))[:-2].decode())
+                if not args:
+                    continue
+                try:
+                    reply = self.execute(args)
+                except (IndexError, ValueError) as e:
+                    reply = CacheError(str(e) or "syntax error")
+                writer.write(self._encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 6380):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local Redis-protocol stand-in for CACHE_URL=redis://...")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Cache stand-in listening on %s:%d", args.host, args.port)
+    asyncio.run(StandInServer().serve(args.host, args.port))
@@ -0,0 +1,372 @@
+"""
+Category catalog: integer category ids, per-user aliases and groups.
+
+``Expense.category`` stays the text the user typed (what the API returns,
+search indexes and exports write). Every expense also carries a
+``category_id`` into ``categories``, set whenever the ORM flushes it, by
+resolving the normalized text (trimmed, lowercased) in this order:
+
+1. the user's aliases (``PUT /categories/aliases``),
+2. the user's own categories,
+3. the built-in aliases ("grocery", "dining", "misc", ...),
+4. the built-in categories.
+
+Text that resolves nowhere becomes a new category of that user, so "food",
+"Food " and "FOOD" share one id while "Pets" is created on first use.
+
+Categories form a one-level hierarchy: a category either is a group (its
+``group_id`` is NULL) or belongs to one, e.g. Food -> Groceries,
+Restaurants. Analytics group and filter by id (``ix_expenses_user_category``
+for anomaly windows, ``ix_expenses_user_date_category`` for date-range
+rollups) and show canonical names through a user's ``Catalog``;
+``group_totals`` is the per-group rollup as one indexed query.
+
+``install`` seeds the built-ins and backfills ``category_id`` of rows
+written before the column existed (see the startup migration in main.py).
+"""
+import logging
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, func, inspect, text
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_NAME = "Other"
+
+# Built-in categories: group -> members (a group is a category too)
+BUILTIN_GROUPS: Dict[str, Tuple[str, ...]] = {
+    "Food": ("Groceries", "Restaurants"),
+    "Transport": (),
+    "Entertainment": (),
+    "Shopping": (),
+    "Rent": (),
+    "Utilities": (),
+    "Health": (),
+    "Other": (),
+}
+BUILTIN_ALIASES: Dict[str, str] = {
+    "grocery": "Groceries", "supermarket": "Groceries",
+    "restaurant": "Restaurants", "dining": "Restaurants", "eating out": "Restaurants", "takeout": "Restaurants",
+    "transportation": "Transport", "travel": "Transport",
+    "movies": "Entertainment", "fun": "Entertainment",
+    "medical": "Health", "fitness": "Health",
+    "misc": "Other", "miscellaneous": "Other", "uncategorized": "Other", "general": "Other",
+}
+
+_INDEXES = (
+    # One category / alias per owner; built-ins (user_id NULL) count as owner 0
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_categories_owner_key ON categories (coalesce(user_id, 0), key)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_category_aliases_owner_alias "
+    "ON category_aliases (coalesce(user_id, 0), alias)",
+)
+_EXPENSE_INDEXES = (
+    # Per-category history in (date, id) order, read by anomaly scoring on every write
+    "CREATE INDEX IF NOT EXISTS ix_expenses_user_category ON expenses (user_id, category_id, date, id)",
+    # Date-range rollups by category or group, answered from the index alone
+    "CREATE INDEX IF NOT EXISTS ix_expenses_user_date_category ON expenses (user_id, date, category_id, amount)",
+)
+# Superseded by ix_expenses_user_category
+_DROPPED = ("DROP INDEX IF EXISTS ix_expenses_user_category_date",)
+
+_RESOLVE = text("""
+    SELECT category_id FROM (
+        SELECT category_id, CASE WHEN user_id IS NULL THEN 2 ELSE 0 END AS rank
+        FROM category_aliases WHERE coalesce(user_id, 0) IN (0, :uid) AND alias = :key
+        UNION ALL
+        SELECT id, CASE WHEN user_id IS NULL THEN 3 ELSE 1 END
+        FROM categories WHERE coalesce(user_id, 0) IN (0, :uid) AND key = :key
+    ) ORDER BY rank LIMIT 1
+""")
+_CREATE = text("INSERT OR IGNORE INTO categories (user_id, key, name) VALUES (:uid, :key, :name)")
+_OWN = text("SELECT id FROM categories WHERE coalesce(user_id, 0) = :uid AND key = :key")
+
+
+def normalize(name: Optional[str]) -> str:
+    return (name or "").strip().lower()
+
+
+# =====================================================
+# Resolution (write path)
+# =====================================================
+def resolve(conn, user_id: int, name: Optional[str]) -> int:
+    """Category id of ``name`` for the user, creating a user category if nothing matches."""
+    key = normalize(name) or normalize(FALLBACK_NAME)
+    found = conn.execute(_RESOLVE, {"uid": user_id, "key": key}).scalar()
+    if found is None:
+        conn.execute(_CREATE, {"uid": user_id, "key": key, "name": (name or "").strip() or FALLBACK_NAME})
+        found = conn.execute(_OWN, {"uid": user_id, "key": key}).scalar()
+    return found
+
+
+def _set_category_id(mapper, connection, target):
+    target.category_id = resolve(connection, target.user_id, target.category)
+
+
+def _reset_category_id(mapper, connection, target):
+    history = inspect(target).attrs.category.history
+    if history.has_changes() or target.category_id is None:
+        _set_category_id(mapper, connection, target)
+
+
+event.listen(models.Expense, "before_insert", _set_category_id)
+event.listen(models.Expense, "before_update", _reset_category_id)
+
+
+def install(engine):
+    """
+    Seed the built-in catalog, create the indexes and resolve rows written
+    before ``expenses.category_id`` existed. Expense indexes and the backfill
+    wait until the column exists (see the startup migration in main.py).
+    """
+    with engine.begin() as conn:
+        for ddl in _INDEXES:
+            conn.execute(text(ddl))
+        for group, members in BUILTIN_GROUPS.items():
+            conn.execute(_CREATE, {"uid": None, "key": normalize(group), "name": group})
+            group_id = conn.execute(_OWN, {"uid": 0, "key": normalize(group)}).scalar()
+            for member in members:
+                conn.execute(_CREATE, {"uid": None, "key": normalize(member), "name": member})
+                conn.execute(
+                    text("UPDATE categories SET group_id = :gid WHERE user_id IS NULL AND key = :key"),
+                    {"gid": group_id, "key": normalize(member)},
+                )
+        for alias, name in BUILTIN_ALIASES.items():
+            conn.execute(
+                text("INSERT OR IGNORE INTO category_aliases (user_id, alias, category_id) "
+                     "SELECT NULL, :alias, id FROM categories WHERE user_id IS NULL AND key = :key"),
+                {"alias": alias, "key": normalize(name)},
+            )
+
+        columns = {row[1] for row in conn.execute(text("PRAGMA table_info(expenses)"))}
+        if "category_id" not in columns:
+            return
+        for ddl in _DROPPED + _EXPENSE_INDEXES:
+            conn.execute(text(ddl))
+        rows = conn.execute(text("SELECT id, user_id, category FROM expenses WHERE category_id IS NULL")).all()
+        memo: Dict[Tuple[int, str], int] = {}
+        for _, uid, category in rows:
+            if (uid, category) not in memo:
+                memo[(uid, category)] = resolve(conn, uid, category)
+        if rows:
+            conn.execute(
+                text("UPDATE expenses SET category_id = :cid WHERE id = :id"),
+                [{"cid": memo[(uid, category)], "id": i} for i, uid, category in rows],
+            )
+            logger.info("Resolved category ids of %d expenses", len(rows))
+
+
+# =====================================================
+# Catalog (read path)
+# =====================================================
+class Catalog:
+    """One user's view of the catalog: the built-ins plus their own categories and aliases."""
+
+    def __init__(self, categories: Iterable, aliases: Iterable):
+        self.names: Dict[int, str] = {}
+        self.keys: Dict[int, str] = {}
+        self.groups: Dict[int, int] = {}  # category id -> its group's id (a group maps to itself)
+        self.owned: Set[int] = set()
+        ranked: Dict[str, Tuple[int, int]] = {}
+        for cid, owner, key, name, group_id in categories:
+            self.names[cid], self.keys[cid] = name, key
+            self.groups[cid] = group_id or cid
+            if owner is not None:
+                self.owned.add(cid)
+            self._rank(ranked, key, 3 if owner is None else 1, cid)
+        for owner, alias, cid in aliases:
+            self._rank(ranked, alias, 2 if owner is None else 0, cid)
+        self._by_key = {key: cid for key, (_, cid) in ranked.items()}
+
+    @staticmethod
+    def _rank(ranked: Dict[str, Tuple[int, int]], key: str, rank: int, cid: int):
+        # Same precedence as ``resolve``
+        if key not in ranked or rank < ranked[key][0]:
+            ranked[key] = (rank, cid)
+
+    def resolve(self, name: Optional[str]) -> Optional[int]:
+        return self._by_key.get(normalize(name))
+
+    def name(self, category_id: Optional[int]) -> str:
+        return self.names.get(category_id, FALLBACK_NAME)
+
+    def canonical(self, name: str) -> str:
+        """Canonical name of ``name``, or ``name`` itself if it does not resolve."""
+        category_id = self.resolve(name)
+        return name if category_id is None else self.name(category_id)
+
+    def group(self, category_id: int) -> int:
+        return self.groups.get(category_id, category_id)
+
+    def members(self, *groups: str) -> Set[int]:
+        """Ids of the categories in the named groups (the groups included)."""
+        group_ids = {self.resolve(g) for g in groups} - {None}
+        return {cid for cid, gid in self.groups.items() if gid in group_ids}
+
+    def by_name(self, totals: Dict[Optional[int], float]) -> Dict[str, float]:
+        """Totals keyed by category id, re-keyed by canonical name."""
+        out: Dict[str, float] = {}
+        for cid, amount in totals.items():
+            out[self.name(cid)] = out.get(self.name(cid), 0.0) + amount
+        return out
+
+
+def load(db: Session, user_id: int) -> Catalog:
+    owner = func.coalesce(models.Category.user_id, 0).in_([0, user_id])
+    categories = db.query(
+        models.Category.id, models.Category.user_id, models.Category.key, models.Category.name,
+        models.Category.group_id,
+    ).filter(owner).all()
+    aliases = db.query(
+        models.CategoryAlias.user_id, models.CategoryAlias.alias, models.CategoryAlias.category_id,
+    ).filter(func.coalesce(models.CategoryAlias.user_id, 0).in_([0, user_id])).all()
+    return Catalog(categories, aliases)
+
+
+def describe(db: Session, user_id: int) -> List[dict]:
+    """Every category the user sees, groups first, with its aliases."""
+    catalog = load(db, user_id)
+    aliases: Dict[int, List[str]] = {}
+    for key, cid in catalog._by_key.items():
+        if key != catalog.keys.get(cid):
+            aliases.setdefault(cid, []).append(key)
+    return [
+        {
+            "id": cid, "name": catalog.name(cid),
+            "group_id": None if catalog.group(cid) == cid else catalog.group(cid),
+            "group": catalog.name(catalog.group(cid)),
+            "builtin": cid not in catalog.owned,
+            "aliases": sorted(aliases.get(cid, [])),
+        }
+        for cid in sorted(catalog.names, key=lambda c: (catalog.name(catalog.group(c)), catalog.group(c) != c, catalog.name(c)))
+    ]
+
+
+def group_totals(db: Session, user_id: int, start: date, end: date) -> List[dict]:
+    """Spend per group (a group's own rows plus its members') over ``start``..``end``, largest first."""
+    group_col = func.coalesce(models.Category.group_id, models.Category.id)
+    rows = db.query(group_col, func.sum(models.Expense.amount), func.count(models.Expense.id)).join(
+        models.Category, models.Category.id == models.Expense.category_id
+    ).filter(
+        models.Expense.user_id == user_id,
+        models.Expense.date >= start,
+        models.Expense.date <= end,
+    ).group_by(group_col).all()
+    catalog = load(db, user_id)
+    return sorted(
+        ({"group_id": gid, "group": catalog.name(gid), "total": round(total, 2), "count": count}
+         for gid, total, count in rows),
+        key=lambda g: -g["total"],
+    )
+
+
+# =====================================================
+# User Changes
+# =====================================================
+def _repoint(db: Session, user_id: int, keys: Set[str], category_id: int) -> int:
+    """Point the user's expenses whose text normalizes to one of ``keys`` at ``category_id``."""
+    texts = [c for (c,) in db.query(models.Expense.category).filter(
+        models.Expense.user_id == user_id).distinct() if normalize(c) in keys]
+    if not texts:
+        return 0
+    return db.query(models.Expense).filter(
+        models.Expense.user_id == user_id, models.Expense.category.in_(texts),
+        models.Expense.category_id != category_id,
+    ).update({models.Expense.category_id: category_id}, synchronize_session=False)
+
+
+def _changed(db: Session, user_id: int, moved: int):
+    from .crud import touch_user_data
+
+    touch_user_data(db, user_id)
+    db.commit()
+    if moved:
+        # Moved rows change the category histories anomalies are scored against
+        from . import anomalies
+        anomalies.rescore(db, [user_id], workers=1)
+
+
+def set_alias(db: Session, user_id: int, alias: str, category: str) -> dict:
+    """Make ``alias`` mean ``category`` for the user and re-point their matching expenses."""
+    key = normalize(alias)
+    if not key:
+        raise ValueError("Alias must not be empty")
+    category_id = load(db, user_id).resolve(category)
+    if category_id is None:
+        raise ValueError(f"Unknown category: {category}")
+    db.query(models.CategoryAlias).filter(
+        models.CategoryAlias.user_id == user_id, models.CategoryAlias.alias == key
+    ).delete(synchronize_session=False)
+    db.add(models.CategoryAlias(user_id=user_id, alias=key, category_id=category_id))
+    moved = _repoint(db, user_id, {key}, category_id)
+    _changed(db, user_id, moved)
+    return {"alias": key, "category_id": category_id, "expenses_moved": moved}
+
+
+def set_group(db: Session, user_id: int, category: str, group: Optional[str]) -> dict:
+    """Put one of the user's own categories into a group (None: make it a group of its own)."""
+    catalog = load(db, user_id)
+    category_id = catalog.resolve(category)
+    if category_id is None:
+        raise ValueError(f"Unknown category: {category}")
+    if category_id not in catalog.owned:
+        raise ValueError(f"{catalog.name(category_id)} is built in; only your own categories can be regrouped")
+    group_id = None
+    if group is not None:
+        group_id = catalog.resolve(group)
+        if group_id is None or catalog.group(group_id) != group_id:
+            raise ValueError(f"Unknown group: {group}")
+        if group_id == category_id or any(catalog.group(c) == category_id for c in catalog.names if c != category_id):
+            raise ValueError("Groups are one level deep")
+    db.query(models.Category).filter(models.Category.id == category_id).update(
+        {models.Category.group_id: group_id}, synchronize_session=False
+    )
+    _changed(db, user_id, 0)
+    return {"id": category_id, "name": catalog.name(category_id), "group_id": group_id}
+
+
+# =====================================================
+# Shard Moves
+# =====================================================
+def copy_for_user(src, dst, user_id: int) -> Dict[int, int]:
+    """
+    Recreate the user's categories and aliases in another database file
+    (connections of a shard move); returns source -> target category ids for
+    every category the user's rows may reference.
+    """
+    own = src.execute(
+        text("SELECT id, key, name, group_id FROM categories WHERE user_id = :uid ORDER BY group_id IS NOT NULL"),
+        {"uid": user_id},
+    ).all()
+    dst.execute(text("DELETE FROM category_aliases WHERE user_id = :uid"), {"uid": user_id})
+    dst.execute(text("DELETE FROM categories WHERE user_id = :uid"), {"uid": user_id})
+    id_map = {
+        old: new for old, new in (
+            (s, dst.execute(_OWN, {"uid": 0, "key": key}).scalar())
+            for s, key in src.execute(text("SELECT id, key FROM categories WHERE user_id IS NULL"))
+        ) if new is not None
+    }
+    for old, key, name, _ in own:
+        dst.execute(_CREATE, {"uid": user_id, "key": key, "name": name})
+        id_map[old] = dst.execute(_OWN, {"uid": user_id, "key": key}).scalar()
+    for old, _, _, group_id in own:
+        if group_id is not None:
+            dst.execute(text("UPDATE categories SET group_id = :gid WHERE id = :id"),
+                        {"gid": id_map.get(group_id), "id": id_map[old]})
+    aliases = src.execute(
+        text("SELECT alias, category_id FROM category_aliases WHERE user_id = :uid"), {"uid": user_id}
+    ).all()
+    if aliases:
+        dst.execute(
+            text("INSERT INTO category_aliases (user_id, alias, category_id) VALUES (:uid, :alias, :cid)"),
+            [{"uid": user_id, "alias": a, "cid": id_map[c]} for a, c in aliases if c in id_map],
+        )
+    return id_map
+
+
+def delete_for_user(conn, user_id: int):
+    conn.execute(text("DELETE FROM category_aliases WHERE user_id = :uid"), {"uid": user_id})
+    conn.execute(text("DELETE FROM categories WHERE user_id = :uid"), {"uid": user_id})
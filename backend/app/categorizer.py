@@ -0,0 +1,219 @@
+"""
+Automatic expense categorization from merchant / keyword dictionaries.
+
+The keyword -> category dictionary is compiled once into an Aho-Corasick
+automaton, so matching a description costs time linear in its length no
+matter how many keywords the dictionary holds. Used to fill in a category on
+``POST /expenses/`` when none is given, to suggest one for scanned receipts,
+and by the bulk ``recategorize`` job (``python -m backend.app.categorizer``).
+
+Keywords match whole words only ("bus" does not match "business"). A
+keyword ending in ``*`` also matches as a word prefix ("restaurant*" matches
+"restaurants", "mcdonald*" matches "mcdonalds").
+"""
+import argparse
+import json
+import logging
+import os
+from collections import defaultdict, deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import categories, models
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_CATEGORY = "Other"
+# Categories the bulk job treats as "not really categorized"
+UNCATEGORIZED = {"", "other", "misc", "uncategorized", "general"}
+
+DEFAULT_KEYWORDS: Dict[str, str] = {
+    # Food & drink
+    "starbucks": "Food", "coffee": "Food", "cafe": "Food", "restaurant*": "Restaurants",
+    "mcdonald*": "Restaurants", "burger*": "Restaurants", "pizza*": "Restaurants", "kfc": "Restaurants",
+    "subway": "Restaurants", "domino*": "Restaurants", "sushi": "Restaurants", "lunch": "Food",
+    "dinner": "Food", "breakfast": "Food", "bakery": "Food", "swiggy": "Food", "zomato": "Food",
+    "doordash": "Food", "ubereats": "Food", "grubhub": "Food",
+    # Groceries
+    "grocery": "Groceries", "groceries": "Groceries", "supermarket": "Groceries", "walmart": "Groceries",
+    "costco": "Groceries", "aldi": "Groceries", "lidl": "Groceries", "kroger": "Groceries",
+    "tesco": "Groceries", "whole foods": "Groceries", "trader joe": "Groceries", "bigbasket": "Groceries",
+    # Transport
+    "uber": "Transport", "lyft": "Transport", "ola": "Transport", "taxi": "Transport", "metro": "Transport",
+    "bus": "Transport", "train": "Transport", "fuel": "Transport", "petrol": "Transport", "gas station": "Transport",
+    "parking": "Transport", "shell": "Transport",
+    # Entertainment & subscriptions
+    "netflix": "Entertainment", "spotify": "Entertainment", "prime video": "Entertainment", "hulu": "Entertainment",
+    "disney": "Entertainment", "cinema*": "Entertainment", "movie*": "Entertainment", "steam": "Entertainment",
+    "playstation": "Entertainment", "concert*": "Entertainment",
+    # Shopping
+    "amazon": "Shopping", "flipkart": "Shopping", "ebay": "Shopping", "ikea": "Shopping", "zara": "Shopping",
+    "h&m": "Shopping", "nike": "Shopping", "mall": "Shopping",
+    # Bills & housing
+    "rent": "Rent", "electricity": "Utilities", "water bill": "Utilities", "internet": "Utilities",
+    "broadband": "Utilities", "phone bill": "Utilities", "recharge": "Utilities",
+    # Health
+    "pharmacy": "Health", "doctor": "Health", "hospital": "Health", "gym": "Health", "clinic": "Health",
+}
+
+
+# =====================================================
+# Aho-Corasick Automaton
+# =====================================================
+class KeywordAutomaton:
+    def __init__(self, keywords: Dict[str, Any]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Per state: (keyword length, value) of every keyword ending here
+        self._out: List[List[Tuple[int, Any]]] = [[]]
+        for keyword, value in keywords.items():
+            self._add(keyword.lower(), value)
+        self._build_failure_links()
+
+    def __len__(self):
+        return len(self._goto)
+
+    def _add(self, keyword: str, value: Any):
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][ch] = nxt
+            state = nxt
+        self._out[state].append((len(keyword), value))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0) if self._goto[f].get(ch) != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """Yield ``(start, end, value)`` for every keyword occurrence in ``text``."""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for length, value in out[state]:
+                    yield i - length + 1, i + 1, value
+
+
+# =====================================================
+# Categorizer
+# =====================================================
+class Categorizer:
+    def __init__(self, keywords: Optional[Dict[str, str]] = None):
+        # keyword -> (category, matches as a prefix)
+        self.automaton = KeywordAutomaton({
+            keyword.rstrip("*"): (category, keyword.endswith("*"))
+            for keyword, category in (keywords or DEFAULT_KEYWORDS).items()
+        })
+
+    def scores(self, description: str) -> Dict[str, int]:
+        """Matched keyword characters per category (whole words, or word prefixes for ``*`` keywords)."""
+        text = description.lower()
+        scores = defaultdict(int)
+        for start, end, (category, prefix) in self.automaton.iter_matches(text):
+            if start > 0 and text[start - 1].isalnum():
+                continue  # starts mid-word
+            if not prefix and end < len(text) and text[end].isalnum():
+                continue  # "bus" in "business"
+            scores[category] += end - start
+        return scores
+
+    def suggest(self, description: Optional[str]) -> Optional[str]:
+        if not description:
+            return None
+        scores = self.scores(description)
+        return max(scores, key=scores.get) if scores else None
+
+
+def _load_keywords() -> Dict[str, str]:
+    keywords = dict(DEFAULT_KEYWORDS)
+    extra = os.environ.get("CATEGORY_KEYWORDS_FILE")
+    if extra and os.path.exists(extra):
+        with open(extra) as f:
+            keywords.update(json.load(f))
+    return keywords
+
+
+categorizer = Categorizer(_load_keywords())
+
+
+def suggest_category(description: Optional[str]) -> Optional[str]:
+    return categorizer.suggest(description)
+
+
+# =====================================================
+# Bulk Recategorize Job
+# =====================================================
+def recategorize(db: Session, user_id: Optional[int] = None, overwrite: bool = False,
+                 batch_size: int = 1000) -> int:
+    """
+    Re-run suggestions over stored expenses. By default only rows in a
+    placeholder category (Other, Misc, ...) are changed; ``overwrite``
+    replaces every category the dictionary has an opinion on.
+    """
+    from .crud import touch_user_data
+
+    q = db.query(models.Expense.id, models.Expense.user_id, models.Expense.description, models.Expense.category)
+    if user_id is not None:
+        q = q.filter(models.Expense.user_id == user_id)
+
+    updates = []
+    touched = set()
+    category_ids = {}
+    for expense_id, owner_id, description, category in q.yield_per(batch_size):
+        if not overwrite and (category or "").strip().lower() not in UNCATEGORIZED:
+            continue
+        suggestion = categorizer.suggest(description)
+        if suggestion and suggestion != category:
+            # Bulk updates skip the flush hook that sets category_id (categories.py)
+            if (owner_id, suggestion) not in category_ids:
+                category_ids[(owner_id, suggestion)] = categories.resolve(db.connection(), owner_id, suggestion)
+            updates.append({"id": expense_id, "category": suggestion, "category_id": category_ids[(owner_id, suggestion)]})
+            touched.add(owner_id)
+
+    for i in range(0, len(updates), batch_size):
+        db.bulk_update_mappings(models.Expense, updates[i:i + batch_size])
+    for owner_id in touched:
+        touch_user_data(db, owner_id)
+    db.commit()
+    if touched:
+        # Moved rows change the category histories anomalies are scored against
+        from . import anomalies
+        anomalies.rescore(db, touched, workers=1)
+    return len(updates)
+
+
+if __name__ == "__main__":
+    from .shards import session_factories
+
+    parser = argparse.ArgumentParser(description="Suggest categories for stored expenses.")
+    parser.add_argument("--user-id", type=int, default=None)
+    parser.add_argument("--overwrite", action="store_true", help="also replace categories set by the user")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    count = 0
+    for open_session in session_factories():  # main file, then each tenant shard
+        session = open_session()
+        try:
+            count += recategorize(session, args.user_id, args.overwrite)
+        finally:
+            session.close()
+    logger.info("Recategorized %d expenses", count)
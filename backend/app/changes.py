@@ -0,0 +1,146 @@
+"""
+Incremental change feed for client delta sync (``GET /changes``).
+
+Every insert, update and delete of a user's expenses and budgets takes the
+next value of that user's ``users.data_version`` counter: inserted and
+updated rows store it in their ``version`` column, deleted rows leave a
+tombstone in ``deleted_rows``. Like the search index, this is maintained by
+triggers, so every write path (ORM, bulk jobs, raw SQL) is covered and the
+versions follow commit order (SQLite has a single writer). Updates that
+leave every synced column unchanged (e.g. a rescore that lands on the same
+score) do not take a version.
+
+``since=0`` returns every live row (rows from before the feed are
+backfilled on first install), so a client can bootstrap from the feed
+itself, keep the returned ``cursor`` and from then on only ask for what
+changed after it.
+"""
+from typing import Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import models
+from .events import expense_data
+
+MAX_PAGE_SIZE = 1000
+
+_NEXT_VERSION = "UPDATE users SET data_version = data_version + 1 WHERE id = {row}.user_id;"
+_CURRENT_VERSION = "(SELECT data_version FROM users WHERE id = {row}.user_id)"
+
+
+def _stamp(table: str) -> str:
+    return (
+        f"UPDATE {table} SET version = {_CURRENT_VERSION.format(row='new')}, updated_at = CURRENT_TIMESTAMP "
+        f"WHERE id = new.id;"
+    )
+
+
+def _changed(columns) -> str:
+    return " OR ".join(f"old.{c} IS NOT new.{c}" for c in columns)
+
+
+_SYNCED_COLUMNS = {
+    "expenses": ("date", "description", "amount", "category", "is_anomaly", "anomaly_score", "anomaly_reason"),
+    "budgets": ("month", "amount"),
+}
+_KINDS = {"expenses": "expense", "budgets": "budget"}
+
+_DDL = []
+for _table, _columns in _SYNCED_COLUMNS.items():
+    _DDL += [
+        f"""CREATE TRIGGER IF NOT EXISTS {_table}_sync_ai AFTER INSERT ON {_table} BEGIN
+            {_NEXT_VERSION.format(row='new')}
+            {_stamp(_table)}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {_table}_sync_au AFTER UPDATE OF {', '.join(_columns)} ON {_table}
+        WHEN {_changed(_columns)} BEGIN
+            {_NEXT_VERSION.format(row='new')}
+            {_stamp(_table)}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {_table}_sync_ad AFTER DELETE ON {_table} BEGIN
+            {_NEXT_VERSION.format(row='old')}
+            INSERT INTO deleted_rows (user_id, kind, row_id, version, deleted_at)
+            VALUES (old.user_id, '{_KINDS[_table]}', old.id, {_CURRENT_VERSION.format(row='old')}, CURRENT_TIMESTAMP);
+        END""",
+    ]
+
+
+_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_expenses_user_version ON expenses (user_id, version)",
+    "CREATE INDEX IF NOT EXISTS ix_budgets_user_version ON budgets (user_id, version)",
+]
+
+# Rows from before the feed (version NULL) get versions in id order per user
+_BACKFILL = []
+for _table in _SYNCED_COLUMNS:
+    _BACKFILL += [
+        f"""UPDATE {_table} SET version = r.version FROM (
+            SELECT t.id, u.data_version + row_number() OVER (PARTITION BY t.user_id ORDER BY t.id) AS version
+            FROM {_table} t JOIN users u ON u.id = t.user_id WHERE t.version IS NULL
+        ) AS r WHERE {_table}.id = r.id""",
+        f"""UPDATE users SET data_version = max(data_version, coalesce(
+            (SELECT max(version) FROM {_table} WHERE user_id = users.id), 0))""",
+    ]
+
+
+def install(engine):
+    """
+    Create the versioning triggers and indexes; on first install, backfill
+    versions of existing rows. Does nothing until the ``version`` columns
+    exist (see the startup migration in main.py).
+    """
+    with engine.begin() as conn:
+        columns = {row[1] for row in conn.execute(text("PRAGMA table_info(expenses)"))}
+        if "version" not in columns:
+            return
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'expenses_sync_ai'")
+        ).first()
+        for stmt in _INDEXES + _DDL:
+            conn.execute(text(stmt))
+        if not exists:
+            for stmt in _BACKFILL:
+                conn.execute(text(stmt))
+
+
+# =====================================================
+# Feed
+# =====================================================
+def changes_since(db: Session, user_id: int, since: int = 0, limit: int = 500) -> Dict:
+    """
+    Rows changed after version ``since``, oldest first: upserts carry the
+    row, deletes only its id. ``cursor`` is the version to pass next time;
+    ``has_more`` means another page is waiting.
+    """
+    if since < 0:
+        raise ValueError("since must be >= 0")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    # Each source is a range scan on (user_id, version); merge the heads
+    expenses = db.query(models.Expense).filter(
+        models.Expense.user_id == user_id, models.Expense.version > since
+    ).order_by(models.Expense.version).limit(limit + 1).all()
+    budgets = db.query(models.Budget).filter(
+        models.Budget.user_id == user_id, models.Budget.version > since
+    ).order_by(models.Budget.version).limit(limit + 1).all()
+    deleted = db.query(models.DeletedRow).filter(
+        models.DeletedRow.user_id == user_id, models.DeletedRow.version > since
+    ).order_by(models.DeletedRow.version).limit(limit + 1).all()
+
+    changes: List[Dict] = (
+        [{"version": e.version, "type": "expense", "op": "upsert", "data": expense_data(e)} for e in expenses]
+        + [{"version": b.version, "type": "budget", "op": "upsert",
+            "data": {"id": b.id, "month": b.month, "amount": b.amount}} for b in budgets]
+        + [{"version": d.version, "type": d.kind, "op": "delete", "data": {"id": d.row_id}} for d in deleted]
+    )
+    changes.sort(key=lambda c: c["version"])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    if changes:
+        cursor = changes[-1]["version"]
+    else:
+        # Nothing newer: hand back the user's current version as the cursor
+        cursor = max(since, db.query(models.User.data_version).filter(models.User.id == user_id).scalar() or 0)
+    return {"changes": changes, "cursor": cursor, "has_more": has_more}
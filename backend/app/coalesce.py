@@ -0,0 +1,101 @@
+"""
+Single-flight coalescing of identical concurrent reads.
+
+The frontend often asks for the same expensive view twice at once (on mount
+and again in a strict-mode re-render, or from several tabs). ``flights``
+keys each call by user, route and normalized parameters: the first caller
+computes, callers arriving while it runs wait for its result (or exception)
+instead of computing it again, and for ``COALESCE_REUSE_SECONDS`` after it
+finished, identical calls reuse it too (0 turns reuse off).
+
+The key includes the user's cache generation (cache.py), which every
+committed write bumps, so a request made after a write never joins or
+reuses a computation that may have started before it.
+
+``run`` is for sync handlers (already on the thread pool). ``run_async`` is
+for async handlers: it moves the computation to the thread pool, so the
+event loop keeps serving, and duplicates await the one computation instead
+of queueing behind it. Coalescing is per process. A shared result is handed
+to every caller as is, so callers must not modify it.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from . import profiling
+from .cache import cache
+from .metrics import counter
+
+REUSE_SECONDS = float(os.environ.get("COALESCE_REUSE_SECONDS", "1"))
+
+COALESCED_REQUESTS = counter(
+    "coalesced_requests_total", "Coalesced reads by how they were served (computed, joined, reused).",
+    ("route", "result"),
+)
+
+
+def flight_key(route: str, user_id: int, params: Dict[str, Any]) -> tuple:
+    """(user, generation, route, params); empty parameters are dropped and strings trimmed."""
+    normalized = {k: v.strip() if isinstance(v, str) else v for k, v in params.items() if v is not None and v != ""}
+    return user_id, cache.generation(user_id), route, json.dumps(normalized, sort_keys=True, default=str)
+
+
+class SingleFlight:
+    def __init__(self, reuse: float = REUSE_SECONDS):
+        self.reuse = reuse
+        self._flights: Dict[tuple, Tuple[Future, Optional[float]]] = {}  # key -> (result, finished at)
+        self._lock = threading.Lock()
+
+    def _join(self, key: tuple, route: str) -> Tuple[Future, bool]:
+        """The flight for ``key`` and whether the caller must compute it."""
+        now = time.monotonic()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                future, finished = flight
+                if finished is None or now - finished < self.reuse:
+                    COALESCED_REQUESTS.inc(route=route, result="joined" if finished is None else "reused")
+                    return future, False
+            for stale in [k for k, (_, done) in self._flights.items() if done is not None and now - done >= self.reuse]:
+                del self._flights[stale]
+            future = Future()
+            future.set_running_or_notify_cancel()  # a waiter giving up cannot cancel it for the others
+            self._flights[key] = (future, None)
+        COALESCED_REQUESTS.inc(route=route, result="computed")
+        return future, True
+
+    def _compute(self, key: tuple, future: Future, compute: Callable[[], Any]):
+        try:
+            with profiling.attach_thread():
+                future.set_result(compute())
+        except BaseException as e:
+            future.set_exception(e)
+        with self._lock:
+            # Results are reused only while the generation is known (see cache.generation)
+            if self.reuse > 0 and key[1] is not None and future.exception() is None:
+                self._flights[key] = (future, time.monotonic())
+            else:
+                self._flights.pop(key, None)
+
+    def run(self, route: str, user_id: int, params: Dict[str, Any], compute: Callable[[], Any]):
+        key = flight_key(route, user_id, params)
+        future, leader = self._join(key, route)
+        if leader:
+            self._compute(key, future, compute)
+        return future.result()
+
+    async def run_async(self, route: str, user_id: int, params: Dict[str, Any], compute: Callable[[], Any]):
+        key = flight_key(route, user_id, params)
+        future, leader = self._join(key, route)
+        if leader:
+            await run_in_threadpool(self._compute, key, future, compute)
+        return await asyncio.wrap_future(future)
+
+
+flights = SingleFlight()
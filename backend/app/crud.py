@@ -1,7 +1,16 @@
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from . import models, schemas
-from typing import List, Optional, Dict, Any
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+from . import models, schemas, reminders, events, archive, recurring, categories
+from .dashboard import DashboardData
+from .cache import mark_user_changed
+from .db import SessionLocal, SHARD_COUNT
+from . import shards
+from .categorizer import suggest_category, FALLBACK_CATEGORY
+from typing import List, Optional, Dict, Any, Callable, Tuple
 from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime
 import calendar
 import csv
@@ -13,9 +22,20 @@ from datetime import date
 # =====================================================
 def get_or_create_user_by_clerk(db: Session, clerk_id: str, email: str) -> models.User:
     """
-    Get a user by Clerk ID or create if not exist.
+    Get a user by Clerk ID or create if not exist. With tenant shards, this
+    also pins ``db`` to the user's shard (see shards.py).
     """
+    if SHARD_COUNT:
+        return _get_sharded_user(db, clerk_id, email)
     user = db.query(models.User).filter(models.User.google_id == clerk_id).first()
+    if not user and db.info.get("read_only"):
+        # First request of a new user on a read session: create on the writer
+        writer = SessionLocal()
+        try:
+            get_or_create_user_by_clerk(writer, clerk_id, email)
+        finally:
+            writer.close()
+        return db.query(models.User).filter(models.User.google_id == clerk_id).one()
     if not user:
         user = models.User(email=email, google_id=clerk_id)
         db.add(user)
@@ -23,6 +43,19 @@ def get_or_create_user_by_clerk(db: Session, clerk_id: str, email: str) -> model
         db.refresh(user)
     return user
 
+def _get_sharded_user(db: Session, clerk_id: str, email: str) -> models.User:
+    for _ in range(2):
+        user_id, location = shards.resolver.locate(clerk_id, email)
+        shards.pin(db, location)
+        user = db.get(models.User, user_id)
+        if user is not None and user.shard is None:
+            return user
+        # Moved since it was resolved: ask the directory again
+        if user is not None:
+            db.expunge(user)
+        shards.resolver.forget(user_id)
+    raise shards.UserMoved(user_id)
+
 def update_user_preferences(db: Session, user_id: int, preferences: schemas.UserPreferences) -> models.User:
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
@@ -30,65 +63,137 @@ def update_user_preferences(db: Session, user_id: int, preferences: schemas.User
     
     user.reminder_enabled = preferences.reminder_enabled
     user.reminder_time = preferences.reminder_time
+    user.reminder_updated_at = datetime.now()  # the scheduler's worker picks this up on its next tick
     
     db.commit()
     db.refresh(user)
+    reminders.wheel.update(user.id, user.email, user.reminder_enabled, user.reminder_time)
     return user
 
+def touch_user_data(db: Session, user_id: int):
+    """
+    Mark the user's expenses/budgets as changed, in the caller's transaction.
+    Precomputed views (e.g. Wrapped snapshots) compare against this, and the
+    user's cached reads are invalidated once the transaction commits.
+    """
+    # shard IS NULL: the user's data lives in this file (not moved away, see shards.py)
+    updated = db.query(models.User).filter(models.User.id == user_id, models.User.shard.is_(None)).update(
+        {models.User.data_updated_at: datetime.now()}, synchronize_session=False
+    )
+    if not updated:
+        shards.resolver.forget(user_id)
+        raise shards.UserMoved(user_id)
+    mark_user_changed(db, user_id)
+
 # =====================================================
 # Expense Functions
 # =====================================================
 def get_expenses(db: Session, user_id: int) -> List[models.Expense]:
     return db.query(models.Expense).filter(models.Expense.user_id == user_id).all()
 
-def create_expense(db: Session, expense: schemas.ExpenseCreate, user_id: int) -> models.Expense:
-    # Anomaly Detection: Large expense > 2x category average
-    # Fetch all expenses for this category
-    cat_expenses = db.query(models.Expense).filter(
-        models.Expense.user_id == user_id,
-        models.Expense.category == expense.category
-    ).all()
-    
-    is_anomaly = False
-    if cat_expenses:
-        avg_amount = sum(e.amount for e in cat_expenses) / len(cat_expenses)
-        if expense.amount > 2 * avg_amount and expense.amount > 100: # Threshold of 100 to avoid noise
-            is_anomaly = True
-            
-    db_expense = models.Expense(**expense.dict(), user_id=user_id, is_anomaly=is_anomaly)
-    db.add(db_expense)
+# Writes are staged: stage_* apply a mutation in the caller's transaction and
+# return (result, on_commit); on_commit publishes change events once the data
+# is committed. The plain functions commit one write each; writes.py commits
+# several staged writes together (group commit).
+def commit_staged(db: Session, staged: Tuple[Any, Callable[[], None]]):
+    result, on_commit = staged
     db.commit()
-    db.refresh(db_expense)
-    return db_expense
+    on_commit()
+    return result
 
-def update_expense(db: Session, expense_id: int, user_id: int, expense_update: schemas.ExpenseCreate) -> Optional[models.Expense]:
+def refresh_derived(db: Session, pivots: List[tuple], merchants: List[tuple]):
+    """Rescore anomalies around ``pivots`` and re-detect ``merchants``' recurring series."""
+    from . import anomalies  # numpy, loaded on the first write rather than at startup
+    for expense_id, values in anomalies.rescore_around(db, pivots).items():
+        # rescore_around writes with bulk UPDATEs; mirror them on loaded rows
+        row = db.identity_map.get(identity_key(models.Expense, expense_id))
+        if row is not None:
+            for field, value in values.items():
+                set_committed_value(row, field, value)
+    recurring.refresh(db, merchants)
+
+def _derived_changed(db: Session, pivots: List[tuple], merchants: List[tuple]):
+    # Inside deferred_derived (a group commit, writes.py) refresh once per batch
+    pending = db.info.get("pending_derived")
+    if pending is None:
+        refresh_derived(db, pivots, merchants)
+    else:
+        pending[0].extend(pivots)
+        pending[1].extend(merchants)
+
+@contextmanager
+def deferred_derived(db: Session):
+    """Collect the anomaly and recurring refreshes of writes staged inside; run them once on exit."""
+    pending = db.info["pending_derived"] = ([], [])
+    try:
+        yield
+    finally:
+        del db.info["pending_derived"]
+    refresh_derived(db, *pending)
+
+def _fill_category(expense: schemas.ExpenseCreate):
+    # No category given: suggest one from the description
+    if not expense.category.strip():
+        expense.category = suggest_category(expense.description) or FALLBACK_CATEGORY
+
+def stage_create_expense(db: Session, expense: schemas.ExpenseCreate, user_id: int):
+    _fill_category(expense)
+    db_expense = models.Expense(**expense.dict(), user_id=user_id, is_anomaly=False)
+    db.add(db_expense)
+    db.flush()
+    # Anomaly Detection: score it (and rows back-dated before) against the category's history
+    _derived_changed(db, [(user_id, db_expense.category_id, db_expense.date, db_expense.id)],
+                     [(user_id, db_expense.merchant_key)])
+    touch_user_data(db, user_id)
+    return db_expense, lambda: events.expense_changed(db, user_id, "created", events.expense_data(db_expense))
+
+def create_expense(db: Session, expense: schemas.ExpenseCreate, user_id: int) -> models.Expense:
+    return commit_staged(db, stage_create_expense(db, expense, user_id))
+
+def stage_update_expense(db: Session, expense_id: int, user_id: int, expense_update: schemas.ExpenseCreate):
     expense = db.query(models.Expense).filter(
         models.Expense.id == expense_id,
         models.Expense.user_id == user_id
     ).first()
     if not expense:
-        return None
+        return None, lambda: None
+    previous = events.expense_data(expense)
+    previous_category, previous_merchant = expense.category_id, expense.merchant_key
+    _fill_category(expense_update)
     for field, value in expense_update.dict().items():
         setattr(expense, field, value)
-    db.commit()
-    db.refresh(expense)
-    return expense
+    db.flush()
+    _derived_changed(db, [(user_id, previous_category, previous["date"], expense.id),
+                          (user_id, expense.category_id, expense.date, expense.id)],
+                     [(user_id, previous_merchant), (user_id, expense.merchant_key)])
+    touch_user_data(db, user_id)
+    return expense, lambda: events.expense_changed(db, user_id, "updated", events.expense_data(expense), previous)
 
-def delete_expense(db: Session, expense_id: int, user_id: int) -> bool:
+def update_expense(db: Session, expense_id: int, user_id: int, expense_update: schemas.ExpenseCreate) -> Optional[models.Expense]:
+    return commit_staged(db, stage_update_expense(db, expense_id, user_id, expense_update))
+
+def stage_delete_expense(db: Session, expense_id: int, user_id: int):
     expense = db.query(models.Expense).filter(
         models.Expense.id == expense_id,
         models.Expense.user_id == user_id
     ).first()
-    if expense:
-        db.delete(expense)
-        db.commit()
-        return True
-    return False
+    if not expense:
+        return False, lambda: None
+    deleted = events.expense_data(expense)
+    category_id, merchant = expense.category_id, expense.merchant_key
+    db.delete(expense)
+    db.flush()
+    _derived_changed(db, [(user_id, category_id, deleted["date"], deleted["id"])], [(user_id, merchant)])
+    touch_user_data(db, user_id)
+    return True, lambda: events.expense_changed(db, user_id, "deleted", deleted)
+
+def delete_expense(db: Session, expense_id: int, user_id: int) -> bool:
+    return commit_staged(db, stage_delete_expense(db, expense_id, user_id))
 
 # =====================================================
 # Budget Functions
 # =====================================================
-def set_budget(db: Session, user_id: int, budget: schemas.BudgetCreate) -> models.Budget:
+def stage_set_budget(db: Session, user_id: int, budget: schemas.BudgetCreate):
     # Ensure month is YYYY-MM
     month_str = budget.month
     if len(month_str.split("-")[1]) == 1:
@@ -105,9 +210,12 @@ def set_budget(db: Session, user_id: int, budget: schemas.BudgetCreate) -> model
         db_budget = models.Budget(user_id=user_id, month=month_str, amount=float(budget.amount))
         db.add(db_budget)
 
-    db.commit()
-    db.refresh(db_budget)
-    return db_budget
+    db.flush()
+    touch_user_data(db, user_id)
+    return db_budget, lambda: events.budget_changed(db, user_id, db_budget)
+
+def set_budget(db: Session, user_id: int, budget: schemas.BudgetCreate) -> models.Budget:
+    return commit_staged(db, stage_set_budget(db, user_id, budget))
 
 
 def get_budget(db: Session, user_id: int, month: str) -> Optional[models.Budget]:
@@ -122,18 +230,19 @@ def get_all_budgets(db: Session, user_id: int):
 # =====================================================
 # Reports / Analytics
 # =====================================================
-def summary_expenses(db: Session, user_id: int, month: str = None, category: str = None) -> Dict[str, Any]:
+def summary_expenses(db: Session, user_id: int, month: str = None, category: str = None,
+                     data: Optional[DashboardData] = None) -> Dict[str, Any]:
     """
     Generate a summary of expenses with totals, categories, budget usage,
     daily trends, and comparison to last month.
     """
-    q = db.query(models.Expense).filter(models.Expense.user_id == user_id)
-    if month:
-        q = q.filter(models.Expense.date.like(f"{month}-%"))
+    data = data or DashboardData(db, user_id, month)
+    expenses = data.month_rows
     if category:
-        q = q.filter(models.Expense.category == category)
+        # Any spelling or alias of the category ("food", "Food", ...)
+        category_id = data.catalog.resolve(category)
+        expenses = [e for e in expenses if e.category_id == category_id]
 
-    expenses = q.all()
     total = sum(e.amount for e in expenses)
 
     # --- Daily spending trend ---
@@ -145,17 +254,14 @@ def summary_expenses(db: Session, user_id: int, month: str = None, category: str
     # --- Top category ---
     cat_totals = defaultdict(float)
     for e in expenses:
-        cat_totals[e.category] += e.amount
-    top_category = max(cat_totals, key=cat_totals.get) if cat_totals else None
+        cat_totals[e.category_id] += e.amount
+    top_category = data.catalog.name(max(cat_totals, key=cat_totals.get)) if cat_totals else None
 
     # --- Budget progress ---
     budget = 0.0
     percent_used = 0.0
     if month:
-        b = db.query(models.Budget).filter(
-            models.Budget.user_id == user_id,
-            models.Budget.month == month
-        ).first()
+        b = data.budget(month)
         if b:
             budget = b.amount
             percent_used = round((total / b.amount) * 100, 2) if b.amount > 0 else 0.0
@@ -169,12 +275,7 @@ def summary_expenses(db: Session, user_id: int, month: str = None, category: str
         last_month_num = month_num - 1 if month_num > 1 else 12
         last_month = f"{last_month_year}-{str(last_month_num).zfill(2)}"
 
-        q_last = db.query(models.Expense).filter(
-            models.Expense.user_id == user_id,
-            models.Expense.date.like(f"{last_month}-%")
-        )
-        last_expenses = q_last.all()
-        last_month_total = sum(e.amount for e in last_expenses)
+        last_month_total = sum(data.month_amounts(last_month))
 
         month_comparison = {
             "this_month": total,
@@ -190,25 +291,26 @@ def summary_expenses(db: Session, user_id: int, month: str = None, category: str
         y, m = map(int, month.split('-'))
         days_in_month = calendar.monthrange(y, m)[1]
         
-        # If looking at current month, use today's date for projection
-        today = datetime.today()
-        if today.year == y and today.month == m:
-            current_day = today.day
+        # If looking at current month, use the stored forecast for the rest of it
+        today = data.today
+        if today.year == y and today.month == m and not category:
+            projected_amount = data.project_month(total, daily_spending.get(today, 0.0)).total
         else:
-            current_day = days_in_month # Past/Future month, just assume full month
-            
-        if current_day > 0:
+            if today.year == y and today.month == m:
+                current_day = today.day
+            else:
+                current_day = days_in_month # Past/Future month, just assume full month
             daily_avg = total / current_day
             remaining_days = days_in_month - current_day
             projected_amount = total + (daily_avg * remaining_days)
-            
-            if projected_amount > budget:
-                budget_status = "warning"
-            if total > budget:
-                budget_status = "exceeded"
+
+        if projected_amount > budget:
+            budget_status = "warning"
+        if total > budget:
+            budget_status = "exceeded"
 
     return {
-        "expenses": expenses,
+        "expenses": [e._asdict() for e in expenses],
         "total": total,
         "average_daily": avg_daily,
         "top_category": top_category or None,
@@ -223,17 +325,134 @@ def summary_expenses(db: Session, user_id: int, month: str = None, category: str
         "month_comparison": month_comparison
     }
 
-def report_by_category(db: Session, user_id: int, month: str = None) -> Dict[str, float]:
+def report_by_category(db: Session, user_id: int, month: str = None,
+                       data: Optional[DashboardData] = None) -> Dict[str, float]:
     """
     Returns expense totals grouped by category.
     """
-    q = db.query(models.Expense).filter(models.Expense.user_id == user_id)
-    if month:
-        q = q.filter(models.Expense.date.like(f"{month}-%"))
+    data = data or DashboardData(db, user_id, month)
     cat_total = defaultdict(float)
-    for expense in q.all():
-        cat_total[expense.category] += expense.amount
-    return dict(cat_total)
+    for expense in data.month_rows:
+        cat_total[expense.category_id] += expense.amount
+    return data.catalog.by_name(cat_total)
+
+
+MAX_HISTORY_MONTHS = 120
+
+def _month_range(from_month: str, to_month: str) -> List[str]:
+    start = datetime.strptime(from_month, "%Y-%m")
+    end = datetime.strptime(to_month, "%Y-%m")
+    y, m = start.year, start.month
+    months = []
+    while (y, m) <= (end.year, end.month):
+        months.append(f"{y}-{str(m).zfill(2)}")
+        y, m = (y, m + 1) if m < 12 else (y + 1, 1)
+    return months
+
+def report_history(db: Session, user_id: int, from_month: str, to_month: str) -> Dict[str, Any]:
+    """
+    Per-month totals, category breakdown and budget vs. actual, plus daily
+    totals for a heatmap, over a range of months. Three grouped queries
+    regardless of how many months the range spans.
+    """
+    try:
+        months = _month_range(from_month, to_month)
+    except ValueError:
+        raise ValueError("from/to must be months in YYYY-MM format")
+    if not months:
+        raise ValueError("from cannot be after to")
+    if len(months) > MAX_HISTORY_MONTHS:
+        raise ValueError(f"Range cannot exceed {MAX_HISTORY_MONTHS} months")
+
+    start = date(int(months[0][:4]), int(months[0][5:]), 1)
+    y, m = int(months[-1][:4]), int(months[-1][5:])
+    end = date(y, m, calendar.monthrange(y, m)[1])
+    in_range = (
+        models.Expense.user_id == user_id,
+        models.Expense.date >= start,
+        models.Expense.date <= end,
+    )
+
+    month_col = func.strftime("%Y-%m", models.Expense.date)
+    catalog = categories.load(db, user_id)
+    by_month_category = [(month, catalog.name(category_id), amount, count) for month, category_id, amount, count in db.query(
+        month_col, models.Expense.category_id, func.sum(models.Expense.amount), func.count(models.Expense.id)
+    ).filter(*in_range).group_by(month_col, models.Expense.category_id)]
+
+    daily = db.query(
+        models.Expense.date, func.sum(models.Expense.amount), func.count(models.Expense.id)
+    ).filter(*in_range).group_by(models.Expense.date).order_by(models.Expense.date).all()
+
+    # Archived years (archive.py): totals from their summaries, days from the packed rows
+    # (summaries keep the text as entered)
+    by_month_category += [
+        (month, catalog.canonical(category), amount, count)
+        for month, category, amount, count in archive.month_category_totals(db, user_id, months[0], months[-1])
+    ]
+    archived_days = defaultdict(lambda: [0.0, 0])
+    for e in archive.expenses_between(db, user_id, start, end):
+        archived_days[e.date][0] += e.amount
+        archived_days[e.date][1] += 1
+    if archived_days:
+        for d, amount, count in daily:
+            archived_days[d][0] += amount
+            archived_days[d][1] += count
+        daily = [(d, a, n) for d, (a, n) in sorted(archived_days.items())]
+
+    budgets = dict(db.query(models.Budget.month, models.Budget.amount).filter(
+        models.Budget.user_id == user_id,
+        models.Budget.month >= months[0],
+        models.Budget.month <= months[-1],
+    ).all())
+
+    per_month = {month: {"total": 0.0, "count": 0, "categories": {}} for month in months}
+    category_totals = defaultdict(float)
+    for month, category, amount, count in by_month_category:
+        row = per_month[month]
+        row["total"] += amount
+        row["count"] += count
+        row["categories"][category] = row["categories"].get(category, 0.0) + amount
+        category_totals[category] += amount
+
+    history = []
+    for month in months:
+        row = per_month[month]
+        budget = budgets.get(month)
+        status = "no_budget"
+        if budget is not None:
+            status = "exceeded" if row["total"] > budget else "warning" if budget > 0 and row["total"] / budget > 0.8 else "safe"
+        history.append({
+            "month": month,
+            "total": round(row["total"], 2),
+            "count": row["count"],
+            "categories": {c: round(a, 2) for c, a in sorted(row["categories"].items(), key=lambda kv: -kv[1])},
+            "budget": budget,
+            "remaining": round(budget - row["total"], 2) if budget is not None else None,
+            "percent_used": round(row["total"] / budget * 100, 2) if budget else None,
+            "budget_status": status,
+        })
+
+    return {
+        "from": months[0],
+        "to": months[-1],
+        "total": round(sum(category_totals.values()), 2),
+        "months": history,
+        "categories": {c: round(a, 2) for c, a in sorted(category_totals.items(), key=lambda kv: -kv[1])},
+        "daily": [{"date": str(d), "amount": round(a, 2), "count": n} for d, a, n in daily],
+    }
+
+
+def expenses_for_export(db: Session, user_id: int, start_date: date, end_date: date) -> list:
+    """Hot and archived expenses in a date range, by date (archived rows are ``archive.ArchivedExpense``)."""
+    hot = db.query(models.Expense).filter(
+        models.Expense.user_id == user_id,
+        models.Expense.date >= start_date,
+        models.Expense.date <= end_date
+    ).order_by(models.Expense.date).all()
+    archived = archive.expenses_between(db, user_id, start_date, end_date)
+    if not archived:
+        return hot
+    return sorted(archived + hot, key=lambda e: e.date)
 
 
 def export_expenses_csv(
@@ -242,11 +461,7 @@ def export_expenses_csv(
     start_date: date,
     end_date: date
 ):
-    expenses = db.query(models.Expense).filter(
-        models.Expense.user_id == user_id,
-        models.Expense.date >= start_date,
-        models.Expense.date <= end_date
-    ).order_by(models.Expense.date).all()
+    expenses = expenses_for_export(db, user_id, start_date, end_date)
 
     output = io.StringIO()
     writer = csv.writer(output)
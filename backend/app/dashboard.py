@@ -0,0 +1,187 @@
+"""
+Data shared by the dashboard sections (``GET /dashboard``).
+
+``DashboardData`` fetches the rows and aggregates a dashboard render needs
+(this month's expenses, all budgets, last month's category totals, the
+forecast, ...) lazily and at most once. Expense rows are read-model tuples
+(readmodel.py), not ORM entities. Every section is a function of it,
+and the individual endpoints (``/budget/risk``, ``/insights``, ...) call the
+same functions with their own ``DashboardData``, so a section computed for
+``/dashboard`` is identical to the standalone response.
+"""
+import calendar
+from datetime import date, timedelta
+from functools import cached_property
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import categories, models, readmodel, rules, search
+
+if TYPE_CHECKING:
+    from . import forecasting
+
+
+class DashboardData:
+    def __init__(self, db: Session, user_id: int, month: Optional[str] = None, today: Optional[date] = None):
+        self.db = db
+        self.user_id = user_id
+        self.month = month  # month shown by summary / by-category (None: all time)
+        self.today = today or date.today()
+        self.this_month_start = date(self.today.year, self.today.month, 1)
+        self.last_month_end = self.this_month_start - timedelta(days=1)
+        self.last_month_start = date(self.last_month_end.year, self.last_month_end.month, 1)
+
+    @cached_property
+    def current_rows(self) -> List[readmodel.ExpenseRow]:
+        """Expenses dated from the first of the current month on."""
+        return readmodel.expense_rows(self.db, self.user_id, start=self.this_month_start)
+
+    @cached_property
+    def month_rows(self) -> List[readmodel.ExpenseRow]:
+        """Expenses of ``month`` (or all of them), by date."""
+        if self.month is None:
+            return readmodel.expense_rows(self.db, self.user_id)
+        if self.month == self.this_month_start.strftime("%Y-%m"):
+            return [e for e in self.current_rows if e.date.strftime("%Y-%m") == self.month]
+        try:
+            year, month = int(self.month[:4]), int(self.month[5:])
+            start = date(year, month, 1)
+        except ValueError:
+            return []  # not a YYYY-MM month: nothing matches
+        end = date(year, month, calendar.monthrange(year, month)[1])
+        return readmodel.expense_rows(self.db, self.user_id, start, end)
+
+    def month_amounts(self, month: str) -> List[float]:
+        return [a for (a,) in self.db.query(models.Expense.amount).filter(
+            models.Expense.user_id == self.user_id,
+            models.Expense.date.like(f"{month}-%"),
+        ).all()]
+
+    @cached_property
+    def budgets(self) -> List[models.Budget]:
+        return self.db.query(models.Budget).filter(models.Budget.user_id == self.user_id).all()
+
+    def budget(self, month: str) -> Optional[models.Budget]:
+        return next((b for b in self.budgets if b.month == month), None)
+
+    @cached_property
+    def catalog(self) -> categories.Catalog:
+        return categories.load(self.db, self.user_id)
+
+    # By-category totals group on category_id (ix_expenses_user_date_category), keyed by canonical name
+    @cached_property
+    def current_by_category(self) -> Dict[str, float]:
+        return self.catalog.by_name(dict(self.db.query(models.Expense.category_id, func.sum(models.Expense.amount)).filter(
+            models.Expense.user_id == self.user_id, models.Expense.date >= self.this_month_start
+        ).group_by(models.Expense.category_id).all()))
+
+    @cached_property
+    def last_month_by_category(self) -> Dict[str, float]:
+        return self.catalog.by_name(dict(self.db.query(models.Expense.category_id, func.sum(models.Expense.amount)).filter(
+            models.Expense.user_id == self.user_id,
+            models.Expense.date >= self.last_month_start,
+            models.Expense.date <= self.last_month_end,
+        ).group_by(models.Expense.category_id).all()))
+
+    @cached_property
+    def forecast(self) -> Optional[models.Forecast]:
+        from . import forecasting  # numpy; see bench_startup.py
+        return forecasting.get_forecast(self.db, self.user_id)
+
+    def project_month(self, month_total: float, spent_today: float) -> "forecasting.Projection":
+        from . import forecasting
+        return forecasting.project_month(
+            self.db, self.user_id, month_total, spent_today, self.today, forecast=self.forecast
+        )
+
+
+# =====================================================
+# Sections
+# =====================================================
+def budget_risk(data: DashboardData) -> dict:
+    today = data.today
+    budget = data.budget(today.strftime("%Y-%m"))
+
+    if not budget:
+        return {"status": "no_budget", "message": "No budget set for this month."}
+
+    expenses = [e for e in data.current_rows if e.date <= today]
+
+    total_spent = sum(e.amount for e in expenses)
+    remaining_budget = budget.amount - total_spent
+
+    # Precomputed forecast for the rest of the month (linear fallback)
+    spent_today = sum(e.amount for e in expenses if e.date == today)
+    projection = data.project_month(total_spent, spent_today)
+    avg_daily_spend = projection.daily_rate
+    projected_total_spend = projection.total
+    projected_overrun = projected_total_spend > budget.amount
+
+    days_to_exhaust = 99
+    if avg_daily_spend > 0:
+        days_to_exhaust = remaining_budget / avg_daily_spend
+
+    warning_level = "safe"
+    if projected_overrun:
+        warning_level = "danger"
+    elif remaining_budget < (budget.amount * 0.2):
+         warning_level = "warning"
+
+    return {
+        "projected_overrun": projected_overrun,
+        "days_to_exhaustion": int(days_to_exhaust) if days_to_exhaust < 99 else ">30",
+        "warning_level": warning_level,
+        "projected_total_spend": round(projected_total_spend, 2),
+        "budget_limit": budget.amount
+    }
+
+
+def insights(data: DashboardData) -> list:
+    # One pass feeds every aggregator; the rules only read the results
+    facts = rules.aggregate(data.current_rows, {
+        "catalog": data.catalog,
+        "last_month_by_category": data.last_month_by_category,
+        "coffee_trips": search.count_matches(data.db, data.user_id, rules.COFFEE_KEYWORDS, from_date=data.this_month_start),
+    })
+    return rules.evaluate("insights", facts)
+
+
+def monthly_diff(data: DashboardData) -> list:
+    current_map = data.current_by_category
+    last_map = data.last_month_by_category
+
+    all_cats = set(current_map.keys()) | set(last_map.keys())
+    diffs = []
+
+    for cat in all_cats:
+        curr = current_map.get(cat, 0)
+        prev = last_map.get(cat, 0)
+        diff = curr - prev
+        diffs.append({"category": cat, "current": curr, "previous": prev, "diff": diff})
+
+    # Sort by absolute difference
+    diffs.sort(key=lambda x: abs(x["diff"]), reverse=True)
+    return diffs
+
+
+def anomalies(data: DashboardData) -> List[dict]:
+    # Return last 5 anomalies, with score and reason
+    from . import anomalies as anomaly_scores
+    return anomaly_scores.recent(data.db, data.user_id, limit=5)
+
+
+def spending_profile(data: DashboardData) -> dict:
+    expenses = data.current_rows
+
+    if not expenses:
+         return {"profile": "Newcomer", "description": "Not enough data yet.", "icon": "🌱"}
+
+    # Logic Rules (first match wins, see rules.py)
+    default = {
+        "profile": "Balanced Spender",
+        "description": "Your spending is distributed, but you lack a clear saving strategy for unexpected costs.",
+        "icon": "⚖️",
+    }
+    return rules.first("profile", rules.aggregate(expenses, {"catalog": data.catalog}), default)
@@ -1,14 +1,156 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from collections import OrderedDict
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+
+from . import models, search, changes, recurring, categories
+from .metrics import instrument_engine
+from .cache import track_sessions
 
 import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PARENT_DIR = os.path.dirname(BASE_DIR) # point to backend/
-DB_FILE = os.path.join(PARENT_DIR, "expense_tracker.db")
+DB_FILE = os.environ.get("DB_FILE", os.path.join(PARENT_DIR, "expense_tracker.db"))
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_FILE}"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+READ_POOL_SIZE = int(os.environ.get("DB_READ_POOL_SIZE", str(max(4, os.cpu_count() or 1))))
+BUSY_TIMEOUT_MS = 5000
+
+# Tenant shards (see shards.py); 0 keeps every user in DB_FILE
+SHARD_COUNT = int(os.environ.get("DB_SHARDS", "0"))
+SHARD_DIR = os.environ.get("DB_SHARD_DIR", os.path.join(PARENT_DIR, "shards"))
+MAX_OPEN_SHARDS = int(os.environ.get("DB_SHARD_ENGINES", "32"))
+
+
+# =====================================================
+# Engines
+# =====================================================
+def _configure_writer(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL: readers work off a snapshot and never block (or wait for) the writer
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def _configure_reader(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def writer_engine(path: str):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", _configure_writer)
+    instrument_engine(engine)
+    return engine
+
+
+def read_engine_for(path: str):
+    # Same file, opened read-only by SQLite itself
+    engine = create_engine(
+        f"sqlite:///file:{path}?mode=ro&uri=true", connect_args={"check_same_thread": False},
+        pool_size=READ_POOL_SIZE,
+    )
+    event.listen(engine, "connect", _configure_reader)
+    instrument_engine(engine)
+    return engine
+
+
+def init_schema(engine):
+    """Tables, search index, change feed triggers, recurring charge keys and the category catalog (every database file has the same schema)."""
+    models.Base.metadata.create_all(bind=engine)
+    search.install(engine)
+    changes.install(engine)
+    recurring.install(engine)
+    categories.install(engine)
+
+
+engine = writer_engine(DB_FILE)
+read_engine = read_engine_for(DB_FILE)
+
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
+class ShardEngines:
+    """Engines of the shard files, opened (and migrated) on first use; least recently used closed first."""
+
+    def __init__(self, directory: str = SHARD_DIR, max_open: int = MAX_OPEN_SHARDS):
+        self.directory = directory
+        self.max_open = max_open
+        self._engines: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, shard: int) -> str:
+        return os.path.join(self.directory, f"shard-{shard:03d}.db")
+
+    def get(self, shard: int, read_only: bool = False):
+        with self._lock:
+            engines = self._engines.get(shard)
+            if engines is None:
+                os.makedirs(self.directory, exist_ok=True)
+                writer = writer_engine(self.path(shard))
+                self._init(writer)  # creates the file before the read-only engine opens it
+                engines = self._engines[shard] = (writer, read_engine_for(self.path(shard)))
+                while len(self._engines) > self.max_open:
+                    _, evicted = self._engines.popitem(last=False)
+                    for e in evicted:
+                        e.dispose()  # checked-out connections stay usable until returned
+            else:
+                self._engines.move_to_end(shard)
+        return engines[1] if read_only else engines[0]
+
+    @staticmethod
+    def _init(writer, attempts: int = 5):
+        for attempt in range(attempts):
+            try:
+                init_schema(writer)
+                return
+            except OperationalError:
+                # Another process is creating the same shard; its tables are there on retry
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(0.1)
+
+
+shard_engines = ShardEngines()
+
+
+def engine_for(location, read_only: bool = False):
+    """Engine of a user's location: None is DB_FILE, an int is a shard."""
+    if location is None:
+        return read_engine if read_only else engine
+    return shard_engines.get(location, read_only)
+
+
+def locations() -> list:
+    """Every place user data can live: DB_FILE (unmigrated users), then each shard."""
+    return [None] + list(range(SHARD_COUNT))
+
+
+# =====================================================
+# Sessions
+# =====================================================
+class ShardSession(Session):
+    """
+    Session on DB_FILE until pinned to a location via ``info["shard"]``
+    (``crud.get_or_create_user_by_clerk`` pins it to the user's shard).
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        location = self.info.get("shard")
+        if location is None:
+            return super().get_bind(mapper, clause=clause, **kw)
+        return shard_engines.get(location, read_only=self.info.get("read_only", False))
+
+
+SessionLocal = sessionmaker(class_=ShardSession, autocommit=False, autoflush=False, bind=engine)
+track_sessions(SessionLocal)  # cached per-user reads are invalidated on commit
+
+# Sessions for read-only endpoints; anything that writes goes through SessionLocal
+ReadSessionLocal = sessionmaker(
+    class_=ShardSession, autocommit=False, autoflush=False, bind=read_engine, info={"read_only": True}
+)
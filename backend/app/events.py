@@ -0,0 +1,259 @@
+"""
+Per-user change events for the live dashboard (``GET /events``, SSE).
+
+``crud.py`` write paths publish small deltas (the changed expense or budget,
+the new totals of the affected month/category, keyed by canonical category
+name like the reports, the month's budget status) to a broker.
+``InProcessBroker`` fans them out to the asyncio queues of the user's open
+streams and keeps a short per-user history so a reconnecting client can
+resume from ``Last-Event-ID``. Another broker (e.g. Redis pub/sub)
+can be swapped in with ``set_broker`` for multi-worker deployments.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import date
+from typing import Deque, Dict, List, NamedTuple, Optional, Set
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import categories, models
+
+HISTORY_SIZE = 256  # events kept per user for Last-Event-ID replay
+QUEUE_SIZE = 100  # undelivered events per stream before it is told to resync
+MAX_CONNECTIONS_PER_USER = 5
+HEARTBEAT_SECONDS = 15
+RETRY_MS = 3000
+
+
+class Event(NamedTuple):
+    id: str
+    type: str
+    data: dict
+
+    def encode(self) -> str:
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data, default=str)}\n\n"
+
+
+class TooManyStreams(Exception):
+    """The user already has the maximum number of open streams."""
+
+
+class Subscription:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.loop = asyncio.get_running_loop()
+        self.overflowed = False
+
+    def offer(self, event: Event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+# =====================================================
+# Brokers
+# =====================================================
+class Broker:
+    def has_subscribers(self, user_id: int) -> bool:
+        return True
+
+    def connection_count(self, user_id: int) -> int:
+        raise NotImplementedError
+
+    def subscribe(self, user_id: int, max_connections: Optional[int] = None) -> Subscription:
+        """Register a stream; raises ``TooManyStreams`` if the user already has ``max_connections``."""
+        raise NotImplementedError
+
+    def unsubscribe(self, sub: Subscription):
+        raise NotImplementedError
+
+    def publish(self, user_id: int, event_type: str, data: dict) -> Event:
+        raise NotImplementedError
+
+    def replay(self, user_id: int, last_event_id: str) -> Optional[List[Event]]:
+        """Events after ``last_event_id``, or None if they are no longer known."""
+        raise NotImplementedError
+
+
+class InProcessBroker(Broker):
+    def __init__(self, history_size: int = HISTORY_SIZE):
+        # Ids are "<epoch>-<seq>" so ids from before a restart are detected
+        self.epoch = str(int(time.time()))
+        self._subs: Dict[int, Set[Subscription]] = defaultdict(set)
+        self._history: Dict[int, Deque[Event]] = defaultdict(lambda: deque(maxlen=history_size))
+        self._seq: Dict[int, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def has_subscribers(self, user_id: int) -> bool:
+        return bool(self._subs.get(user_id))
+
+    def connection_count(self, user_id: int) -> int:
+        return len(self._subs.get(user_id, ()))
+
+    def subscribe(self, user_id: int, max_connections: Optional[int] = None) -> Subscription:
+        sub = Subscription(user_id)
+        with self._lock:
+            # Checked under the lock, so concurrent connects cannot all pass the cap
+            if max_connections is not None and len(self._subs.get(user_id, ())) >= max_connections:
+                raise TooManyStreams(user_id)
+            self._subs[user_id].add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subs.get(sub.user_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.user_id]
+
+    def publish(self, user_id: int, event_type: str, data: dict) -> Event:
+        with self._lock:
+            self._seq[user_id] += 1
+            event = Event(f"{self.epoch}-{self._seq[user_id]}", event_type, data)
+            self._history[user_id].append(event)
+            subs = list(self._subs.get(user_id, ()))
+        for sub in subs:
+            # crud may run on a threadpool worker; queues belong to the loop
+            sub.loop.call_soon_threadsafe(sub.offer, event)
+        return event
+
+    def replay(self, user_id: int, last_event_id: str) -> Optional[List[Event]]:
+        try:
+            epoch, seq = last_event_id.split("-")
+            seq = int(seq)
+        except ValueError:
+            return None
+        if epoch != self.epoch:
+            return None
+        with self._lock:
+            history = list(self._history.get(user_id, ()))
+        if seq >= self._seq[user_id]:
+            return []
+        if not history or int(history[0].id.split("-")[1]) > seq + 1:
+            return None  # gap: some events already fell out of the history
+        return [e for e in history if int(e.id.split("-")[1]) > seq]
+
+
+broker: Broker = InProcessBroker()
+
+
+def set_broker(new_broker: Broker):
+    global broker
+    broker = new_broker
+
+
+# =====================================================
+# Deltas published by crud.py
+# =====================================================
+def expense_data(expense: models.Expense) -> dict:
+    """Plain snapshot of an expense (safe to use after it is deleted)."""
+    return {
+        "id": expense.id,
+        "date": expense.date,
+        "description": expense.description,
+        "amount": expense.amount,
+        "category": expense.category,
+        "category_id": expense.category_id,
+        "is_anomaly": bool(expense.is_anomaly),
+        "anomaly_score": expense.anomaly_score,
+        "anomaly_reason": expense.anomaly_reason,
+    }
+
+
+def _month_of(d) -> str:
+    return d.strftime("%Y-%m") if isinstance(d, date) else str(d)[:7]
+
+
+def _month_totals(db: Session, user_id: int, month: str, catalog: categories.Catalog, names: Set[str]) -> dict:
+    """Month total and the totals of ``names`` (canonical), as ``/report_by_category/`` keys them."""
+    rows = db.query(models.Expense.category_id, func.sum(models.Expense.amount)).filter(
+        models.Expense.user_id == user_id,
+        models.Expense.date.like(f"{month}-%"),
+    ).group_by(models.Expense.category_id).all()
+    by_category = catalog.by_name(dict(rows))
+    return {
+        "month": month,
+        "total": sum(by_category.values(), 0.0),
+        "categories": {c: by_category.get(c, 0.0) for c in names},
+    }
+
+
+def _budget_status(db: Session, user_id: int, month: str, total: float) -> Optional[dict]:
+    budget = db.query(models.Budget).filter(
+        models.Budget.user_id == user_id, models.Budget.month == month
+    ).first()
+    if not budget:
+        return None
+    status = "safe"
+    if total > budget.amount:
+        status = "exceeded"
+    elif budget.amount > 0 and total / budget.amount > 0.8:
+        status = "warning"
+    return {
+        "month": month,
+        "budget": budget.amount,
+        "percent_used": round(total / budget.amount * 100, 2) if budget.amount > 0 else 0.0,
+        "status": status,
+    }
+
+
+def expense_changed(db: Session, user_id: int, action: str, expense: dict, previous: Optional[dict] = None):
+    """Publish ``expense.<action>`` with the new totals of every affected month/category."""
+    if not broker.has_subscribers(user_id):
+        return
+    catalog = categories.load(db, user_id)
+    affected: Dict[str, Set[str]] = defaultdict(set)
+    for e in (expense, previous):
+        if e:
+            name = catalog.canonical(e["category"]) if e["category_id"] is None else catalog.name(e["category_id"])
+            affected[_month_of(e["date"])].add(name)
+    totals = [_month_totals(db, user_id, month, catalog, names) for month, names in affected.items()]
+    budgets = [b for b in (_budget_status(db, user_id, t["month"], t["total"]) for t in totals) if b]
+    broker.publish(user_id, f"expense.{action}", {"expense": expense, "totals": totals, "budgets": budgets})
+
+
+def budget_changed(db: Session, user_id: int, budget: models.Budget):
+    if not broker.has_subscribers(user_id):
+        return
+    totals = _month_totals(db, user_id, budget.month, categories.load(db, user_id), set())
+    broker.publish(user_id, "budget.updated", {
+        "budget": {"id": budget.id, "month": budget.month, "amount": budget.amount},
+        "status": _budget_status(db, user_id, budget.month, totals["total"]),
+    })
+
+
+# =====================================================
+# SSE Stream
+# =====================================================
+async def stream(request, sub: Subscription, last_event_id: Optional[str] = None):
+    """Events for a subscription taken with ``broker.subscribe``; unsubscribes when done."""
+    user_id = sub.user_id
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        if last_event_id:
+            missed = broker.replay(user_id, last_event_id)
+            if missed is None:
+                yield "event: resync\ndata: {}\n\n"
+            else:
+                for event in missed:
+                    yield event.encode()
+        while True:
+            if sub.overflowed:
+                yield "event: resync\ndata: {}\n\n"
+                return
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), timeout=HEARTBEAT_SECONDS)
+                yield event.encode()
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield ": heartbeat\n\n"
+    finally:
+        broker.unsubscribe(sub)
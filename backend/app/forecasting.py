@@ -0,0 +1,203 @@
+"""
+Budget projections from precomputed per-user spend forecasts.
+
+A nightly batch job (``python -m backend.app.forecasting``) builds a daily
+spend series for every user, fits a day-of-week seasonality plus EWMA trend
+model for all of them at once with NumPy, and stores the result in the
+``forecasts`` table. Request handlers then only read the stored model and add
+a cheap correction for what has already been spent today.
+"""
+import argparse
+import calendar
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DAYS = 91  # 13 full weeks, so every weekday is seen equally often
+EWMA_HALFLIFE_DAYS = 14.0
+SEASONALITY_PRIOR_WEEKS = 2.0  # shrinks weekday factors towards 1 for short histories
+FORECAST_MAX_AGE_DAYS = 3  # older forecasts are ignored in favour of the linear fallback
+CHUNK_SIZE = 2000  # users per worker task
+
+
+# =====================================================
+# Model Fitting (vectorized over users)
+# =====================================================
+def fit_forecasts(series: np.ndarray, first_day: np.ndarray, start: date):
+    """
+    Fit all users at once.
+
+    ``series`` is a (users x days) matrix of daily spend starting at ``start``;
+    ``first_day`` holds each user's first day with history (days before it are
+    ignored rather than counted as zero spend). Returns ``(levels, factors)``:
+    the deseasonalized EWMA daily spend per user and a (users x 7) matrix of
+    weekday multipliers, Monday first.
+    """
+    n_users, n_days = series.shape
+    day_idx = np.arange(n_days)
+    dows = (start.weekday() + day_idx) % 7
+    mask = (day_idx[None, :] >= first_day[:, None]).astype(float)
+
+    # Day-of-week seasonality: weekday mean / overall mean, shrunk towards 1
+    onehot = np.eye(7)[dows]  # days x 7
+    dow_sum = (series * mask) @ onehot
+    dow_cnt = mask @ onehot
+    observed = mask.sum(axis=1)
+    overall = np.divide((series * mask).sum(axis=1), observed, out=np.zeros(n_users), where=observed > 0)
+    prior = SEASONALITY_PRIOR_WEEKS
+    factors = np.divide(
+        dow_sum + prior * overall[:, None],
+        (dow_cnt + prior) * overall[:, None],
+        out=np.ones((n_users, 7)),
+        where=overall[:, None] > 0,
+    )
+    factors /= factors.mean(axis=1, keepdims=True)
+
+    # EWMA trend over the deseasonalized series
+    deseason = series / factors[:, dows]
+    alpha = 1 - 0.5 ** (1 / EWMA_HALFLIFE_DAYS)
+    weights = (1 - alpha) ** (n_days - 1 - day_idx)
+    w = mask * weights[None, :]
+    wsum = w.sum(axis=1)
+    levels = np.divide((deseason * w).sum(axis=1), wsum, out=np.zeros(n_users), where=wsum > 0)
+    return levels, factors
+
+
+def _fit_chunk(args):
+    series, first_day, start = args
+    return fit_forecasts(series, first_day, start)
+
+
+# =====================================================
+# Batch Job
+# =====================================================
+def load_daily_series(db: Session, start: date, end: date):
+    """One grouped query for every user's daily totals in ``[start, end]``."""
+    rows = db.query(
+        models.Expense.user_id, models.Expense.date, func.sum(models.Expense.amount)
+    ).filter(
+        models.Expense.date >= start,
+        models.Expense.date <= end,
+    ).group_by(models.Expense.user_id, models.Expense.date).all()
+
+    user_ids = sorted({r[0] for r in rows})
+    index = {uid: i for i, uid in enumerate(user_ids)}
+    n_days = (end - start).days + 1
+    series = np.zeros((len(user_ids), n_days))
+    for user_id, day, amount in rows:
+        series[index[user_id], (day - start).days] += amount
+
+    # Days before a user's first ever expense are not history, just absence
+    first_dates = dict(db.query(
+        models.Expense.user_id, func.min(models.Expense.date)
+    ).group_by(models.Expense.user_id).all())
+    first_day = np.array(
+        [max(0, (first_dates[uid] - start).days) for uid in user_ids], dtype=int
+    )
+    return user_ids, series, first_day
+
+
+def run_batch(db: Session, as_of: Optional[date] = None, workers: Optional[int] = None) -> int:
+    """Fit and store forecasts for every user with recent history, replacing the previous run."""
+    as_of = as_of or date.today() - timedelta(days=1)
+    start = as_of - timedelta(days=HISTORY_DAYS - 1)
+    user_ids, series, first_day = load_daily_series(db, start, as_of)
+    if not user_ids:
+        return 0
+
+    chunks = [
+        (series[i:i + CHUNK_SIZE], first_day[i:i + CHUNK_SIZE], start)
+        for i in range(0, len(user_ids), CHUNK_SIZE)
+    ]
+    if len(chunks) == 1 or workers == 1:
+        results = [_fit_chunk(c) for c in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_fit_chunk, chunks))
+    levels = np.concatenate([r[0] for r in results])
+    factors = np.concatenate([r[1] for r in results])
+
+    db.query(models.Forecast).delete(synchronize_session=False)
+    db.bulk_insert_mappings(models.Forecast, [
+        {
+            "user_id": uid,
+            "as_of": as_of,
+            "daily_level": float(levels[i]),
+            "dow_factors": json.dumps([round(float(f), 4) for f in factors[i]]),
+            "history_days": int(series.shape[1] - first_day[i]),
+        }
+        for i, uid in enumerate(user_ids)
+    ])
+    db.commit()
+    return len(user_ids)
+
+
+# =====================================================
+# Projection (request path)
+# =====================================================
+class Projection(NamedTuple):
+    total: float  # projected month-end spend
+    daily_rate: float  # expected spend per remaining day
+    source: str  # "forecast" or "linear"
+
+
+def get_forecast(db: Session, user_id: int) -> Optional[models.Forecast]:
+    return db.query(models.Forecast).filter(models.Forecast.user_id == user_id).first()
+
+
+def project_month(db: Session, user_id: int, month_total: float, spent_today: float = 0.0,
+                  today: Optional[date] = None, forecast: Optional[models.Forecast] = None) -> Projection:
+    """
+    Projected month-end spend for the current month.
+
+    Uses the stored forecast for the days after today, plus whatever of
+    today's expected spend has not happened yet. Falls back to the linear
+    ``total / days_passed`` extrapolation when no fresh forecast exists.
+    """
+    today = today or date.today()
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
+    days_left = days_in_month - today.day
+
+    forecast = forecast or get_forecast(db, user_id)
+    if forecast is None or (today - forecast.as_of).days > FORECAST_MAX_AGE_DAYS:
+        daily = month_total / today.day if today.day > 0 else 0
+        return Projection(month_total + daily * days_left, daily, "linear")
+
+    factors: List[float] = json.loads(forecast.dow_factors)
+    level = forecast.daily_level
+    rest_of_today = max(0.0, level * factors[today.weekday()] - spent_today)
+    remaining = sum(
+        level * factors[(today + timedelta(days=k)).weekday()] for k in range(1, days_left + 1)
+    )
+    daily = remaining / days_left if days_left > 0 else level
+    return Projection(month_total + rest_of_today + remaining, daily, "forecast")
+
+
+if __name__ == "__main__":
+    from .shards import session_factories
+
+    parser = argparse.ArgumentParser(description="Fit budget forecasts for all users.")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count)")
+    parser.add_argument("--as-of", type=date.fromisoformat, default=None, help="last history day (default: yesterday)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    count = 0
+    for open_session in session_factories():  # main file, then each tenant shard
+        session = open_session()
+        try:
+            models.Base.metadata.create_all(bind=session.get_bind())
+            count += run_batch(session, as_of=args.as_of, workers=args.workers)
+        finally:
+            session.close()
+    logger.info("Stored forecasts for %d users", count)
@@ -1,17 +1,26 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse
 from sqlalchemy.orm import Session
 from datetime import datetime
 from fastapi.responses import StreamingResponse
 from datetime import date
 import csv
 import io
+import logging
 
 
-from backend.app.db import SessionLocal, engine
-from backend.app import crud, schemas, models
+from backend.app.db import SessionLocal, ReadSessionLocal, engine, init_schema, DB_FILE
+from backend.app import crud, schemas
 from backend.app.auth import get_current_user
+from backend.app import metrics, profiling, reminders, search, writes, changes, shards, archive, recurring, categories
+from backend.app.categorizer import categorizer
+from backend.app.cache import cache
+from backend.app.coalesce import flights
+from backend.app.admission import limit
+from fastapi.encoders import jsonable_encoder
+
+logger = logging.getLogger(__name__)
 
 
 # =====================================================
@@ -22,10 +31,27 @@ app = FastAPI(
     description="Backend for Expense Tracker with Clerk Auth + SQLite",
     version="1.0.0",
 )
+# Lets an opt-in profile sample only its own request (see profiling.py)
+app.router.route_class = profiling.ProfiledRoute
 
 from backend.app.routers import insights
 app.include_router(insights.router)
 
+from backend.app.routers import metrics as metrics_router
+app.include_router(metrics_router.router)
+
+from backend.app.routers import profiles
+app.include_router(profiles.router)
+
+from backend.app.routers import events as events_router
+app.include_router(events_router.router)
+
+from backend.app.routers import dashboard
+app.include_router(dashboard.router)
+
+from backend.app.routers import scan  # the Vision client loads on the first scan
+app.include_router(scan.router)
+
 
 # =====================================================
 # CORS Middleware (MUST be here, at the top)
@@ -42,42 +68,131 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in profiling of single requests (see profiling.py). Registered before
+# the metrics middleware so it runs inside it and can read the request's SQL.
+app.middleware("http")(profiling.profile_middleware)
+
+# Request latency, in-flight and per-request SQL metrics (see /metrics)
+app.middleware("http")(metrics.http_middleware)
+
 # =====================================================
 # Database Initialization
 # =====================================================
-# =====================================================
-# Database Initialization
-# =====================================================
-models.Base.metadata.create_all(bind=engine)
-
 @app.on_event("startup")
 def on_startup():
+    # Schema first (at startup, not import: importing the app stays cheap for tools and tests)
+    init_schema(engine)
+
     # Simple migration hack for hackathon: Add columns if not exist
     # This is normally done via Alembic
     import sqlite3
     try:
         # Connect to the database directly
-        conn = sqlite3.connect("expense_tracker.db")
+        conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
         
         # Try adding reminder_enabled
         try:
             cursor.execute("ALTER TABLE users ADD COLUMN reminder_enabled BOOLEAN DEFAULT 0")
-            print("✅ Added reminder_enabled column")
+            logger.info("Added reminder_enabled column")
         except Exception:
             pass # Column likely exists
             
         # Try adding reminder_time
         try:
             cursor.execute("ALTER TABLE users ADD COLUMN reminder_time VARCHAR DEFAULT '20:00'")
-            print("✅ Added reminder_time column")
+            logger.info("Added reminder_time column")
+        except Exception:
+            pass # Column likely exists
+
+        # Try adding reminder_updated_at (polled by the reminder scheduler)
+        try:
+            cursor.execute("ALTER TABLE users ADD COLUMN reminder_updated_at DATETIME")
+            logger.info("Added reminder_updated_at column")
+        except Exception:
+            pass # Column likely exists
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_users_reminder_updated_at ON users (reminder_updated_at)")
+
+        # Try adding data_updated_at (Wrapped snapshot freshness)
+        try:
+            cursor.execute("ALTER TABLE users ADD COLUMN data_updated_at DATETIME")
+            logger.info("Added data_updated_at column")
+        except Exception:
+            pass # Column likely exists
+
+        # Try adding anomaly score/reason (run `python -m backend.app.anomalies` once after)
+        for column in ("anomaly_score FLOAT", "anomaly_reason VARCHAR"):
+            try:
+                cursor.execute(f"ALTER TABLE expenses ADD COLUMN {column}")
+                logger.info("Added %s column", column.split()[0])
+            except Exception:
+                pass # Column likely exists
+
+        # Try adding shard (tenant directory, see shards.py)
+        try:
+            cursor.execute("ALTER TABLE users ADD COLUMN shard INTEGER")
+            logger.info("Added shard column")
+        except Exception:
+            pass # Column likely exists
+
+        # Try adding change feed versions (triggers and backfill: changes.install below)
+        for table, column in (("users", "data_version INTEGER NOT NULL DEFAULT 0"),
+                              ("expenses", "version INTEGER"), ("expenses", "updated_at DATETIME"),
+                              ("budgets", "version INTEGER"), ("budgets", "updated_at DATETIME")):
+            try:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+                logger.info("Added %s.%s column", table, column.split()[0])
+            except Exception:
+                pass # Column likely exists
+
+        # Try adding recurring charge keys (index and backfill: recurring.install below;
+        # then run `python -m backend.app.recurring` once)
+        for column in ("merchant_key VARCHAR", "amount_band INTEGER"):
+            try:
+                cursor.execute(f"ALTER TABLE expenses ADD COLUMN {column}")
+                logger.info("Added %s column", column.split()[0])
+            except Exception:
+                pass # Column likely exists
+
+        # Try adding category ids (indexes and backfill: categories.install below)
+        try:
+            cursor.execute("ALTER TABLE expenses ADD COLUMN category_id INTEGER REFERENCES categories(id)")
+            logger.info("Added category_id column")
         except Exception:
             pass # Column likely exists
             
         conn.commit()
         conn.close()
+        changes.install(engine)
+        recurring.install(engine)
+        categories.install(engine)
     except Exception as e:
-        print(f"⚠️ Migration Check Warning: {e}")
+        logger.warning("Migration check warning: %s", e)
+
+
+@app.on_event("startup")
+async def start_reminder_scheduler():
+    # Set REMINDER_SCHEDULER=0 on all but one worker to avoid duplicate sends
+    if not reminders.REMINDER_SCHEDULER_ENABLED:
+        return
+    reminders.scheduler.start(*shards.session_factories(read_only=True))
+
+
+@app.on_event("shutdown")
+async def stop_reminder_scheduler():
+    await reminders.scheduler.stop()
+
+
+@app.on_event("shutdown")
+def stop_write_coordinator():
+    # Commit whatever is still queued before the process exits
+    writes.stop_all()
+
+
+@app.exception_handler(shards.UserMoved)
+async def user_moved_handler(request, exc: shards.UserMoved):
+    # Raced with a shard rebalance; the next attempt goes to the new shard
+    return JSONResponse(status_code=503, content={"detail": "Please retry"}, headers={"Retry-After": "1"})
 
 
 # =====================================================
@@ -89,6 +204,14 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def get_read_db():
+    # Read-only pool: in WAL mode these never wait on (or block) writes
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
         
 # =====================================================
 # User Preferences
@@ -109,20 +232,46 @@ def read_root():
 # =====================================================
 # Expenses
 # =====================================================
-@app.get("/expenses/", response_model=list[schemas.Expense])
-async def read_expenses(current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.get("/expenses/", response_model=list[schemas.Expense], dependencies=[Depends(limit("read"))])
+async def read_expenses(current_user: dict = Depends(get_current_user), db: Session = Depends(get_read_db)):
     user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
     return crud.get_expenses(db, user.id)
 
+@app.get("/expenses/search", dependencies=[Depends(limit("read"))])
+async def search_expenses(
+    q: str,
+    category: str = None,
+    from_date: date = None,
+    to_date: date = None,
+    sort: str = "rank",
+    limit: int = 20,
+    cursor: str = None,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
+    try:
+        return search.search_expenses(db, user.id, q, category, from_date, to_date, sort, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/categories/suggest", dependencies=[Depends(limit("read"))])
+async def suggest_category(description: str, current_user: dict = Depends(get_current_user)):
+    scores = categorizer.scores(description)
+    return {
+        "category": max(scores, key=scores.get) if scores else None,
+        "scores": scores,
+    }
+
 @app.post("/expenses/", response_model=schemas.Expense)
 async def create_expense(expense: schemas.ExpenseCreate, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
     user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
-    return crud.create_expense(db, expense, user.id)
+    return await writes.apply(db, crud.stage_create_expense, expense, user.id)
 
 @app.put("/expenses/{expense_id}", response_model=schemas.Expense)
 async def update_expense(expense_id: int, expense: schemas.ExpenseCreate, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
     user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
-    out = crud.update_expense(db, expense_id, user.id, expense)
+    out = await writes.apply(db, crud.stage_update_expense, expense_id, user.id, expense)
     if not out:
         raise HTTPException(status_code=404, detail="Expense not found or unauthorized")
     return out
@@ -130,7 +279,7 @@ async def update_expense(expense_id: int, expense: schemas.ExpenseCreate, curren
 @app.delete("/expenses/{expense_id}")
 async def delete_expense(expense_id: int, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
     user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
-    success = crud.delete_expense(db, expense_id, user.id)
+    success = await writes.apply(db, crud.stage_delete_expense, expense_id, user.id)
     if not success:
         raise HTTPException(status_code=404, detail="Expense not found or unauthorized")
     return {"success": True}
@@ -141,42 +290,150 @@ async def delete_expense(expense_id: int, current_user: dict = Depends(get_curre
 @app.post("/budgets/", response_model=schemas.Budget)
 async def set_budget(budget: schemas.BudgetCreate, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
     user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
-    return crud.set_budget(db, user.id, budget)
+    return await writes.apply(db, crud.stage_set_budget, user.id, budget)
 
-@app.get("/budgets/{month}", response_model=schemas.Budget)
-async def get_budget(month: str, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.get("/budgets/{month}", response_model=schemas.Budget, dependencies=[Depends(limit("read"))])
+async def get_budget(month: str, current_user: dict = Depends(get_current_user), db: Session = Depends(get_read_db)):
     user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
     result = crud.get_budget(db, user.id, month)
     if not result:
         raise HTTPException(status_code=404, detail="Budget not found")
     return result
 
-@app.get("/budgets_all/", response_model=list[schemas.Budget])
-async def get_all_budgets(current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.get("/budgets_all/", response_model=list[schemas.Budget], dependencies=[Depends(limit("read"))])
+async def get_all_budgets(current_user: dict = Depends(get_current_user), db: Session = Depends(get_read_db)):
     user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
     return crud.get_all_budgets(db, user.id)
 
+# =====================================================
+# Sync
+# =====================================================
+@app.get("/changes", dependencies=[Depends(limit("read"))])
+async def get_changes(since: int = 0, limit: int = 500, current_user: dict = Depends(get_current_user), db: Session = Depends(get_read_db)):
+    """
+    Expenses and budgets inserted, updated or deleted after cursor ``since``,
+    in commit order. Pass the returned ``cursor`` on the next call.
+    """
+    user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
+    try:
+        return changes.changes_since(db, user.id, since, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# =====================================================
+# Archive
+# =====================================================
+@app.get("/archive", dependencies=[Depends(limit("read"))])
+async def list_archived_years(current_user: dict = Depends(get_current_user), db: Session = Depends(get_read_db)):
+    """Years moved out of the expense list (still included in history and exports)."""
+    user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
+    return archive.archived_years(db, user.id)
+
+@app.post("/archive/{year}/restore", dependencies=[Depends(limit("export"))])
+async def restore_archived_year(year: int, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+    user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
+    restored = archive.restore(db, user.id, year)
+    if not restored:
+        raise HTTPException(status_code=404, detail="Year is not archived")
+    return {"year": year, "restored": restored}
+
+# =====================================================
+# Categories
+# =====================================================
+@app.get("/categories", dependencies=[Depends(limit("read"))])
+async def list_categories(current_user: dict = Depends(get_current_user), db: Session = Depends(get_read_db)):
+    """Built-in and your own categories, by group, with their aliases."""
+    user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
+    return categories.describe(db, user.id)
+
+@app.put("/categories/aliases")
+async def set_category_alias(body: schemas.CategoryAliasSet, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Make ``alias`` mean ``category``; existing expenses typed as the alias move to it."""
+    user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
+    try:
+        return categories.set_alias(db, user.id, body.alias, body.category)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.put("/categories/group")
+async def set_category_group(body: schemas.CategoryGroupSet, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+    user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
+    try:
+        return categories.set_group(db, user.id, body.category, body.group)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # =====================================================
 # Reports
 # =====================================================
-@app.get("/summary/")
-async def summary(month: str = None, category: str = None, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.get("/summary/", dependencies=[Depends(limit("analytics"))])
+async def summary(month: str = None, category: str = None, current_user: dict = Depends(get_current_user), db: Session = Depends(get_read_db)):
+    user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
+    # Identical concurrent calls share one computation (coalesce.py); " Food" and "food" are one key
+    category_key = categories.normalize(category)
+    return await flights.run_async("summary", user.id, {"month": month, "category": category_key}, lambda: cache.get_or_set(
+        "summary", f"{date.today()}:{month}:{category_key}",
+        lambda: jsonable_encoder(crud.summary_expenses(db, user.id, month, category)),
+        user_id=user.id,
+    ))
+
+@app.get("/report_by_category/", dependencies=[Depends(limit("analytics"))])
+async def report_by_category(month: str = None, current_user: dict = Depends(get_current_user), db: Session = Depends(get_read_db)):
     user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
-    return crud.summary_expenses(db, user.id, month, category)
+    return await flights.run_async("report_by_category", user.id, {"month": month}, lambda: cache.get_or_set(
+        "report_by_category", str(month),
+        lambda: crud.report_by_category(db, user.id, month),
+        user_id=user.id,
+    ))
 
-@app.get("/report_by_category/")
-async def report_by_category(month: str = None, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.get("/reports/history", dependencies=[Depends(limit("analytics"))])
+async def report_history(
+    from_month: str = Query(None, alias="from"),
+    to_month: str = Query(None, alias="to"),
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Month-by-month totals, category breakdown, budget vs. actual and daily
+    heatmap for ``from``..``to`` (YYYY-MM, default: the last 12 months).
+    """
     user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
-    return crud.report_by_category(db, user.id, month) 
+    today = date.today()
+    to_month = to_month or today.strftime("%Y-%m")
+    if not from_month:
+        y, m = today.year, today.month - 11
+        from_month = f"{y - 1}-{str(m + 12).zfill(2)}" if m < 1 else f"{y}-{str(m).zfill(2)}"
+    try:
+        return await flights.run_async("report_history", user.id, {"from": from_month, "to": to_month}, lambda: cache.get_or_set(
+            "report_history", f"{from_month}:{to_month}",
+            lambda: crud.report_history(db, user.id, from_month, to_month),
+            user_id=user.id,
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/reports/groups", dependencies=[Depends(limit("analytics"))])
+async def report_groups(from_date: date = None, to_date: date = None, current_user: dict = Depends(get_current_user), db: Session = Depends(get_read_db)):
+    """Spend per category group (e.g. Food = Food + Groceries + Restaurants), default: this month."""
+    user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
+    today = date.today()
+    from_date = from_date or today.replace(day=1)
+    to_date = to_date or today
+    return await flights.run_async("report_groups", user.id, {"from": from_date, "to": to_date}, lambda: cache.get_or_set(
+        "report_groups", f"{from_date}:{to_date}",
+        lambda: categories.group_totals(db, user.id, from_date, to_date),
+        user_id=user.id,
+    ))
+
 # =====================================================
 # Export CSV
 # =====================================================
-@app.get("/export/expenses/csv")
+@app.get("/export/expenses/csv", dependencies=[Depends(limit("export"))])
 async def export_expenses_csv(
     from_date: str,
     to_date: str,
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     user = crud.get_or_create_user_by_clerk(
         db, current_user["clerk_id"], current_user["email"]
@@ -207,27 +464,18 @@ async def export_expenses_csv(
             "Content-Disposition": f"attachment; filename={filename}"
         }
     )
-@app.get("/export/expenses")
+@app.get("/export/expenses", dependencies=[Depends(limit("export"))])
 async def export_expenses_csv(
     from_date: date,
     to_date: date,
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     user = crud.get_or_create_user_by_clerk(
         db, current_user["clerk_id"], current_user["email"]
     )
 
-    expenses = (
-        db.query(models.Expense)
-        .filter(
-            models.Expense.user_id == user.id,
-            models.Expense.date >= from_date,
-            models.Expense.date <= to_date
-        )
-        .order_by(models.Expense.date)
-        .all()
-    )
+    expenses = crud.expenses_for_export(db, user.id, from_date, to_date)
 
     output = io.StringIO()
     writer = csv.writer(output)
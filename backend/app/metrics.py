@@ -0,0 +1,274 @@
+"""
+In-process, Prometheus-style metrics.
+
+Counters, gauges and histograms live in a module-level registry and are
+rendered in the Prometheus text exposition format by ``render()``, which is
+served at ``/metrics``. Per-request SQL statistics are collected through
+SQLAlchemy cursor events and attached to the request currently being served
+via a context variable.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+logger = logging.getLogger("backend.app.requests")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+
+# =====================================================
+# Metric Types
+# =====================================================
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name + _format_labels(self.labelnames, key), value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type_name}"
+        for series, value in self.samples():
+            yield f"{series} {value}"
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def get(self, **labels) -> float:
+        """Number of observations recorded for the given labels."""
+        series = self._series.get(self._key(labels))
+        return series[-1] if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield self.name + "_bucket" + _format_labels(self.labelnames, key, f'le="{bound}"'), cumulative
+            yield self.name + "_bucket" + _format_labels(self.labelnames, key, 'le="+Inf"'), series[-1]
+            yield self.name + "_sum" + _format_labels(self.labelnames, key), series[-2]
+            yield self.name + "_count" + _format_labels(self.labelnames, key), series[-1]
+
+
+# =====================================================
+# Registry
+# =====================================================
+REGISTRY: Dict[str, _Metric] = {}
+
+
+def _register(metric: _Metric) -> _Metric:
+    REGISTRY[metric.name] = metric
+    return metric
+
+
+def counter(name, documentation, labelnames=()) -> Counter:
+    return REGISTRY.get(name) or _register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()) -> Gauge:
+    return REGISTRY.get(name) or _register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.get(name) or _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUESTS = counter("http_requests_total", "HTTP requests served.", ("method", "route", "status"))
+HTTP_LATENCY = histogram("http_request_duration_seconds", "HTTP request latency.", ("method", "route"))
+HTTP_IN_FLIGHT = gauge("http_requests_in_flight", "HTTP requests currently being served.", ("method", "route"))
+HTTP_DB_QUERIES = histogram("http_request_db_queries", "SQL statements executed per request.", ("route",), QUERY_COUNT_BUCKETS)
+HTTP_DB_TIME = histogram("http_request_db_seconds", "Cumulative SQL time per request.", ("route",))
+DB_QUERY_LATENCY = histogram("db_query_duration_seconds", "Latency of individual SQL statements.")
+EXTERNAL_REQUESTS = counter("external_requests_total", "Outbound calls to third-party services.", ("service", "operation", "outcome"))
+EXTERNAL_LATENCY = histogram("external_request_duration_seconds", "Outbound call latency.", ("service", "operation"))
+
+
+# =====================================================
+# Per-Request SQL Statistics
+# =====================================================
+class RequestStats:
+    __slots__ = ("queries", "db_time", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        # Only populated when a request is being profiled (see profiling.py)
+        self.statements = None
+
+
+# Holds a mutable RequestStats so that work done in the threadpool (sync
+# endpoints and dependencies run in a copied context) is still counted.
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    DB_QUERY_LATENCY.observe(elapsed)
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+        if stats.statements is not None:
+            stats.statements.append({"sql": statement, "ms": round(elapsed * 1000, 3)})
+
+
+def instrument_engine(engine):
+    """Attach query timing listeners to a SQLAlchemy engine."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# =====================================================
+# Outbound Calls
+# =====================================================
+@contextmanager
+def track_external(service: str, operation: str):
+    """Time an outbound call and count it as ``ok`` or ``error``."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        EXTERNAL_LATENCY.observe(time.perf_counter() - start, service=service, operation=operation)
+        EXTERNAL_REQUESTS.inc(service=service, operation=operation, outcome=outcome)
+
+
+# =====================================================
+# HTTP Middleware
+# =====================================================
+def route_template(request) -> str:
+    """Path template of the matching route, so metrics don't explode per id."""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", request.url.path)
+    return "unmatched"
+
+
+async def http_middleware(request, call_next):
+    method = request.method
+    route = route_template(request)
+    stats = RequestStats()
+    token = current_request.set(stats)
+    HTTP_IN_FLIGHT.inc(method=method, route=route)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        HTTP_IN_FLIGHT.dec(method=method, route=route)
+        HTTP_REQUESTS.inc(method=method, route=route, status=str(status))
+        HTTP_LATENCY.observe(elapsed, method=method, route=route)
+        HTTP_DB_QUERIES.observe(stats.queries, route=route)
+        HTTP_DB_TIME.observe(stats.db_time, route=route)
+        current_request.reset(token)
+        logger.info(json.dumps({
+            "event": "request",
+            "method": method,
+            "route": route,
+            "path": request.url.path,
+            "status": status,
+            "duration_ms": round(elapsed * 1000, 2),
+            "db_queries": stats.queries,
+            "db_ms": round(stats.db_time * 1000, 2),
+        }))
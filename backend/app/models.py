@@ -1,5 +1,5 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey, UniqueConstraint, Boolean
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, UniqueConstraint, Boolean, Index, LargeBinary
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
@@ -11,6 +11,10 @@ class User(Base):
     google_id = Column(String, unique=True, index=True, nullable=True)  # stores Clerk ID
     reminder_enabled = Column(Boolean, default=False)
     reminder_time = Column(String, default="20:00") # HH:MM
+    reminder_updated_at = Column(DateTime, nullable=True, index=True)  # last preference change, polled by the scheduler
+    data_updated_at = Column(DateTime, nullable=True)  # last expense/budget write, for snapshot freshness
+    data_version = Column(Integer, nullable=False, default=0)  # change feed counter, bumped by triggers (changes.py)
+    shard = Column(Integer, nullable=True)  # directory only: shard holding the user's data, NULL = this file (shards.py)
 
     expenses = relationship("Expense", back_populates="owner")
     budgets = relationship("Budget", back_populates="owner")
@@ -22,10 +26,43 @@ class Expense(Base):
     date = Column(Date, nullable=False)
     description = Column(String, nullable=False)
     amount = Column(Float, nullable=False)
-    category = Column(String, nullable=False)
+    category = Column(String, nullable=False)  # as entered; resolved into category_id
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=True)  # set on flush (categories.py)
     is_anomaly = Column(Boolean, default=False)
+    anomaly_score = Column(Float, nullable=True)  # robust z-score vs the category's recent history
+    anomaly_reason = Column(String, nullable=True)
+    version = Column(Integer, nullable=True)  # set by the change feed triggers
+    updated_at = Column(DateTime, nullable=True)
+    merchant_key = Column(String, nullable=True)  # normalized description, set on flush (recurring.py)
+    amount_band = Column(Integer, nullable=True)  # log-scale amount bucket, set on flush (recurring.py)
 
     owner = relationship("User", back_populates="expenses")
+    __table_args__ = (
+        # Per-category history in (date, id) order, read by anomaly scoring on every write
+        Index("ix_expenses_user_category", "user_id", "category_id", "date", "id"),
+        # Date-range rollups by category or group, answered from the index alone
+        Index("ix_expenses_user_date_category", "user_id", "date", "category_id", "amount"),
+        Index("ix_expenses_user_version", "user_id", "version"),
+        # Candidate recurring series in date order, one range per (merchant, amount band)
+        Index("ix_expenses_user_merchant", "user_id", "merchant_key", "amount_band", "date"),
+    )
+
+class Category(Base):
+    """A built-in (user_id NULL) or user category; groups are categories without a group (categories.py)."""
+    __tablename__ = "categories"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    key = Column(String, nullable=False)  # normalized name, unique per owner
+    name = Column(String, nullable=False)  # display name
+    group_id = Column(Integer, ForeignKey("categories.id"), nullable=True)
+
+class CategoryAlias(Base):
+    """Another normalized name for a category, built in (user_id NULL) or the user's own."""
+    __tablename__ = "category_aliases"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    alias = Column(String, nullable=False)
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=False)
 
 class Budget(Base):
     __tablename__ = "budgets"
@@ -33,6 +70,90 @@ class Budget(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     month = Column(String, nullable=False)  # format: YYYY-MM
     amount = Column(Float, nullable=False)
+    version = Column(Integer, nullable=True)  # set by the change feed triggers
+    updated_at = Column(DateTime, nullable=True)
 
     owner = relationship("User", back_populates="budgets")
-    __table_args__ = (UniqueConstraint('user_id', 'month', name='_user_month_uc'),)
\ No newline at end of file
+    __table_args__ = (
+        UniqueConstraint('user_id', 'month', name='_user_month_uc'),
+        Index("ix_budgets_user_version", "user_id", "version"),
+    )
+
+class DeletedRow(Base):
+    """Tombstone of a deleted expense or budget, for the change feed."""
+    __tablename__ = "deleted_rows"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    kind = Column(String, nullable=False)  # expense | budget
+    row_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (Index("ix_deleted_rows_user_version", "user_id", "version"),)
+
+class ExpenseArchive(Base):
+    """One user's expenses of one archived year, column-packed and compressed (archive.py)."""
+    __tablename__ = "expense_archives"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    year = Column(Integer, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    total = Column(Float, nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+    archived_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (UniqueConstraint('user_id', 'year', name='_user_year_uc'),)
+
+class ArchivedSummary(Base):
+    """Exact month x category totals of archived expenses, for reports."""
+    __tablename__ = "archived_summaries"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    month = Column(String, nullable=False)  # YYYY-MM
+    category = Column(String, nullable=False)
+    total = Column(Float, nullable=False)
+    count = Column(Integer, nullable=False)
+
+    __table_args__ = (UniqueConstraint('user_id', 'month', 'category', name='_user_month_category_uc'),)
+
+class Forecast(Base):
+    __tablename__ = "forecasts"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), unique=True, index=True)
+    as_of = Column(Date, nullable=False)  # last day of history used for the fit
+    daily_level = Column(Float, nullable=False)  # deseasonalized EWMA daily spend
+    dow_factors = Column(String, nullable=False)  # JSON list of 7 multipliers, Monday first
+    history_days = Column(Integer, nullable=False)
+
+
+class WrappedSnapshot(Base):
+    __tablename__ = "wrapped_snapshots"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    period = Column(String, nullable=False)  # month | quarter | year
+    period_key = Column(String, nullable=False)  # 2025-03 | 2025-Q1 | 2025
+    payload = Column(String, nullable=False)  # JSON story, as returned by GET /wrapped
+    generated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (UniqueConstraint('user_id', 'period', 'period_key', name='_user_period_uc'),)
+
+
+class RecurringCharge(Base):
+    __tablename__ = "recurring_charges"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    merchant_key = Column(String, nullable=False)
+    amount_band = Column(Integer, nullable=False)
+    description = Column(String, nullable=False)  # as last seen
+    category = Column(String, nullable=False)  # as last seen
+    period = Column(String, nullable=False)  # weekly | monthly | annual
+    interval_days = Column(Float, nullable=False)  # median days between charges
+    amount = Column(Float, nullable=False)  # mean charge
+    last_amount = Column(Float, nullable=False)
+    occurrences = Column(Integer, nullable=False)
+    first_seen = Column(Date, nullable=False)
+    last_seen = Column(Date, nullable=False)
+    next_expected = Column(Date, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (UniqueConstraint('user_id', 'merchant_key', 'amount_band', name='_user_merchant_band_uc'),)
@@ -0,0 +1,344 @@
+"""
+Opt-in, per-request profiler for debugging slow endpoints in production.
+
+A request is profiled only when it carries a token signed with
+``PROFILE_SECRET`` (``X-Profile-Token`` header or ``__profile`` query flag).
+Tokens are single-use: each carries a nonce, claimed in the shared cache by
+the first request that presents it.
+
+The request is run under a stack-sampling profiler that only records the
+request's own work: its handler task on the event loop and the threadpool
+threads running its sync endpoint (``ProfiledRoute``) or coalesced reads
+(``attach_thread``), so concurrent requests are not sampled. Each capture is
+written to ``PROFILE_DIR`` as a speedscope file plus a JSON sidecar holding the request's
+SQL statements and timings. Only the newest ``PROFILE_MAX_CAPTURES`` captures
+are kept on disk.
+"""
+import asyncio
+import contextvars
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Optional
+
+from fastapi import Header, HTTPException, status
+from fastapi.routing import APIRoute
+
+from .cache import cache
+from .metrics import current_request
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SECRET = os.environ.get("PROFILE_SECRET", "")
+PROFILE_DIR = os.environ.get(
+    "PROFILE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "profiles")
+)
+PROFILE_MAX_CAPTURES = int(os.environ.get("PROFILE_MAX_CAPTURES", "20"))
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "0.002"))
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROFILER_FILES = {os.path.join(APP_DIR, "profiling.py"), os.path.join(APP_DIR, "metrics.py")}
+
+# At most one profile runs at a time, to bound the sampling overhead
+_profile_lock = threading.Lock()
+
+# Sampler of the request being profiled, inherited by its tasks and threadpool work
+_active_sampler: contextvars.ContextVar[Optional["StackSampler"]] = contextvars.ContextVar(
+    "active_sampler", default=None
+)
+
+
+# =====================================================
+# Tokens
+# =====================================================
+def _signature(path: str, expires: int, nonce: str) -> str:
+    msg = f"{path}:{expires}:{nonce}".encode()
+    return hmac.new(PROFILE_SECRET.encode(), msg, hashlib.sha256).hexdigest()
+
+
+def sign_profile_token(path: str, ttl_seconds: int = 300) -> str:
+    """Token that enables profiling of one request to ``path`` within ``ttl_seconds``."""
+    expires = int(time.time()) + ttl_seconds
+    nonce = uuid.uuid4().hex
+    return f"{expires}.{nonce}.{_signature(path, expires, nonce)}"
+
+
+def verify_profile_token(token: Optional[str], path: str) -> bool:
+    """Check the token and use it up; a replayed token is rejected."""
+    if not PROFILE_SECRET or not token:
+        return False
+    try:
+        expires_str, nonce, sig = token.split(".", 2)
+        expires = int(expires_str)
+    except ValueError:
+        return False
+    ttl = expires - time.time()
+    if ttl <= 0 or not hmac.compare_digest(sig, _signature(path, expires, nonce)):
+        return False
+    # Shared by all workers with a Redis cache; fails closed if the cache is down
+    return cache.claim("profile-token", nonce, ttl)
+
+
+def require_admin(x_admin_token: str = Header(None)):
+    """Dependency guarding the profile management endpoints."""
+    if not PROFILE_SECRET or not x_admin_token or not hmac.compare_digest(x_admin_token, PROFILE_SECRET):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin token required")
+
+
+# =====================================================
+# Sampler
+# =====================================================
+class StackSampler(threading.Thread):
+    """
+    Periodically snapshots the stacks of the profiled request's work and
+    keeps the ones running application code. Work is attached while it runs:
+    a threadpool thread as a whole, an event loop thread only while the
+    request's task is the one running on it.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        super().__init__(daemon=True, name="request-profiler")
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+        # (thread id, task or None for the whole thread) -> nesting depth
+        self._owners = Counter()
+        self._owners_lock = threading.Lock()
+
+    def attach(self, thread_id: int, task: Optional[asyncio.Task] = None):
+        with self._owners_lock:
+            self._owners[(thread_id, task)] += 1
+
+    def detach(self, thread_id: int, task: Optional[asyncio.Task] = None):
+        with self._owners_lock:
+            self._owners[(thread_id, task)] -= 1
+            if self._owners[(thread_id, task)] <= 0:
+                del self._owners[(thread_id, task)]
+
+    def _owned(self, thread_id: int, owners) -> bool:
+        for owner_thread, task in owners:
+            if owner_thread != thread_id:
+                continue
+            if task is None or asyncio.current_task(task.get_loop()) is task:
+                return True
+        return False
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            with self._owners_lock:
+                owners = list(self._owners)
+            if not owners:
+                continue
+            for thread_id, frame in sys._current_frames().items():
+                if not self._owned(thread_id, owners):
+                    continue
+                stack = []
+                in_app = False
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    if code.co_filename.startswith(APP_DIR) and code.co_filename not in _PROFILER_FILES:
+                        in_app = True
+                    frame = frame.f_back
+                if in_app:
+                    self.stacks[tuple(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def to_speedscope(self, name: str, duration: float) -> dict:
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, count in self.stacks.items():
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    func, filename, line = frame
+                    frames.append({"name": func, "file": filename, "line": line})
+                ids.append(index[frame])
+            samples.append(ids)
+            weights.append(count * self.interval)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "expense-tracker-profiler",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": duration,
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+
+# =====================================================
+# Attaching Work to the Profiled Request
+# =====================================================
+@contextmanager
+def attach_thread():
+    """Sample the current thread while the block runs, if it works for a profiled request."""
+    sampler = _active_sampler.get()
+    if sampler is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    sampler.attach(thread_id)
+    try:
+        yield
+    finally:
+        sampler.detach(thread_id)
+
+
+@contextmanager
+def _attach_task():
+    sampler = _active_sampler.get()
+    task = asyncio.current_task() if sampler is not None else None
+    if task is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    sampler.attach(thread_id, task)
+    try:
+        yield
+    finally:
+        sampler.detach(thread_id, task)
+
+
+class ProfiledRoute(APIRoute):
+    """Route class that attaches the route's handler task and sync endpoint thread to a running profile."""
+
+    def get_route_handler(self):
+        call = self.dependant.call
+        if not asyncio.iscoroutinefunction(call):
+            # Sync endpoints run in the threadpool: attach the thread running them
+            @functools.wraps(call)
+            def run_sync(*args, **kwargs):
+                with attach_thread():
+                    return call(*args, **kwargs)
+            self.dependant.call = run_sync
+        handler = super().get_route_handler()
+
+        async def run(request):
+            with _attach_task():
+                return await handler(request)
+        return run
+
+
+# =====================================================
+# Capture Storage (bounded ring buffer on disk)
+# =====================================================
+def _capture_paths(profile_id: str):
+    base = os.path.join(PROFILE_DIR, profile_id)
+    return base + ".speedscope.json", base + ".meta.json"
+
+
+def _prune():
+    metas = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".meta.json"))
+    for name in metas[:max(0, len(metas) - PROFILE_MAX_CAPTURES)]:
+        for path in _capture_paths(name[: -len(".meta.json")]):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def save_capture(meta: dict, profile: dict) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_path, meta_path = _capture_paths(meta["id"])
+    with open(profile_path, "w") as f:
+        json.dump(profile, f)
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    _prune()
+    return meta["id"]
+
+
+def list_captures() -> List[dict]:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    out = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if name.endswith(".meta.json"):
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                meta = json.load(f)
+            meta.pop("sql", None)
+            out.append(meta)
+    return out
+
+
+def load_capture(profile_id: str):
+    """Return ``(speedscope_path, meta)`` or ``None`` if the capture is gone."""
+    if not profile_id.replace("-", "").isalnum():
+        return None
+    profile_path, meta_path = _capture_paths(profile_id)
+    if not os.path.exists(profile_path) or not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return profile_path, json.load(f)
+
+
+# =====================================================
+# HTTP Middleware
+# =====================================================
+async def profile_middleware(request, call_next):
+    token = request.headers.get("x-profile-token") or request.query_params.get("__profile")
+    if token is None or not verify_profile_token(token, request.url.path):
+        return await call_next(request)
+    if not _profile_lock.acquire(blocking=False):
+        response = await call_next(request)
+        response.headers["X-Profile-Status"] = "busy"
+        return response
+
+    try:
+        stats = current_request.get()
+        if stats is not None:
+            stats.statements = []
+        sampler = StackSampler()
+        start = time.perf_counter()
+        sampler.start()
+        active = _active_sampler.set(sampler)
+        try:
+            response = await call_next(request)
+        finally:
+            _active_sampler.reset(active)
+            sampler.stop()
+        duration = time.perf_counter() - start
+
+        # Time-ordered ids so the ring buffer can prune by name
+        profile_id = f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+        name = f"{request.method} {request.url.path}"
+        meta = {
+            "id": profile_id,
+            "method": request.method,
+            "path": request.url.path,
+            "status": response.status_code,
+            "created_at": time.time(),
+            "duration_ms": round(duration * 1000, 2),
+            "samples": sum(sampler.stacks.values()),
+            "db_queries": stats.queries if stats else None,
+            "db_ms": round(stats.db_time * 1000, 2) if stats else None,
+            "sql": stats.statements if stats else [],
+        }
+        try:
+            save_capture(meta, sampler.to_speedscope(name, duration))
+            response.headers["X-Profile-Id"] = profile_id
+        except OSError as e:
+            logger.warning("Could not store profile %s: %s", profile_id, e)
+        return response
+    finally:
+        _profile_lock.release()
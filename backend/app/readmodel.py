@@ -0,0 +1,47 @@
+"""
+Read models for analytics: expenses as plain tuples instead of ORM entities.
+
+Analytics (summary, by-category report, insights, spending profile,
+Wrapped) read a few columns of every expense in a range once. Loading
+``models.Expense`` entities for that builds an identity-mapped,
+change-tracked instance per row; ``expense_rows`` runs one Core
+``select()`` of just the columns analytics use and returns ``ExpenseRow``
+named tuples, with the same attribute names as the model, so consumers read
+``e.amount`` / ``e.date`` either way. Writes still go through the ORM.
+
+``python backend/bench_readmodel.py`` compares both at 100k rows per user.
+"""
+from datetime import date
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models
+
+
+class ExpenseRow(NamedTuple):
+    """An expense as analytics read it (the public fields of ``schemas.Expense``)."""
+    id: int
+    date: date
+    description: str
+    amount: float
+    category: str
+    category_id: Optional[int]
+    is_anomaly: bool
+    anomaly_score: Optional[float]
+    anomaly_reason: Optional[str]
+
+
+_COLUMNS = tuple(getattr(models.Expense, field) for field in ExpenseRow._fields)
+
+
+def expense_rows(db: Session, user_id: int, start: Optional[date] = None, end: Optional[date] = None) -> List[ExpenseRow]:
+    """The user's expenses dated ``start``..``end`` (either open), by date then id."""
+    stmt = select(*_COLUMNS).where(models.Expense.user_id == user_id)
+    if start is not None:
+        stmt = stmt.where(models.Expense.date >= start)
+    if end is not None:
+        stmt = stmt.where(models.Expense.date <= end)
+    stmt = stmt.order_by(models.Expense.date, models.Expense.id)
+    return [ExpenseRow._make(row) for row in db.execute(stmt)]
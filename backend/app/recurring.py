@@ -0,0 +1,301 @@
+"""
+Recurring charge (subscription) detection.
+
+Every expense carries a ``merchant_key``, its description lowercased with
+digits, punctuation, month names and payment boilerplate dropped ("NETFLIX.COM
+*8231" and "Netflix.com 0425" are both "netflix"), and an ``amount_band``, a
+~20% wide log-scale bucket of its amount. Both are set whenever the ORM
+flushes an expense. A merchant's expenses in adjacent bands are a candidate
+series (a price change or an amount near a band edge stays in one), read
+from one range of ``ix_expenses_user_merchant``.
+
+``detect`` makes one pass over a series: if the median gap between charges
+is close to a week, a month or a year and most gaps agree with it, the
+series is a recurring charge. Results live in ``recurring_charges`` and are
+kept current two ways:
+
+- on every expense write, ``refresh`` re-detects the series of the
+  expense's merchant (crud.py; a group-committed batch refreshes all of its
+  merchants in one query, see writes.py),
+- ``python -m backend.app.recurring`` re-detects every series of every user
+  in one ordered scan per database file (run it once after upgrading).
+
+``GET /recurring`` lists them, and the budget simulator prices dropping
+subscriptions from them instead of guessing.
+"""
+import argparse
+import calendar
+import logging
+import math
+import re
+import statistics
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, event, or_, text
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+BAND_RATIO = 1.2  # amounts within ~20% share a band
+DAYS_PER_MONTH = 30.44
+MAX_KEY_WORDS = 3
+MAX_SERIES_ROWS = 120  # most recent charges of a series considered
+MIN_AGREEING = 0.75  # share of gaps that must match the period
+LAPSE_FACTOR = 1.5  # no charge for 1.5 intervals: no longer active
+# Recurring, but not something to cancel
+ESSENTIAL_CATEGORIES = {"rent", "utilities"}
+
+
+class Period(NamedTuple):
+    name: str
+    days: float
+    tolerance: int  # days a gap may differ from ``days``
+    min_occurrences: int
+
+
+PERIODS = (
+    Period("weekly", 7, 1, 4),
+    Period("monthly", DAYS_PER_MONTH, 3, 3),
+    Period("annual", 365.25, 10, 2),
+)
+
+_NON_LETTERS = re.compile(r"[^a-z]+")
+_NOISE_WORDS = frozenset("""
+    payment pmt purchase pos debit credit card online www com net org inc ltd llc co the to from
+    ach ref txn autopay auto recurring subscription monthly annual yearly weekly bill renewal
+    jan feb mar apr may jun jul aug sep sept oct nov dec
+    january february march april june july august september october november december
+""".split())
+
+
+# =====================================================
+# Grouping keys
+# =====================================================
+def merchant_key(description: Optional[str]) -> Optional[str]:
+    words = [w for w in _NON_LETTERS.sub(" ", (description or "").lower()).split()
+             if len(w) > 1 and w not in _NOISE_WORDS]
+    return " ".join(words[:MAX_KEY_WORDS]) or None
+
+
+def amount_band(amount: Optional[float]) -> Optional[int]:
+    if amount is None or amount <= 0:
+        return None
+    return round(math.log(amount) / math.log(BAND_RATIO))
+
+
+def _set_keys(mapper, connection, target):
+    target.merchant_key = merchant_key(target.description)
+    target.amount_band = amount_band(target.amount)
+
+
+event.listen(models.Expense, "before_insert", _set_keys)
+event.listen(models.Expense, "before_update", _set_keys)
+
+
+_INDEX = ("CREATE INDEX IF NOT EXISTS ix_expenses_user_merchant "
+          "ON expenses (user_id, merchant_key, amount_band, date)")
+
+
+def install(engine):
+    """
+    Create the series index and key rows written before the columns existed.
+    Does nothing until the columns exist (see the startup migration in main.py).
+    """
+    with engine.begin() as conn:
+        columns = {row[1] for row in conn.execute(text("PRAGMA table_info(expenses)"))}
+        if "merchant_key" not in columns:
+            return
+        conn.execute(text(_INDEX))
+        rows = conn.execute(
+            text("SELECT id, description, amount FROM expenses WHERE merchant_key IS NULL")
+        ).all()
+        keyed = [{"id": i, "key": merchant_key(d), "band": amount_band(a)} for i, d, a in rows]
+        keyed = [k for k in keyed if k["key"] is not None]
+        if keyed:
+            conn.execute(text("UPDATE expenses SET merchant_key = :key, amount_band = :band WHERE id = :id"), keyed)
+            logger.info("Keyed %d expenses for recurring charge detection", len(keyed))
+
+
+# =====================================================
+# Detection
+# =====================================================
+def _next_charge(last: date, period: Period, interval: float) -> date:
+    if period.name == "weekly":
+        return last + timedelta(days=round(interval))
+    months = 1 if period.name == "monthly" else 12
+    year, month = divmod(last.month - 1 + months, 12)
+    year, month = last.year + year, month + 1
+    return date(year, month, min(last.day, calendar.monthrange(year, month)[1]))
+
+
+def detect(rows: Sequence) -> Optional[dict]:
+    """
+    ``rows`` of one series, (date, amount, description, category) in date
+    order. Returns the recurring charge's fields, or None if not periodic.
+    """
+    days: List[date] = []
+    for r in rows:
+        if not days or r.date != days[-1]:
+            days.append(r.date)  # several charges on one day count once
+    if len(days) < 2:
+        return None
+    gaps = [(b - a).days for a, b in zip(days, days[1:])]
+    interval = statistics.median(gaps)
+    period = next((p for p in PERIODS if abs(interval - p.days) <= p.tolerance), None)
+    if period is None or len(days) < period.min_occurrences:
+        return None
+    if sum(abs(g - period.days) <= period.tolerance for g in gaps) < MIN_AGREEING * len(gaps):
+        return None
+    last = rows[-1]
+    return {
+        "description": last.description,
+        "category": last.category,
+        "period": period.name,
+        "interval_days": float(interval),
+        "amount": round(sum(r.amount for r in rows) / len(rows), 2),
+        "last_amount": last.amount,
+        "occurrences": len(days),
+        "first_seen": days[0],
+        "last_seen": days[-1],
+        "next_expected": _next_charge(days[-1], period, interval),
+    }
+
+
+def series(rows: Sequence) -> List[Tuple[int, list]]:
+    """
+    Split one merchant's rows, in (amount_band, date) order, into candidate
+    series: runs of adjacent bands, so an amount near a band edge or a small
+    price change stays in one series. Returns (lowest band, rows by date).
+    """
+    runs: List[list] = []  # [first band, rows, last band]
+    for band, group in groupby(rows, key=lambda r: r.amount_band):
+        if runs and band - runs[-1][2] <= 1:
+            runs[-1][1].extend(group)
+            runs[-1][2] = band
+        else:
+            runs.append([band, list(group), band])
+    return [(first, sorted(run, key=lambda r: r.date)[-MAX_SERIES_ROWS:]) for first, run, _ in runs]
+
+
+def _series_query(db: Session):
+    return db.query(
+        models.Expense.user_id, models.Expense.merchant_key, models.Expense.amount_band,
+        models.Expense.date, models.Expense.amount, models.Expense.description, models.Expense.category,
+    ).filter(models.Expense.amount_band.isnot(None))
+
+
+def _charges(user_id: int, key: str, rows: Sequence, now: datetime) -> List[dict]:
+    charges = []
+    for band, run in series(rows):
+        found = detect(run)
+        if found is not None:
+            charges.append({"user_id": user_id, "merchant_key": key, "amount_band": band, "updated_at": now, **found})
+    return charges
+
+
+def _matching(model, keys):
+    # OR of pairs rather than a row-value IN, which SQLite answers with a table scan
+    return or_(*(and_(model.user_id == user_id, model.merchant_key == key) for user_id, key in keys))
+
+
+def refresh(db: Session, keys: Iterable[Tuple[int, Optional[str]]]) -> int:
+    """
+    Re-detect the series of ``(user_id, merchant_key)`` pairs after writes,
+    in the caller's transaction; returns charges found.
+    """
+    keys = {(user_id, key) for user_id, key in keys if key is not None}
+    if not keys:
+        return 0
+    rows = _series_query(db).filter(_matching(models.Expense, keys)).order_by(
+        models.Expense.user_id, models.Expense.merchant_key, models.Expense.amount_band,
+        models.Expense.date, models.Expense.id,
+    ).all()
+    now = datetime.now()
+    charges = []
+    for (user_id, key), series_rows in groupby(rows, key=lambda r: r[:2]):
+        charges += _charges(user_id, key, list(series_rows), now)
+    db.query(models.RecurringCharge).filter(_matching(models.RecurringCharge, keys)).delete(synchronize_session=False)
+    if charges:
+        db.bulk_insert_mappings(models.RecurringCharge, charges)
+    return len(charges)
+
+
+def detect_all(db: Session, user_ids: Optional[Iterable[int]] = None, batch_size: int = 5000) -> int:
+    """Rebuild ``recurring_charges`` for the given users (default: everyone); returns charges found."""
+    q = _series_query(db).filter(models.Expense.merchant_key.isnot(None))
+    stale = db.query(models.RecurringCharge)
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        q = q.filter(models.Expense.user_id.in_(user_ids))
+        stale = stale.filter(models.RecurringCharge.user_id.in_(user_ids))
+    # One ordered pass over the series index; each merchant is a contiguous range
+    q = q.order_by(models.Expense.user_id, models.Expense.merchant_key, models.Expense.amount_band,
+                   models.Expense.date, models.Expense.id)
+    now = datetime.now()
+    charges = []
+    for (user_id, key), rows in groupby(q.yield_per(batch_size), key=lambda r: r[:2]):
+        charges += _charges(user_id, key, list(rows), now)
+    stale.delete(synchronize_session=False)
+    db.bulk_insert_mappings(models.RecurringCharge, charges)
+    db.commit()
+    return len(charges)
+
+
+# =====================================================
+# Reads
+# =====================================================
+def is_active(charge: models.RecurringCharge, today: Optional[date] = None) -> bool:
+    today = today or date.today()
+    return (today - charge.last_seen).days <= charge.interval_days * LAPSE_FACTOR
+
+
+def monthly_cost(charge: models.RecurringCharge) -> float:
+    # At the current price: what cancelling would save
+    return round(charge.last_amount * DAYS_PER_MONTH / charge.interval_days, 2)
+
+
+def list_charges(db: Session, user_id: int, include_inactive: bool = False, today: Optional[date] = None) -> List[dict]:
+    charges = db.query(models.RecurringCharge).filter(models.RecurringCharge.user_id == user_id).all()
+    out = [
+        {
+            "id": c.id, "description": c.description, "merchant_key": c.merchant_key, "category": c.category,
+            "period": c.period, "interval_days": c.interval_days, "amount": c.amount,
+            "last_amount": c.last_amount, "occurrences": c.occurrences, "first_seen": c.first_seen,
+            "last_seen": c.last_seen, "next_expected": c.next_expected,
+            "active": is_active(c, today), "monthly_cost": monthly_cost(c),
+        }
+        for c in charges
+    ]
+    if not include_inactive:
+        out = [c for c in out if c["active"]]
+    return sorted(out, key=lambda c: (not c["active"], -c["monthly_cost"]))
+
+
+def subscriptions(db: Session, user_id: int, today: Optional[date] = None) -> List[models.RecurringCharge]:
+    """Active recurring charges that are discretionary (not rent, utilities, ...)."""
+    return [
+        c for c in db.query(models.RecurringCharge).filter(models.RecurringCharge.user_id == user_id)
+        if is_active(c, today) and c.category.strip().lower() not in ESSENTIAL_CATEGORIES
+    ]
+
+
+if __name__ == "__main__":
+    from .shards import session_factories
+
+    parser = argparse.ArgumentParser(description="Detect recurring charges for every user.")
+    parser.add_argument("--user-id", type=int, action="append", default=None, help="limit to these users (repeatable)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    count = 0
+    for open_session in session_factories():  # main file, then each tenant shard
+        session = open_session()
+        try:
+            count += detect_all(session, args.user_id)
+        finally:
+            session.close()
+    logger.info("Found %d recurring charges", count)
@@ -0,0 +1,244 @@
+"""
+Daily expense-logging reminders for users with ``reminder_enabled``.
+
+Enabled users are kept in a timing wheel with one bucket per minute of the
+day (keyed by their ``HH:MM`` ``reminder_time``). The wheel is loaded once at
+startup and updated incrementally when preferences change, so each scheduler
+tick only touches the bucket(s) that are due instead of scanning every user.
+Reminder times are interpreted in the server's local time.
+
+Preferences may be changed on any worker, while only one runs the scheduler
+(``REMINDER_SCHEDULER=0`` on the others). A change stamps
+``users.reminder_updated_at``, and every tick first re-reads the rows stamped
+since the previous one (``TimingWheel.refresh``), so the scheduler's wheel
+is at most a minute behind whichever worker served the change.
+
+Delivery goes through a pluggable sender; ``LogSender`` is the default and
+``MemorySender`` is a local stand-in that records what would have been sent.
+"""
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .metrics import counter
+
+logger = logging.getLogger(__name__)
+
+REMINDER_SCHEDULER_ENABLED = os.environ.get("REMINDER_SCHEDULER", "1") == "1"
+REMINDER_BATCH_SIZE = int(os.environ.get("REMINDER_BATCH_SIZE", "100"))
+REMINDER_MAX_CONCURRENCY = int(os.environ.get("REMINDER_MAX_CONCURRENCY", "4"))
+
+SLOTS_PER_DAY = 24 * 60
+# Changes are re-read this far back: a worker can commit a stamp older than
+# one the scheduler already saw
+REFRESH_OVERLAP = timedelta(minutes=1)
+
+REMINDERS_SENT = counter("reminders_sent_total", "Reminders handed to the sender.", ("outcome",))
+
+
+class Reminder(NamedTuple):
+    user_id: int
+    email: str
+    reminder_time: str
+
+
+def parse_slot(reminder_time: Optional[str]) -> Optional[int]:
+    """Minute of the day for an ``HH:MM`` string, or None if invalid."""
+    try:
+        hours, minutes = reminder_time.split(":")
+        hours, minutes = int(hours), int(minutes)
+    except (AttributeError, ValueError):
+        return None
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        return None
+    return hours * 60 + minutes
+
+
+# =====================================================
+# Timing Wheel
+# =====================================================
+class TimingWheel:
+    def __init__(self):
+        self._buckets: List[Dict[int, str]] = [{} for _ in range(SLOTS_PER_DAY)]
+        self._slot_of: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def update(self, user_id: int, email: str, enabled: bool, reminder_time: Optional[str]):
+        """Add, move or remove one user; O(1)."""
+        slot = parse_slot(reminder_time) if enabled else None
+        with self._lock:
+            old = self._slot_of.pop(user_id, None)
+            if old is not None:
+                self._buckets[old].pop(user_id, None)
+            if slot is not None:
+                self._buckets[slot][user_id] = email
+                self._slot_of[user_id] = slot
+
+    def remove(self, user_id: int):
+        self.update(user_id, "", False, None)
+
+    def due(self, slot: int) -> List[Reminder]:
+        label = f"{slot // 60:02d}:{slot % 60:02d}"
+        with self._lock:
+            items = list(self._buckets[slot].items())
+        return [Reminder(uid, email, label) for uid, email in items]
+
+    def load(self, *dbs: Session):
+        """Rebuild from the database, one session per tenant shard (startup only)."""
+        rows = []
+        for db in dbs:
+            # shard IS NULL: the user's row of record is in this file
+            rows += db.query(models.User.id, models.User.email, models.User.reminder_time).filter(
+                models.User.reminder_enabled == True, models.User.shard.is_(None)
+            ).all()
+        with self._lock:
+            self._buckets = [{} for _ in range(SLOTS_PER_DAY)]
+            self._slot_of = {}
+        for user_id, email, reminder_time in rows:
+            self.update(user_id, email, True, reminder_time)
+
+    def refresh(self, since: datetime, *dbs: Session) -> Optional[datetime]:
+        """Apply preference changes stamped at or after ``since``; returns the newest stamp seen."""
+        newest = None
+        for db in dbs:
+            rows = db.query(
+                models.User.id, models.User.email, models.User.reminder_enabled,
+                models.User.reminder_time, models.User.reminder_updated_at,
+            ).filter(models.User.reminder_updated_at >= since, models.User.shard.is_(None)).all()
+            for user_id, email, enabled, reminder_time, updated_at in rows:
+                self.update(user_id, email, bool(enabled), reminder_time)
+                newest = updated_at if newest is None else max(newest, updated_at)
+        return newest
+
+
+# =====================================================
+# Senders
+# =====================================================
+class ReminderSender:
+    async def send_batch(self, reminders: List[Reminder]):
+        raise NotImplementedError
+
+
+class LogSender(ReminderSender):
+    async def send_batch(self, reminders: List[Reminder]):
+        for r in reminders:
+            logger.info("Reminder due for user %s <%s> at %s", r.user_id, r.email, r.reminder_time)
+
+
+class MemorySender(ReminderSender):
+    """Records reminders instead of delivering them."""
+
+    def __init__(self):
+        self.sent: List[Reminder] = []
+        self.batches = 0
+
+    async def send_batch(self, reminders: List[Reminder]):
+        self.batches += 1
+        self.sent.extend(reminders)
+
+
+# =====================================================
+# Scheduler
+# =====================================================
+class ReminderScheduler:
+    def __init__(self, wheel: TimingWheel, sender: ReminderSender,
+                 batch_size: int = REMINDER_BATCH_SIZE, max_concurrency: int = REMINDER_MAX_CONCURRENCY):
+        self.wheel = wheel
+        self.sender = sender
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self._last_minute: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self._session_factories: List[Callable[[], Session]] = []
+        self._synced_at: Optional[datetime] = None
+
+    async def tick(self, now: Optional[datetime] = None) -> int:
+        """
+        Dispatch every bucket between the previous tick and ``now``, so a
+        late wake-up never skips a minute. Returns the number of reminders.
+        """
+        if self._session_factories:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.sync)
+            except Exception as e:
+                logger.warning("Reminder preference refresh failed: %s", e)
+        now = (now or datetime.now()).replace(second=0, microsecond=0)
+        if self._last_minute is None or now - self._last_minute > timedelta(days=1):
+            self._last_minute = now - timedelta(minutes=1)
+        due: List[Reminder] = []
+        minute = self._last_minute + timedelta(minutes=1)
+        while minute <= now:
+            due.extend(self.wheel.due(minute.hour * 60 + minute.minute))
+            minute += timedelta(minutes=1)
+        self._last_minute = max(self._last_minute, now)
+        if due:
+            await self._dispatch(due)
+        return len(due)
+
+    async def _dispatch(self, reminders: List[Reminder]):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def send(batch):
+            async with semaphore:
+                try:
+                    await self.sender.send_batch(batch)
+                    REMINDERS_SENT.inc(len(batch), outcome="ok")
+                except Exception as e:
+                    REMINDERS_SENT.inc(len(batch), outcome="error")
+                    logger.warning("Reminder batch of %d failed: %s", len(batch), e)
+
+        batches = [reminders[i:i + self.batch_size] for i in range(0, len(reminders), self.batch_size)]
+        await asyncio.gather(*(send(b) for b in batches))
+
+    async def run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception("Reminder tick failed")
+            now = datetime.now()
+            await asyncio.sleep(60 - now.second - now.microsecond / 1_000_000)
+
+    def _sessions(self, fn):
+        dbs = [factory() for factory in self._session_factories]
+        try:
+            return fn(*dbs)
+        finally:
+            for db in dbs:
+                db.close()
+
+    def sync(self):
+        """Pick up preference changes made on any worker since the last sync."""
+        newest = self._sessions(lambda *dbs: self.wheel.refresh(self._synced_at - REFRESH_OVERLAP, *dbs))
+        if newest is not None and newest > self._synced_at:
+            self._synced_at = newest
+
+    def start(self, *session_factories: Callable[[], Session]):
+        """Load the wheel (one session factory per tenant shard) and start ticking."""
+        self._session_factories = list(session_factories)
+        self._synced_at = datetime.now()  # changes during the load are re-read by the first sync
+        self._sessions(self.wheel.load)
+        logger.info("Reminder scheduler started with %d users", len(self.wheel))
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+wheel = TimingWheel()
+scheduler = ReminderScheduler(wheel, LogSender())
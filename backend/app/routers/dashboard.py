@@ -0,0 +1,48 @@
+from datetime import date
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session
+
+from .. import crud, dashboard, schemas, profiling
+from ..cache import cache
+from ..admission import limit
+from ..auth import get_current_user
+from .insights import get_read_db
+
+router = APIRouter(route_class=profiling.ProfiledRoute, tags=["dashboard"], dependencies=[Depends(limit("analytics"))])
+
+# Section name -> builder; each matches the standalone endpoint noted
+SECTIONS = {
+    "summary": lambda data: crud.summary_expenses(data.db, data.user_id, data.month, data=data),  # /summary/
+    "by_category": lambda data: crud.report_by_category(data.db, data.user_id, data.month, data=data),  # /report_by_category/
+    "budgets": lambda data: [schemas.Budget.from_orm(b) for b in data.budgets],  # /budgets_all/
+    "risk": dashboard.budget_risk,  # /budget/risk
+    "insights": dashboard.insights,  # /insights
+    "anomalies": dashboard.anomalies,  # /anomalies
+    "profile": dashboard.spending_profile,  # /spending-profile
+    "monthly_diff": dashboard.monthly_diff,  # /reports/monthly-diff
+}
+
+
+@router.get("/dashboard")
+def get_dashboard(month: str = None, sections: str = None, current_user: dict = Depends(get_current_user), db: Session = Depends(get_read_db)):
+    """
+    Every dashboard section in one response, computed from one shared fetch
+    of the month's rows, budgets and last-month aggregates. ``month``
+    defaults to the current one; ``sections`` is a comma-separated subset
+    of the section names (default: all).
+    """
+    user = crud.get_or_create_user_by_clerk(db, current_user["clerk_id"], current_user["email"])
+    names = [s.strip() for s in sections.split(",") if s.strip()] if sections else list(SECTIONS)
+    unknown = [n for n in names if n not in SECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sections: {', '.join(unknown)}. Available: {', '.join(SECTIONS)}")
+
+    today = date.today()
+    data = dashboard.DashboardData(db, user.id, month or today.strftime("%Y-%m"), today)
+    return cache.get_or_set(
+        "dashboard", f"{today}:{data.month}:{','.join(names)}",
+        lambda: jsonable_encoder({name: SECTIONS[name](data) for name in names}),
+        user_id=user.id,
+    )
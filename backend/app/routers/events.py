@@ -0,0 +1,43 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from .. import crud, db, events, profiling
+from ..auth import get_current_user_for_stream
+
+router = APIRouter(route_class=profiling.ProfiledRoute, tags=["events"])
+
+
+@router.get("/events")
+async def stream_events(
+    request: Request,
+    last_event_id: Optional[str] = Query(None),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+    current_user: dict = Depends(get_current_user_for_stream),
+):
+    """
+    Server-Sent Events stream of the user's expense and budget changes.
+    Reconnecting clients resume from ``Last-Event-ID``; a ``resync`` event
+    means some changes were missed and the dashboard should refetch.
+    """
+    # Short-lived session: the stream must not hold a connection open
+    session = db.SessionLocal()
+    try:
+        user_id = crud.get_or_create_user_by_clerk(session, current_user["clerk_id"], current_user["email"]).id
+    finally:
+        session.close()
+
+    try:
+        sub = events.broker.subscribe(user_id, max_connections=events.MAX_CONNECTIONS_PER_USER)
+    except events.TooManyStreams:
+        raise HTTPException(status_code=429, detail="Too many open event streams")
+
+    return StreamingResponse(
+        events.stream(request, sub, last_event_id_header or last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Also releases the slot if the client leaves before the stream starts
+        background=BackgroundTask(events.broker.unsubscribe, sub),
+    )
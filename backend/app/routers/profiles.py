@@ -0,0 +1,52 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+
+from .. import profiling
+
+router = APIRouter(
+    prefix="/admin/profiles",
+    tags=["admin"],
+    dependencies=[Depends(profiling.require_admin)],
+    route_class=profiling.ProfiledRoute,
+)
+
+
+@router.get("")
+def list_profiles():
+    """
+    Captured request profiles, newest first.
+    """
+    return profiling.list_captures()
+
+
+@router.post("/token")
+def create_profile_token(path: str, ttl_seconds: int = 300):
+    """
+    Signed, single-use token that profiles the next request to `path` when
+    sent as the `X-Profile-Token` header (or `__profile` query parameter).
+    """
+    return {"path": path, "token": profiling.sign_profile_token(path, ttl_seconds)}
+
+
+@router.get("/{profile_id}")
+def download_profile(profile_id: str):
+    """
+    Download the call tree in speedscope format (open at speedscope.app).
+    """
+    capture = profiling.load_capture(profile_id)
+    if not capture:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    path, _ = capture
+    return FileResponse(path, media_type="application/json", filename=f"{profile_id}.speedscope.json")
+
+
+@router.get("/{profile_id}/sql")
+def get_profile_sql(profile_id: str):
+    """
+    Request metadata plus every SQL statement it ran, with timings.
+    """
+    capture = profiling.load_capture(profile_id)
+    if not capture:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    _, meta = capture
+    return meta
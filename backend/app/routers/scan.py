@@ -1,13 +1,20 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+import logging
+
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from backend.app import profiling
+from backend.app.admission import limit
 from backend.app.vision import extract_receipt_data
-from google.api_core.exceptions import PermissionDenied
 
 router = APIRouter(
     prefix="/scan",
     tags=["scan"],
+    dependencies=[Depends(limit("ocr"))],
     responses={404: {"description": "Not found"}},
+    route_class=profiling.ProfiledRoute,
 )
 
+logger = logging.getLogger(__name__)
+
 @router.post("/upload")
 async def scan_receipt(file: UploadFile = File(...)):
     """
@@ -21,11 +28,14 @@ async def scan_receipt(file: UploadFile = File(...)):
     try:
         data = extract_receipt_data(contents)
         return data
-    except PermissionDenied as e:
-        print(f"Billing Error: {e}")
-        raise HTTPException(status_code=402, detail="Google Cloud Billing is disabled. Please enable it in the Google Cloud Console.")
+    except ImportError as e:
+        logger.error("Vision client unavailable: %s", e)
+        raise HTTPException(status_code=503, detail="Receipt scanning is not available")
     except Exception as e:
-        print(f"Error processing image: {e}")
-        import traceback
-        traceback.print_exc()
+        # Imported here: the Google libraries load with the first scan (see vision.get_client)
+        from google.api_core.exceptions import PermissionDenied
+        if isinstance(e, PermissionDenied):
+            logger.error("Billing error from Vision API: %s", e)
+            raise HTTPException(status_code=402, detail="Google Cloud Billing is disabled. Please enable it in the Google Cloud Console.")
+        logger.exception("Error processing image: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
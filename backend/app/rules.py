@@ -0,0 +1,320 @@
+"""
+Declarative insight rules over single-pass aggregates.
+
+Every registered aggregator (sums by category id, weekday buckets, keyword
+counters, counts) is fed by one pass over the expense rows; the results are
+exposed as ``Facts``, with category names and groups read through the
+user's category catalog (``context["catalog"]``, see categories.py). Insights, spending profiles and Wrapped patterns and
+personalities are plain functions registered with ``@rule(group)`` that read
+those facts, so adding a rule never adds a query or another scan.
+
+A rule returns ``None`` when it does not apply, otherwise one output (or a
+list of outputs). Rules in a group run in ``order``.
+"""
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+# Category groups (a group covers its member categories, built in or the user's)
+FOOD_GROUPS = ("food",)
+ENTERTAINMENT_GROUPS = ("entertainment", "shopping")
+COFFEE_KEYWORDS = ("coffee", "starbucks", "cafe")
+
+
+# =====================================================
+# Streaming Aggregators
+# =====================================================
+class Aggregator:
+    def feed(self, row):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class Total(Aggregator):
+    def __init__(self):
+        self.value = 0.0
+
+    def feed(self, row):
+        self.value += row.amount
+
+    def result(self):
+        return self.value
+
+
+class Count(Aggregator):
+    def __init__(self):
+        self.value = 0
+
+    def feed(self, row):
+        self.value += 1
+
+    def result(self):
+        return self.value
+
+
+class SumBy(Aggregator):
+    """Amount summed per value of a row attribute, in first-seen order."""
+
+    def __init__(self, field: str):
+        self.field = field
+        self.totals = defaultdict(float)
+
+    def feed(self, row):
+        self.totals[getattr(row, self.field)] += row.amount
+
+    def result(self):
+        return dict(self.totals)
+
+
+class WeekdaySum(Aggregator):
+    """Amount per weekday, Monday first."""
+
+    def __init__(self):
+        self.buckets = [0.0] * 7
+
+    def feed(self, row):
+        self.buckets[row.date.weekday()] += row.amount
+
+    def result(self):
+        return self.buckets
+
+
+AGGREGATORS: Dict[str, Callable[[], Aggregator]] = {}
+
+
+def register_aggregator(name: str, factory: Callable[[], Aggregator]):
+    AGGREGATORS[name] = factory
+
+
+register_aggregator("total", Total)
+register_aggregator("count", Count)
+register_aggregator("by_category_id", lambda: SumBy("category_id"))
+register_aggregator("by_weekday", WeekdaySum)
+# Keyword facts such as "coffee_trips" come from the full-text index
+# (search.count_matches) via the context instead of scanning descriptions.
+
+
+# =====================================================
+# Facts
+# =====================================================
+class Facts:
+    """Aggregator results plus caller context (budget, last month, ...)."""
+
+    def __init__(self, values: Dict[str, Any], context: Optional[Dict[str, Any]] = None):
+        self._values = dict(context or {})
+        self._values.update(values)
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def get(self, name, default=None):
+        return self._values.get(name, default)
+
+    @property
+    def weekend_total(self) -> float:
+        return self.by_weekday[5] + self.by_weekday[6]
+
+    @property
+    def by_category(self) -> Dict[str, float]:
+        """Totals by canonical category name."""
+        if "by_category" not in self._values:
+            self._values["by_category"] = self.catalog.by_name(self.by_category_id)
+        return self._values["by_category"]
+
+    @property
+    def top_category(self) -> Optional[str]:
+        return max(self.by_category, key=self.by_category.get) if self.by_category else None
+
+    @property
+    def top_amount(self) -> float:
+        top = self.top_category
+        return self.by_category[top] if top else 0
+
+    def group_sum(self, groups: Iterable[str]) -> float:
+        members = self.catalog.members(*groups)
+        return sum(amount for cid, amount in self.by_category_id.items() if cid in members)
+
+    def share(self, amount: float) -> float:
+        """Fraction of the total; 0 when nothing was spent."""
+        return amount / self.total if self.total > 0 else 0.0
+
+
+def aggregate(rows: Iterable, context: Optional[Dict[str, Any]] = None) -> Facts:
+    """Feed every registered aggregator from a single pass over ``rows``."""
+    aggs = [(name, factory()) for name, factory in AGGREGATORS.items()]
+    feeders = [a.feed for _, a in aggs]
+    for row in rows:
+        for feed in feeders:
+            feed(row)
+    return Facts({name: a.result() for name, a in aggs}, context)
+
+
+# =====================================================
+# Rule Registry
+# =====================================================
+class Rule(NamedTuple):
+    name: str
+    order: int
+    fn: Callable[[Facts], Any]
+
+
+RULES: Dict[str, List[Rule]] = defaultdict(list)
+
+
+def rule(group: str, order: int = 100):
+    def decorator(fn):
+        RULES[group].append(Rule(fn.__name__, order, fn))
+        RULES[group].sort(key=lambda r: r.order)
+        return fn
+    return decorator
+
+
+def evaluate(group: str, facts: Facts) -> List[Any]:
+    """All outputs of a group's rules, in rule order."""
+    out = []
+    for r in RULES[group]:
+        result = r.fn(facts)
+        if result is None:
+            continue
+        out.extend(result if isinstance(result, list) else [result])
+    return out
+
+
+def first(group: str, facts: Facts, default=None):
+    """Output of the first rule in the group that applies."""
+    for r in RULES[group]:
+        result = r.fn(facts)
+        if result is not None:
+            return result
+    return default
+
+
+# =====================================================
+# Insights (GET /insights)
+# =====================================================
+@rule("insights", order=10)
+def concentration(f: Facts):
+    if f.total > 0:
+        percentage = f.share(f.top_amount) * 100
+        if percentage > 40:
+            return {
+                "type": "concentration",
+                "text": f"{f.top_category} makes up {int(percentage)}% of your spending — a deviation here will immediately impact your ability to pay essential bills.",
+                "icon": "📊"
+            }
+
+
+@rule("insights", order=20)
+def category_surge(f: Facts):
+    out = []
+    last_month = f.get("last_month_by_category", {})
+    for cat, curr_amt in f.by_category.items():
+        prev_amt = last_month.get(cat, 0)
+        if prev_amt > 50: # Only significant amounts
+            change = ((curr_amt - prev_amt) / prev_amt) * 100
+            if change > 30:
+                out.append({
+                    "type": "increase",
+                    "text": f"Spending on {cat} spiked {int(change)}% vs last month. This unexpected volatility shortens your budget runway.",
+                    "icon": "📈"
+                })
+    return out or None
+
+
+@rule("insights", order=30)
+def weekend_warrior(f: Facts):
+    if f.share(f.weekend_total) > 0.5:
+        return {
+            "type": "weekend",
+            "text": "Over 50% of your spending happens on weekends. This 'binge-spending' pattern leaves you vulnerable on weekdays.",
+            "icon": "🎉"
+        }
+
+
+@rule("insights", order=40)
+def coffee_habit(f: Facts):
+    coffee_trips = f.get("coffee_trips", 0)
+    if coffee_trips > 5:
+        return {
+            "type": "habit",
+            "text": f"You made {coffee_trips} coffee trips this month. These micro-transactions are silently draining your adjustable income.",
+            "icon": "☕"
+        }
+
+
+# =====================================================
+# Spending Profile (GET /spending-profile)
+# =====================================================
+@rule("profile", order=10)
+def weekend_spender(f: Facts):
+    if f.share(f.weekend_total) > 0.40:
+        return {"profile": "Weekend Spender", "description": "You spend 40% of your money in 2 days. This volatility creates Monday-Friday cash flow gaps.", "icon": "🎉"}
+
+
+@rule("profile", order=20)
+def food_dominant(f: Facts):
+    if f.share(f.group_sum(FOOD_GROUPS)) > 0.50:
+        return {"profile": "Food-Dominant", "description": "Food costs are eating 50% of your budget. One less meal out extends your runway by 3 days.", "icon": "🍔"}
+
+
+# =====================================================
+# Money Wrapped Patterns
+# =====================================================
+@rule("wrapped_patterns", order=10)
+def dominant_category(f: Facts):
+    if f.total > 0:
+        top_pct = f.share(f.top_amount) * 100
+        if top_pct > 40:
+            return f"🎬 {int(top_pct)}% spent on {f.top_category}"
+
+
+@rule("wrapped_patterns", order=20)
+def weekend_vibe(f: Facts):
+    # Proxy for 'Late Night' if we lack time
+    if f.share(f.weekend_total) > 0.35:
+        return f"⚡ One weekend consumed {int(f.share(f.weekend_total) * 100)}% of your budget"
+
+
+@rule("wrapped_patterns", order=30)
+def purchase_frequency(f: Facts):
+    if f.count > 15:
+        return "🛒 You averaged a purchase every 2 days"
+    if f.count > 0 and (f.total / f.count) > 100:
+        return "💎 You prefer few, high-value purchases"
+
+
+# =====================================================
+# Money Wrapped Personality (first match wins)
+# =====================================================
+@rule("wrapped_personality", order=10)
+def late_night_entertainer(f: Facts):
+    if f.share(f.group_sum(ENTERTAINMENT_GROUPS)) > 0.5:
+        return ("Late-Night Entertainer", "Your money wakes up after 9 PM. Entertainment rules your weekends.")
+
+
+@rule("wrapped_personality", order=20)
+def food_first(f: Facts):
+    if f.share(f.group_sum(FOOD_GROUPS)) > 0.5:
+        return ("Food-First Thinker", "Taste comes first. Dining out is your primary love language.")
+
+
+@rule("wrapped_personality", order=30)
+def impulse_buyer(f: Facts):
+    if f.total > 0 and f.count > 20 and (f.total / f.budget) < 0.8:
+        return ("Impulse Buyer", "Lots of small taps. You love the dopamine of a new purchase.")
+
+
+@rule("wrapped_personality", order=40)
+def budget_optimist(f: Facts):
+    if f.total > 0 and (f.total / f.budget) < 0.3:
+        return ("Budget Optimist", "You're playing it safe. Maybe too safe? Live a little.")
+
+
+@rule("wrapped_personality", order=50)
+def weekend_warrior_personality(f: Facts):
+    if f.share(f.weekend_total) > 0.6:
+        return ("Weekend Warrior", "Mon-Fri you save. Sat-Sun you behave like a different person.")
@@ -13,7 +13,10 @@ class ExpenseCreate(ExpenseBase):
 
 class Expense(ExpenseBase):
     id: int
+    category_id: Optional[int] = None  # catalog id the category resolved to (GET /categories)
     is_anomaly: bool = False
+    anomaly_score: Optional[float] = None
+    anomaly_reason: Optional[str] = None
     class Config:
         orm_mode = True
 
@@ -48,4 +51,37 @@ class UserPreferences(BaseModel):
 
 class Summary(BaseModel):
     total: float
-    expenses: list[Expense]
\ No newline at end of file
+    expenses: list[Expense]
+
+class RecurringCharge(BaseModel):
+    id: int
+    description: str
+    merchant_key: str
+    category: str
+    period: str  # weekly | monthly | annual
+    interval_days: float
+    amount: float  # mean charge
+    last_amount: float
+    occurrences: int
+    first_seen: date
+    last_seen: date
+    next_expected: date
+    active: bool
+    monthly_cost: float
+
+class CategoryAliasSet(BaseModel):
+    alias: str
+    category: str  # name or alias of an existing category
+
+class CategoryGroupSet(BaseModel):
+    category: str  # one of your own categories
+    group: Optional[str] = None  # a top-level category; None makes it top-level
+
+class CategoryCut(BaseModel):
+    category: str
+    percents: list[float]  # options to try, 0-100
+
+class SimulationGrid(BaseModel):
+    category_cuts: list[CategoryCut] = []
+    remove_recurring: list[str] = []  # descriptions of recurring charges to try dropping (see GET /recurring)
+    daily_adjustments: list[float] = [0.0]  # extra spend per day, negative saves
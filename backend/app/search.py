@@ -0,0 +1,162 @@
+"""
+Full-text search over expenses with an SQLite FTS5 index.
+
+``expenses_fts`` is an external-content FTS5 table over
+``expenses.description`` and ``expenses.category``, kept in sync by triggers
+so every write path (ORM, bulk jobs, raw SQL) updates it. ``install`` creates
+the table and triggers and backfills existing rows the first time it runs.
+"""
+import base64
+import json
+import re
+from datetime import date
+from typing import Iterable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import categories
+
+FTS_TABLE = "expenses_fts"
+MAX_PAGE_SIZE = 100
+
+_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        description, category,
+        content='expenses', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS expenses_fts_ai AFTER INSERT ON expenses BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, description, category) VALUES (new.id, new.description, new.category);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS expenses_fts_ad AFTER DELETE ON expenses BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, category) VALUES ('delete', old.id, old.description, old.category);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS expenses_fts_au AFTER UPDATE OF description, category ON expenses BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, category) VALUES ('delete', old.id, old.description, old.category);
+        INSERT INTO {FTS_TABLE}(rowid, description, category) VALUES (new.id, new.description, new.category);
+    END""",
+]
+
+_TOKEN_RE = re.compile(r"\w+\*?", re.UNICODE)
+
+
+def install(engine):
+    """Create the FTS table and sync triggers; backfill on first install."""
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+        ).first()
+        for stmt in _DDL:
+            conn.execute(text(stmt))
+        if not exists:
+            conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def build_match(q: str, prefix: bool = True) -> Optional[str]:
+    """
+    Turn user input into a safe FTS5 MATCH expression: every word is quoted
+    (so operators in the input are literal), ``word*`` is a prefix query and,
+    with ``prefix``, so is the last word (search-as-you-type).
+    """
+    tokens = _TOKEN_RE.findall(q)
+    if not tokens:
+        return None
+    terms = []
+    for i, tok in enumerate(tokens):
+        is_prefix = tok.endswith("*") or (prefix and i == len(tokens) - 1)
+        terms.append(f'"{tok.rstrip("*")}"' + ("*" if is_prefix else ""))
+    return " ".join(terms)
+
+
+def _encode_cursor(value, row_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, row_id]).encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def search_expenses(db: Session, user_id: int, q: str, category: Optional[str] = None,
+                    from_date: Optional[date] = None, to_date: Optional[date] = None,
+                    sort: str = "rank", limit: int = 20, cursor: Optional[str] = None,
+                    prefix: bool = True) -> dict:
+    """
+    Ranked (bm25) or newest-first search with keyset pagination: the cursor
+    is the sort key of the last row returned, so deep pages cost the same as
+    the first one.
+    """
+    match = build_match(q, prefix)
+    if match is None:
+        return {"results": [], "next_cursor": None}
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    filters = [f"f.{FTS_TABLE} MATCH :match", "e.user_id = :user_id"]
+    params = {"match": match, "user_id": user_id, "limit": limit + 1}
+    if category:
+        # Any spelling or alias of the category, as in /summary/
+        category_id = categories.load(db, user_id).resolve(category)
+        if category_id is None:
+            return {"results": [], "next_cursor": None}
+        filters.append("e.category_id = :category_id")
+        params["category_id"] = category_id
+    if from_date:
+        filters.append("e.date >= :from_date")
+        params["from_date"] = str(from_date)
+    if to_date:
+        filters.append("e.date <= :to_date")
+        params["to_date"] = str(to_date)
+
+    if sort == "date":
+        order, key_col, page_filter = "date DESC, id DESC", "date", "(date, id) < (:k, :kid)"
+    elif sort == "rank":
+        order, key_col, page_filter = "rank ASC, id ASC", "rank", "(rank, id) > (:k, :kid)"
+    else:
+        raise ValueError("sort must be 'rank' or 'date'")
+
+    outer_where = ""
+    if cursor:
+        params["k"], params["kid"] = _decode_cursor(cursor)
+        outer_where = f"WHERE {page_filter}"
+
+    sql = f"""
+        SELECT * FROM (
+            SELECT e.id AS id, e.date AS date, e.description AS description, e.amount AS amount,
+                   e.category AS category, e.is_anomaly AS is_anomaly, bm25(f.{FTS_TABLE}) AS rank
+            FROM {FTS_TABLE} AS f JOIN expenses AS e ON e.id = f.rowid
+            WHERE {" AND ".join(filters)}
+        ) {outer_where}
+        ORDER BY {order}
+        LIMIT :limit
+    """
+    rows = db.execute(text(sql), params).mappings().all()
+
+    results = [dict(r, is_anomaly=bool(r["is_anomaly"])) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = results[-1]
+        next_cursor = _encode_cursor(last[key_col], last["id"])
+    return {"results": results, "next_cursor": next_cursor}
+
+
+def count_matches(db: Session, user_id: int, keywords: Iterable[str],
+                  from_date: Optional[date] = None, to_date: Optional[date] = None) -> int:
+    """Number of the user's expenses with a description word starting with any keyword."""
+    match = "description : (" + " OR ".join(f'"{k}"*' for k in keywords) + ")"
+    filters = [f"f.{FTS_TABLE} MATCH :match", "e.user_id = :user_id"]
+    params = {"match": match, "user_id": user_id}
+    if from_date:
+        filters.append("e.date >= :from_date")
+        params["from_date"] = str(from_date)
+    if to_date:
+        filters.append("e.date <= :to_date")
+        params["to_date"] = str(to_date)
+    sql = f"""
+        SELECT COUNT(*) FROM {FTS_TABLE} AS f JOIN expenses AS e ON e.id = f.rowid
+        WHERE {" AND ".join(filters)}
+    """
+    return db.execute(text(sql), params).scalar()
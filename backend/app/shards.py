@@ -0,0 +1,310 @@
+"""
+Tenant sharding: each user's data lives in one of ``DB_SHARDS`` SQLite files.
+
+``DB_FILE`` stays the directory: its ``users`` table allocates user ids and
+records in ``users.shard`` where each user's data lives (NULL: in
+``DB_FILE`` itself, as before sharding). Every shard file has the full
+schema, including the user's own ``users`` row (preferences, change feed
+counter), so a request touches the directory once to find the user and
+everything else runs against one shard: writers on different shards no
+longer share a lock, a WAL or a page cache.
+
+New users are placed by consistent hashing of their id (``HashRing``), so
+adding a shard only moves the users whose ring segment it takes over.
+``python -m backend.app.shards rebalance`` moves users whose recorded shard
+differs from their ring placement, one user at a time and online (this is
+also how an existing single-file database is sharded):
+
+1. take the source file's write lock (writers of that shard wait),
+2. copy the user's rows into the target in one transaction,
+3. point the directory at the target,
+4. delete the rows from the source and release the lock.
+
+Expense and budget rows get new ids in the target (ids are per file), and
+so do the user's own categories and aliases, with expenses re-pointed at
+them (built-in categories are seeded in every file); the old ids are
+tombstoned, so delta-sync clients (``/changes``) see the move
+as deletes plus inserts. A writer that resolved the old location before the
+move fails with ``UserMoved`` instead of writing into the source (see
+``crud.touch_user_data``) and succeeds on retry.
+
+With ``DB_SHARDS=0`` (the default) the ring is empty and every user stays
+in ``DB_FILE``.
+"""
+import argparse
+import bisect
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import categories, models
+from .db import SHARD_COUNT, SessionLocal, ReadSessionLocal, engine_for, locations
+
+logger = logging.getLogger(__name__)
+
+VNODES = 64  # ring points per shard
+MAX_CACHED_USERS = 100000
+
+
+class UserMoved(Exception):
+    """The user's data moved to another shard after it was resolved; retry."""
+
+    def __init__(self, user_id: int):
+        super().__init__(f"User {user_id} moved to another shard")
+        self.user_id = user_id
+
+
+# =====================================================
+# Placement
+# =====================================================
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, shards: int, vnodes: int = VNODES):
+        points = sorted((_hash(f"shard-{s}#{v}"), s) for s in range(shards) for v in range(vnodes))
+        self._keys = [p for p, _ in points]
+        self._shards = [s for _, s in points]
+
+    def shard_for(self, user_id: int) -> Optional[int]:
+        if not self._keys:
+            return None
+        i = bisect.bisect(self._keys, _hash(f"user-{user_id}")) % len(self._keys)
+        return self._shards[i]
+
+
+ring = HashRing(SHARD_COUNT)
+
+
+class Resolver:
+    """Clerk id -> (user id, location), read from the directory and cached."""
+
+    def __init__(self, max_users: int = MAX_CACHED_USERS):
+        self.max_users = max_users
+        self._cache: "OrderedDict[str, Tuple[int, Optional[int]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def locate(self, clerk_id: str, email: str) -> Tuple[int, Optional[int]]:
+        with self._lock:
+            hit = self._cache.get(clerk_id)
+            if hit is not None:
+                self._cache.move_to_end(clerk_id)
+                return hit
+        found = self._lookup(ReadSessionLocal, clerk_id) or self._create(clerk_id, email)
+        with self._lock:
+            self._cache[clerk_id] = found
+            while len(self._cache) > self.max_users:
+                self._cache.popitem(last=False)
+        return found
+
+    def forget(self, user_id: int):
+        with self._lock:
+            for clerk_id in [k for k, (uid, _) in self._cache.items() if uid == user_id]:
+                del self._cache[clerk_id]
+
+    def _lookup(self, session_factory, clerk_id: str):
+        directory = session_factory()
+        try:
+            row = directory.query(models.User.id, models.User.shard).filter(models.User.google_id == clerk_id).first()
+            return (row.id, row.shard) if row else None
+        finally:
+            directory.close()
+
+    def _create(self, clerk_id: str, email: str) -> Tuple[int, Optional[int]]:
+        directory = SessionLocal()
+        try:
+            user = models.User(email=email, google_id=clerk_id)
+            directory.add(user)
+            directory.flush()
+            user.shard = ring.shard_for(user.id)
+            directory.commit()
+            user_id, location = user.id, user.shard
+        except IntegrityError:
+            # Created concurrently by another request
+            directory.rollback()
+            return self._lookup(SessionLocal, clerk_id)
+        finally:
+            directory.close()
+        if location is not None:
+            shard = SessionLocal(info={"shard": location})
+            try:
+                shard.merge(models.User(id=user_id, email=email, google_id=clerk_id))
+                shard.commit()
+            finally:
+                shard.close()
+        return user_id, location
+
+
+resolver = Resolver()
+
+
+def pin(db: Session, location: Optional[int]):
+    """Route ``db`` to a user's location (sessions serve one user's shard at a time)."""
+    current = db.info.get("shard")
+    if current != location and (db.new or db.dirty or db.deleted):
+        raise RuntimeError(f"Session has pending changes on shard {current}, cannot switch to {location}")
+    db.info["shard"] = location
+
+
+def session_factories(read_only: bool = False) -> List:
+    """One session factory per location, for batch jobs that cover every user."""
+    factory = ReadSessionLocal if read_only else SessionLocal
+    return [lambda location=location: factory(info={"shard": location}) for location in locations()]
+
+
+# =====================================================
+# Rebalancing
+# =====================================================
+# Per-user tables copied by a move, in insert order; the first two get new ids
+_REIDED = (("expenses", "expense", "date, id"), ("budgets", "budget", "month, id"))
+_COPIED = ("forecasts", "wrapped_snapshots", "deleted_rows", "expense_archives", "archived_summaries",
+           "recurring_charges")
+
+
+def _columns(conn, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))]
+
+
+def move_user(user_id: int, source: Optional[int], target: Optional[int]) -> int:
+    """Move one user's data from ``source`` to ``target``; returns rows copied."""
+    if source == target:
+        return 0
+    with engine_for(source).connect() as src, engine_for(target).connect() as dst:
+        # 1. Write lock on the source: the user's writers wait until the move is done
+        src.execute(text("UPDATE users SET data_updated_at = data_updated_at WHERE id = :uid"), {"uid": user_id})
+
+        # 2. Copy into the target (clearing leftovers of an interrupted move first)
+        user_cols = [c for c in _columns(src, "users") if c != "shard"]
+        user_row = src.execute(
+            text(f"SELECT {', '.join(user_cols)} FROM users WHERE id = :uid"), {"uid": user_id}
+        ).mappings().one()
+        for table, _, _ in _REIDED:
+            dst.execute(text(f"DELETE FROM {table} WHERE user_id = :uid"), {"uid": user_id})
+        for table in _COPIED:
+            dst.execute(text(f"DELETE FROM {table} WHERE user_id = :uid"), {"uid": user_id})
+        category_ids = categories.copy_for_user(src, dst, user_id)
+        dst.execute(
+            text(
+                f"INSERT INTO users ({', '.join(user_cols)}) VALUES ({', '.join(':' + c for c in user_cols)}) "
+                f"ON CONFLICT(id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in user_cols if c != 'id')}, "
+                f"shard = NULL"
+            ),
+            dict(user_row),
+        )
+        copied = 0
+        old_ids: Dict[str, List[int]] = {}
+        for table, kind, order in _REIDED:
+            cols = [c for c in _columns(src, table) if c not in ("id", "version", "updated_at")]
+            rows = src.execute(
+                text(f"SELECT id, {', '.join(cols)} FROM {table} WHERE user_id = :uid ORDER BY {order}"),
+                {"uid": user_id},
+            ).mappings().all()
+            if rows:
+                # Insert triggers give each row a fresh version and id in the target
+                dst.execute(
+                    text(f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join(':' + c for c in cols)})"),
+                    [{c: category_ids.get(r[c]) if c == "category_id" else r[c] for c in cols} for r in rows],
+                )
+            old_ids[kind] = [r["id"] for r in rows]
+            copied += len(rows)
+        for table in _COPIED:
+            cols = [c for c in _columns(src, table) if c != "id"]
+            rows = src.execute(
+                text(f"SELECT {', '.join(cols)} FROM {table} WHERE user_id = :uid"), {"uid": user_id}
+            ).mappings().all()
+            if rows:
+                dst.execute(
+                    text(f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join(':' + c for c in cols)})"),
+                    [dict(r) for r in rows],
+                )
+            copied += len(rows)
+        # Old ids are gone for delta-sync clients
+        tombstones = [(kind, old_id) for kind, ids in old_ids.items() for old_id in ids]
+        if tombstones:
+            dst.execute(
+                text("UPDATE users SET data_version = data_version + :n WHERE id = :uid"),
+                {"n": len(tombstones), "uid": user_id},
+            )
+            last = dst.execute(text("SELECT data_version FROM users WHERE id = :uid"), {"uid": user_id}).scalar()
+            first = last - len(tombstones) + 1
+            dst.execute(
+                text(
+                    "INSERT INTO deleted_rows (user_id, kind, row_id, version, deleted_at) "
+                    "VALUES (:uid, :kind, :row_id, :version, CURRENT_TIMESTAMP)"
+                ),
+                [{"uid": user_id, "kind": kind, "row_id": old_id, "version": first + i}
+                 for i, (kind, old_id) in enumerate(tombstones)],
+            )
+
+        # 3. Point the directory at the target
+        flip = text("UPDATE users SET shard = :target WHERE id = :uid")
+        if target is None:
+            dst.execute(flip, {"target": None, "uid": user_id})
+            dst.commit()
+        else:
+            dst.commit()
+            if source is None:
+                src.execute(flip, {"target": target, "uid": user_id})
+            else:
+                with engine_for(None).begin() as directory:
+                    directory.execute(flip, {"target": target, "uid": user_id})
+
+        # 4. Remove the source copy (DB_FILE keeps the directory row)
+        for table, _, _ in _REIDED:
+            src.execute(text(f"DELETE FROM {table} WHERE user_id = :uid"), {"uid": user_id})
+        for table in _COPIED:
+            src.execute(text(f"DELETE FROM {table} WHERE user_id = :uid"), {"uid": user_id})
+        categories.delete_for_user(src, user_id)
+        if source is not None:
+            src.execute(text("DELETE FROM users WHERE id = :uid"), {"uid": user_id})
+        src.commit()
+    resolver.forget(user_id)
+    return copied
+
+
+def rebalance(dry_run: bool = False, limit: Optional[int] = None) -> int:
+    """Move every user whose recorded location differs from the ring; returns users moved."""
+    directory = SessionLocal()
+    try:
+        users = directory.query(models.User.id, models.User.shard).order_by(models.User.id).all()
+    finally:
+        directory.close()
+    moves = [(uid, shard, ring.shard_for(uid)) for uid, shard in users if shard != ring.shard_for(uid)]
+    if limit is not None:
+        moves = moves[:limit]
+    for user_id, source, target in moves:
+        if dry_run:
+            logger.info("Would move user %d: %s -> %s", user_id, source, target)
+            continue
+        rows = move_user(user_id, source, target)
+        logger.info("Moved user %d: %s -> %s (%d rows)", user_id, source, target, rows)
+    return len(moves)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tenant shard maintenance.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    reb = sub.add_parser("rebalance", help="move users to their ring placement (DB_SHARDS)")
+    reb.add_argument("--dry-run", action="store_true")
+    reb.add_argument("--limit", type=int, default=None, help="move at most this many users")
+    sub.add_parser("stats", help="users per location")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "rebalance":
+        count = rebalance(args.dry_run, args.limit)
+        logger.info("%s %d users", "Would move" if args.dry_run else "Moved", count)
+    else:
+        session = SessionLocal()
+        try:
+            for shard, users in session.query(models.User.shard, func.count()).group_by(models.User.shard):
+                logger.info("%s: %d users", "main" if shard is None else f"shard {shard}", users)
+        finally:
+            session.close()
@@ -0,0 +1,187 @@
+"""
+Vectorized "what if" budget simulation.
+
+The current month is reduced to a per-category daily spend rate (one query
+grouped by category id; cuts name categories by any spelling or alias), plus
+the rates of any recurring charges the caller wants to drop: the long-run
+rate of a charge found by the detector (recurring.py), else what matching
+expenses cost so far this month.
+Every scenario in a grid (per-category percentage cuts x recurring charges
+removed x fixed daily adjustment) is then evaluated in a single NumPy pass.
+"""
+import calendar
+import itertools
+from datetime import date
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import categories, models, forecasting
+from .recurring import is_active, merchant_key
+
+DEFAULT_BUDGET = 1000
+MAX_SCENARIOS = 4096
+
+
+class SimulationContext(NamedTuple):
+    categories: List[str]  # canonical names
+    rates: np.ndarray  # (C,) expected daily spend per category for the rest of the month
+    recurring: List[str]
+    recurring_rates: np.ndarray  # (R, C) daily rate of each recurring charge per category
+    total_spent: float
+    budget: float
+    days_left: int
+    baseline_projected: float
+    catalog: categories.Catalog
+
+
+def load_context(db: Session, user_id: int, today: Optional[date] = None,
+                 recurring: List[str] = ()) -> SimulationContext:
+    today = today or date.today()
+    start = date(today.year, today.month, 1)
+    days_passed = today.day
+
+    catalog = categories.load(db, user_id)
+    by_category = list(catalog.by_name(dict(db.query(models.Expense.category_id, func.sum(models.Expense.amount)).filter(
+        models.Expense.user_id == user_id,
+        models.Expense.date >= start,
+    ).group_by(models.Expense.category_id).all())).items())
+    spent_today = db.query(func.coalesce(func.sum(models.Expense.amount), 0.0)).filter(
+        models.Expense.user_id == user_id,
+        models.Expense.date == today,
+    ).scalar()
+
+    cat_index = {c: i for i, (c, _) in enumerate(by_category)}
+    totals = np.array([amt for _, amt in by_category], dtype=float)
+    total_spent = float(totals.sum())
+
+    budget = db.query(models.Budget.amount).filter(
+        models.Budget.user_id == user_id, models.Budget.month == today.strftime("%Y-%m")
+    ).scalar()
+    budget_amt = budget if budget is not None else DEFAULT_BUDGET
+
+    # Split the forecast daily rate across categories by this month's mix
+    projection = forecasting.project_month(db, user_id, total_spent, spent_today, today)
+    linear_daily = total_spent / days_passed
+    scale = projection.daily_rate / linear_daily if linear_daily > 0 else 0.0
+    rates = totals / days_passed * scale
+
+    recurring = [r.strip().lower() for r in recurring]
+    recurring_rates = np.zeros((len(recurring), len(by_category)))
+    rec_index = {r: i for i, r in enumerate(recurring)}
+    if recurring:
+        # Detected charges: current price / interval, if charged in a category seen this month
+        keys = {merchant_key(r): r for r in recurring}
+        charge_cols = (models.RecurringCharge.merchant_key, models.RecurringCharge.category,
+                       models.RecurringCharge.last_amount, models.RecurringCharge.interval_days,
+                       models.RecurringCharge.last_seen)
+        for charge in db.query(*charge_cols).filter(
+            models.RecurringCharge.user_id == user_id, models.RecurringCharge.merchant_key.in_(list(keys))
+        ):
+            category = catalog.canonical(charge.category)
+            if is_active(charge, today) and category in cat_index:
+                recurring_rates[rec_index[keys[charge.merchant_key]], cat_index[category]] += (
+                    charge.last_amount / charge.interval_days
+                )
+    undetected = [r for r in recurring if not recurring_rates[rec_index[r]].any()]
+    if undetected:
+        rows = db.query(
+            func.lower(func.trim(models.Expense.description)), models.Expense.category_id, func.sum(models.Expense.amount)
+        ).filter(
+            models.Expense.user_id == user_id,
+            models.Expense.date >= start,
+            func.lower(func.trim(models.Expense.description)).in_(undetected),
+        ).group_by(func.lower(func.trim(models.Expense.description)), models.Expense.category_id).all()
+        for desc, category_id, amount in rows:
+            recurring_rates[rec_index[desc], cat_index[catalog.name(category_id)]] += amount / days_passed * scale
+
+    days_left = calendar.monthrange(today.year, today.month)[1] - today.day
+    return SimulationContext(
+        [c for c, _ in by_category], rates, recurring, recurring_rates, total_spent, budget_amt, days_left,
+        projection.total, catalog,
+    )
+
+
+def evaluate(ctx: SimulationContext, cuts: np.ndarray, removed: np.ndarray, adjustments: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Evaluate S scenarios at once.
+
+    ``cuts`` is (S, C) fractions in [0, 1], ``removed`` is (S, R) booleans and
+    ``adjustments`` is (S,) extra spend per day (negative saves money).
+    """
+    removal = removed.astype(float) @ ctx.recurring_rates  # (S, C)
+    cat_rates = np.clip(ctx.rates[None, :] - removal, 0, None) * (1 - cuts)
+    daily = np.clip(cat_rates.sum(axis=1) + adjustments, 0, None)
+    # Scenario changes only act on the days still to come
+    base_daily = ctx.rates.sum()
+    projected = ctx.baseline_projected + (daily - base_daily) * ctx.days_left
+    remaining = ctx.budget - ctx.total_spent
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_to_exhaust = np.where(daily > 0, remaining / daily, np.inf)
+    return {"daily": daily, "projected": projected, "days_to_exhaustion": days_to_exhaust}
+
+
+def _category_index(ctx: SimulationContext) -> Dict[str, int]:
+    return {c: i for i, c in enumerate(ctx.categories)}
+
+
+def run_grid(ctx: SimulationContext, category_cuts: Dict[str, List[float]],
+             remove_recurring: List[str], daily_adjustments: List[float]) -> List[dict]:
+    """Cartesian product of every option, evaluated in one pass."""
+    cut_options = [(cat, [p / 100.0 for p in pcts]) for cat, pcts in category_cuts.items()]
+    axes = [opts for _, opts in cut_options] + [[False, True]] * len(remove_recurring) + [daily_adjustments or [0.0]]
+    n = int(np.prod([len(a) for a in axes]))
+    if n > MAX_SCENARIOS:
+        raise ValueError(f"Grid has {n} scenarios; the limit is {MAX_SCENARIOS}")
+
+    grid = np.array(list(itertools.product(*axes)), dtype=float).reshape(n, len(axes))
+    cat_index = _category_index(ctx)
+    rec_index = {r: i for i, r in enumerate(ctx.recurring)}
+
+    cuts = np.zeros((n, len(ctx.categories)))
+    for col, (cat, _) in enumerate(cut_options):
+        if ctx.catalog.canonical(cat) in cat_index:
+            cuts[:, cat_index[ctx.catalog.canonical(cat)]] = grid[:, col]
+    removed = np.zeros((n, len(ctx.recurring)), dtype=bool)
+    for j, charge in enumerate(remove_recurring):
+        removed[:, rec_index[charge.strip().lower()]] = grid[:, len(cut_options) + j] > 0
+    adjustments = grid[:, -1]
+
+    result = evaluate(ctx, np.clip(cuts, 0, 1), removed, adjustments)
+    return [
+        _scenario(ctx, result, s,
+                  {cat: round(grid[s, col] * 100, 2) for col, (cat, _) in enumerate(cut_options)},
+                  [c for j, c in enumerate(remove_recurring) if removed[s, j]], float(adjustments[s]))
+        for s in range(n)
+    ]
+
+
+def run_scenario(ctx: SimulationContext, category_cuts: Dict[str, float],
+                 remove_recurring: List[str], daily_adjustment: float = 0.0) -> dict:
+    """One scenario: a percentage cut per category, every listed recurring charge removed."""
+    cat_index = _category_index(ctx)
+    rec_index = {r: i for i, r in enumerate(ctx.recurring)}
+    cuts = np.zeros((1, len(ctx.categories)))
+    for cat, pct in category_cuts.items():
+        if ctx.catalog.canonical(cat) in cat_index:
+            cuts[0, cat_index[ctx.catalog.canonical(cat)]] = pct / 100.0
+    removed = np.zeros((1, len(ctx.recurring)), dtype=bool)
+    for charge in remove_recurring:
+        removed[0, rec_index[charge.strip().lower()]] = True
+    result = evaluate(ctx, np.clip(cuts, 0, 1), removed, np.array([daily_adjustment], dtype=float))
+    return _scenario(ctx, result, 0, dict(category_cuts), list(remove_recurring), float(daily_adjustment))
+
+
+def _scenario(ctx: SimulationContext, result: Dict[str, np.ndarray], s: int,
+              category_cuts: Dict[str, float], removed_recurring: List[str], adjustment: float) -> dict:
+    days = result["days_to_exhaustion"][s]
+    return {
+        "category_cuts": category_cuts,
+        "removed_recurring": removed_recurring,
+        "daily_adjustment": adjustment,
+        "projected_total": round(float(result["projected"][s]), 2),
+        "days_to_exhaustion": int(days) if np.isfinite(days) else None,
+        "risk_status": "danger" if result["projected"][s] > ctx.budget else "safe",
+    }
@@ -1,12 +1,30 @@
 import re
-from google.cloud import vision
 import os
+import threading
 from datetime import datetime
 
-# Set credentials explicitly if available, otherwise relies on GOOGLE_APPLICATION_CREDENTIALS
+from .metrics import track_external
+from .categorizer import suggest_category, FALLBACK_CATEGORY
+
 CREDENTIALS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "service_account.json")
-if os.path.exists(CREDENTIALS_PATH):
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = CREDENTIALS_PATH
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """
+    The Vision client, created on the first scan: google.cloud.vision and its
+    gRPC stack are slow to import, so workers that never scan never load them.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from google.cloud import vision
+            # Set credentials explicitly if available, otherwise relies on GOOGLE_APPLICATION_CREDENTIALS
+            if os.path.exists(CREDENTIALS_PATH):
+                os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = CREDENTIALS_PATH
+            _client = vision.ImageAnnotatorClient()
+        return _client
 
 def extract_receipt_data(image_content: bytes) -> dict:
     """
@@ -15,11 +33,14 @@ def extract_receipt_data(image_content: bytes) -> dict:
     - Date
     - Merchant (heuristic)
     """
-    client = vision.ImageAnnotatorClient()
+    from google.cloud import vision
+
+    client = get_client()
     image = vision.Image(content=image_content)
     
     # Perform text detection
-    response = client.text_detection(image=image)
+    with track_external("google_vision", "text_detection"):
+        response = client.text_detection(image=image)
     texts = response.text_annotations
     
     if not texts:
@@ -104,4 +125,9 @@ def extract_receipt_data(image_content: bytes) -> dict:
             except ValueError:
                 pass
 
+    # 4. Suggest a category from the merchant, then the full receipt text
+    data["category"] = (
+        suggest_category(data["merchant"]) or suggest_category(full_text) or FALLBACK_CATEGORY
+    )
+
     return data
@@ -0,0 +1,272 @@
+"""
+"Money Wrapped" story engine and its precomputed snapshots.
+
+``build_wrapped`` computes the story for one user and period (month, quarter
+or year). Payloads are stored in ``wrapped_snapshots`` so ``GET /wrapped``
+can serve them without touching the user's expenses; a snapshot is fresh as
+long as it was generated after the user's last write (``User.data_updated_at``)
+and, for a still-open period, on the same day.
+
+``python -m backend.app.wrapped`` generates snapshots for all users at period
+close (or for the current period with ``--current``) across a process pool.
+"""
+import argparse
+import calendar
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import categories, models, readmodel, rules
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ("month", "quarter", "year")
+DEFAULT_MONTHLY_BUDGET = 1000
+CHUNK_SIZE = 200  # users per worker task
+
+
+# =====================================================
+# Periods
+# =====================================================
+def period_key_for(period: str, day: date) -> str:
+    if period == "month":
+        return day.strftime("%Y-%m")
+    if period == "quarter":
+        return f"{day.year}-Q{(day.month - 1) // 3 + 1}"
+    if period == "year":
+        return str(day.year)
+    raise ValueError(f"Unknown period: {period}")
+
+
+def period_range(period: str, key: str) -> Tuple[date, date]:
+    """First and last day covered by a period key like 2025-03, 2025-Q1 or 2025."""
+    try:
+        if period == "month":
+            y, m = map(int, key.split("-"))
+            return date(y, m, 1), date(y, m, calendar.monthrange(y, m)[1])
+        if period == "quarter":
+            y, q = key.split("-Q")
+            y, q = int(y), int(q)
+            if not 1 <= q <= 4:
+                raise ValueError(key)
+            last_month = q * 3
+            return date(y, last_month - 2, 1), date(y, last_month, calendar.monthrange(y, last_month)[1])
+        if period == "year":
+            y = int(key)
+            return date(y, 1, 1), date(y, 12, 31)
+    except ValueError:
+        raise ValueError(f"Invalid {period} key: {key}")
+    raise ValueError(f"Unknown period: {period}")
+
+
+def previous_period_key(period: str, today: date) -> str:
+    """Key of the most recently closed period."""
+    start, _ = period_range(period, period_key_for(period, today))
+    return period_key_for(period, date.fromordinal(start.toordinal() - 1))
+
+
+def _period_label(period: str, start: date) -> str:
+    if period == "month":
+        return start.strftime("%B %Y")
+    if period == "quarter":
+        return f"Q{(start.month - 1) // 3 + 1} {start.year}"
+    return str(start.year)
+
+
+def _months_between(start: date, end: date) -> List[str]:
+    months = []
+    y, m = start.year, start.month
+    while (y, m) <= (end.year, end.month):
+        months.append(f"{y}-{m:02d}")
+        y, m = (y, m + 1) if m < 12 else (y + 1, 1)
+    return months
+
+
+# =====================================================
+# Story Engine
+# =====================================================
+def build_wrapped(db: Session, user_id: int, period: str = "month", key: Optional[str] = None,
+                  today: Optional[date] = None) -> dict:
+    today = today or date.today()
+    key = key or period_key_for(period, today)
+    start, end = period_range(period, key)
+    is_open = start <= today <= end
+
+    expenses = readmodel.expense_rows(db, user_id, start, end)
+
+    # Budget for the whole period; months without one count as the default
+    months = _months_between(start, end)
+    budgets = dict(db.query(models.Budget.month, models.Budget.amount).filter(
+        models.Budget.user_id == user_id,
+        models.Budget.month.in_(months),
+    ).all())
+    budget_amt = sum(budgets.get(m, DEFAULT_MONTHLY_BUDGET) for m in months)
+
+    # --- Analysis Data Prep (single pass, see rules.py) ---
+    facts = rules.aggregate(expenses, {"budget": budget_amt, "catalog": categories.load(db, user_id)})
+    total_spent = facts.total
+    remaining = budget_amt - total_spent
+    top_cat = facts.top_category or "General"
+
+    # --- 1. Patterns (Strictly 3 Max) ---
+    patterns = rules.evaluate("wrapped_patterns", facts)[:3]
+    if not patterns:
+        patterns = ["🌱 You are building your spending history"]
+
+    # --- 2. Money Personality (Deterministic) ---
+    personality_label, personality_desc = rules.first("wrapped_personality", facts, (
+        "Balanced but Fragile",
+        "Good distribution, but your buffer is running thin.",
+    ))
+
+    # --- 3. Risk / Consequence ---
+    if is_open and period == "month":
+        spent_today = sum(e.amount for e in expenses if e.date == today)
+        from . import forecasting  # numpy, only needed for an open month
+        projection = forecasting.project_month(db, user_id, total_spent, spent_today, today)
+        avg_daily = projection.daily_rate
+        projected = projection.total
+    else:
+        as_of = today if is_open else end
+        days_passed = (as_of - start).days + 1
+        avg_daily = total_spent / days_passed
+        projected = total_spent + avg_daily * (end - as_of).days
+
+    risk_status = "STABLE"
+    days_until_break = 99
+
+    if projected > budget_amt:
+        risk_status = "FRAGILE"
+        if avg_daily > 0:
+            days_until_break = remaining / avg_daily
+
+    days_safe = int(days_until_break) if days_until_break < 30 else 30
+
+    # --- 4. Recommendation (One Action) ---
+    rec = "Keep tracking every expense."
+    if risk_status == "FRAGILE":
+        rec = f"Cut {top_cat} by 25% and you stay safe."
+    else:
+        rec = "You're safe. Save 10% of your remaining budget."
+
+    return {
+        "period": _period_label(period, start),
+        "total_spent": int(total_spent),
+        "patterns": patterns,
+        "personality": {
+            "label": personality_label,
+            "description": personality_desc
+        },
+        "risk": {
+            "days_left": days_safe,
+            "buffer": int(remaining) if remaining > 0 else 0,
+            "status": risk_status
+        },
+        "recommendation": rec
+    }
+
+
+# =====================================================
+# Snapshots
+# =====================================================
+def is_fresh(snapshot: models.WrappedSnapshot, user: models.User, period: str, today: date) -> bool:
+    if user.data_updated_at and snapshot.generated_at < user.data_updated_at:
+        return False
+    start, end = period_range(period, snapshot.period_key)
+    if start <= today <= end and snapshot.generated_at.date() != today:
+        return False  # open periods depend on "today" (days left, projection)
+    return True
+
+
+def save_snapshot(db: Session, user_id: int, period: str, key: str, payload: dict) -> models.WrappedSnapshot:
+    snapshot = db.query(models.WrappedSnapshot).filter(
+        models.WrappedSnapshot.user_id == user_id,
+        models.WrappedSnapshot.period == period,
+        models.WrappedSnapshot.period_key == key,
+    ).first()
+    if snapshot is None:
+        snapshot = models.WrappedSnapshot(user_id=user_id, period=period, period_key=key)
+        db.add(snapshot)
+    snapshot.payload = json.dumps(payload)
+    snapshot.generated_at = datetime.now()
+    db.commit()
+    return snapshot
+
+
+def get_wrapped(db: Session, user: models.User, period: str = "month", key: Optional[str] = None) -> dict:
+    """Serve the stored snapshot, rebuilding it only if it is missing or stale."""
+    today = date.today()
+    key = key or period_key_for(period, today)
+    period_range(period, key)  # validates the key
+    snapshot = db.query(models.WrappedSnapshot).filter(
+        models.WrappedSnapshot.user_id == user.id,
+        models.WrappedSnapshot.period == period,
+        models.WrappedSnapshot.period_key == key,
+    ).first()
+    if snapshot is not None and is_fresh(snapshot, user, period, today):
+        return json.loads(snapshot.payload)
+
+    payload = build_wrapped(db, user.id, period, key, today)
+    save_snapshot(db, user.id, period, key, payload)
+    return payload
+
+
+# =====================================================
+# Batch Generation
+# =====================================================
+def _generate_chunk(args) -> int:
+    from .db import SessionLocal
+
+    period, key, today, user_ids, location = args
+    db = SessionLocal(info={"shard": location})
+    try:
+        for user_id in user_ids:
+            save_snapshot(db, user_id, period, key, build_wrapped(db, user_id, period, key, today))
+    finally:
+        db.close()
+    return len(user_ids)
+
+
+def generate_snapshots(db: Session, period: str, key: str, today: Optional[date] = None,
+                       workers: Optional[int] = None) -> int:
+    """Build snapshots for every user with expenses in the period."""
+    today = today or date.today()
+    start, end = period_range(period, key)
+    user_ids = [uid for (uid,) in db.query(models.Expense.user_id).filter(
+        models.Expense.date >= start,
+        models.Expense.date <= end,
+    ).distinct().all()]
+    location = db.info.get("shard")  # workers open their own session on the same shard
+    chunks = [(period, key, today, user_ids[i:i + CHUNK_SIZE], location) for i in range(0, len(user_ids), CHUNK_SIZE)]
+    if len(chunks) <= 1 or workers == 1:
+        return sum(_generate_chunk(c) for c in chunks)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(_generate_chunk, chunks))
+
+
+if __name__ == "__main__":
+    from .shards import session_factories
+
+    parser = argparse.ArgumentParser(description="Generate Money Wrapped snapshots for all users.")
+    parser.add_argument("--period", choices=PERIODS, default="month")
+    parser.add_argument("--key", default=None, help="period key, e.g. 2025-03, 2025-Q1, 2025 (default: last closed period)")
+    parser.add_argument("--current", action="store_true", help="generate the current, still-open period")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    today = date.today()
+    key = args.key or (period_key_for(args.period, today) if args.current else previous_period_key(args.period, today))
+    count = 0
+    for open_session in session_factories():  # main file, then each tenant shard
+        session = open_session()
+        try:
+            models.Base.metadata.create_all(bind=session.get_bind())
+            count += generate_snapshots(session, args.period, key, today, args.workers)
+        finally:
+            session.close()
+    logger.info("Generated %d %s snapshots for %s", count, args.period, key)
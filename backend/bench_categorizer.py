@@ -0,0 +1,95 @@
+"""
+Throughput benchmark for the keyword categorizer.
+
+Categorizes 1M synthetic descriptions with the Aho-Corasick automaton and
+compares it with the naive "any(keyword in description)" loop it replaces,
+for the default dictionary and for one 100x larger. First checks a few
+descriptions whose keyword matches are only partial words.
+
+Run from the repository root:
+    python backend/bench_categorizer.py [--n 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.app.categorizer import Categorizer, DEFAULT_KEYWORDS
+
+# description -> expected suggestion
+CASES = {
+    "Business class ticket": None,
+    "Car rental": None,
+    "Gym training session": "Health",
+    "Metropolitan museum": None,
+    "Monthly rent": "Rent",
+    "Bus pass": "Transport",
+    "Uber trip": "Transport",
+    "Dominos pizza": "Restaurants",
+    "McDonald's": "Restaurants",
+    "Movies night": "Entertainment",
+}
+
+WORDS = ["payment", "store", "order", "online", "card", "ref", "purchase", "txn", "city", "branch"]
+
+
+def make_descriptions(n, keywords, seed=42):
+    rng = random.Random(seed)
+    keys = list(keywords)
+    out = []
+    for _ in range(n):
+        parts = rng.sample(WORDS, 3)
+        if rng.random() < 0.8:
+            parts.insert(rng.randrange(4), rng.choice(keys).title())
+        parts.append(str(rng.randrange(100000)))
+        out.append(" ".join(parts))
+    return out
+
+
+def naive_suggest(description, keywords):
+    text = description.lower()
+    scores = {}
+    for keyword, category in keywords.items():
+        keyword = keyword.rstrip("*")
+        if keyword in text:
+            scores[category] = scores.get(category, 0) + len(keyword)
+    return max(scores, key=scores.get) if scores else None
+
+
+def bench(label, fn, descriptions):
+    start = time.perf_counter()
+    for d in descriptions:
+        fn(d)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<44} {len(descriptions):>9,} rows  {elapsed:7.2f}s  {len(descriptions) / elapsed:>12,.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=1_000_000)
+    parser.add_argument("--naive-n", type=int, default=100_000, help="rows for the (slow) naive baseline")
+    args = parser.parse_args()
+
+    categorizer = Categorizer(DEFAULT_KEYWORDS)
+    wrong = {d: categorizer.suggest(d) for d, expected in CASES.items() if categorizer.suggest(d) != expected}
+    if wrong:
+        sys.exit(f"wrong suggestions: {wrong}")
+
+    large = dict(DEFAULT_KEYWORDS)
+    for i in range(len(DEFAULT_KEYWORDS) * 99):
+        large[f"merchant{i:05d}"] = "Shopping"
+
+    for name, keywords in (("default", DEFAULT_KEYWORDS), ("100x", large)):
+        descriptions = make_descriptions(args.n, DEFAULT_KEYWORDS)
+        start = time.perf_counter()
+        categorizer = Categorizer(keywords)
+        print(f"\n[{name} dictionary: {len(keywords):,} keywords, automaton built in {time.perf_counter() - start:.3f}s]")
+        bench("automaton", categorizer.suggest, descriptions)
+        bench("naive substring loop", lambda d: naive_suggest(d, keywords), descriptions[:args.naive_n])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Analytics read path: ORM entities vs read-model tuples (readmodel.py).
+
+Seeds a throwaway database with one user's expenses (100k by default,
+spread over the last year), then runs the analytics behind ``/summary/``,
+``/report_by_category/``, ``/insights``, ``/spending-profile`` and
+``/wrapped`` twice: once with rows loaded as ``models.Expense`` entities
+(the previous read path) and once with ``readmodel.expense_rows``. Reports
+the median latency of each and, from a separate traced run, the peak and
+retained Python allocations.
+
+Run from the repository root:
+    python backend/bench_readmodel.py [--rows 100000] [--runs 3]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATEGORIES = ("Food", "Groceries", "Restaurants", "Transport", "Entertainment", "Shopping", "Rent", "Utilities")
+
+
+def seed(rows: int, today: date):
+    from backend.app import categories, db, models
+
+    rng = random.Random(0)
+    with db.engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), {"id": 1, "email": "bench@example.com", "data_version": 0})
+        category_ids = {c: categories.resolve(conn, 1, c) for c in CATEGORIES}
+        expenses = []
+        for _ in range(rows):
+            category = rng.choice(CATEGORIES)
+            expenses.append({
+                "user_id": 1, "date": today - timedelta(days=rng.randrange(365)),
+                "description": f"shop {rng.randrange(200)}", "amount": round(rng.uniform(1, 120), 2),
+                "category": category, "category_id": category_ids[category], "is_anomaly": False,
+            })
+        conn.execute(models.Expense.__table__.insert(), expenses)
+        conn.execute(models.Budget.__table__.insert(), {"user_id": 1, "month": today.strftime("%Y-%m"), "amount": 5000})
+
+
+def orm_rows(db, user_id, start=None, end=None):
+    """The previous read path: full entities, then the same tuples analytics now get."""
+    from backend.app import models, readmodel
+
+    q = db.query(models.Expense).filter(models.Expense.user_id == user_id)
+    if start is not None:
+        q = q.filter(models.Expense.date >= start)
+    if end is not None:
+        q = q.filter(models.Expense.date <= end)
+    return [readmodel.ExpenseRow._make(getattr(e, f) for f in readmodel.ExpenseRow._fields)
+            for e in q.order_by(models.Expense.date, models.Expense.id)]
+
+
+def workloads(today: date) -> Dict[str, Callable]:
+    from backend.app import crud, dashboard, readmodel, wrapped
+
+    def data(month=None):
+        return dashboard.DashboardData(db_session(), 1, month, today)
+
+    def summary(month=None):
+        d = data(month)
+        return crud.summary_expenses(d.db, 1, month, data=d)
+
+    def by_category(month=None):
+        d = data(month)
+        return crud.report_by_category(d.db, 1, month, data=d)
+
+    return {
+        "fetch (all rows)": lambda: readmodel.expense_rows(db_session(), 1),
+        "summary (all time)": summary,
+        "report_by_category": by_category,
+        "insights": lambda: dashboard.insights(data()),
+        "spending_profile": lambda: dashboard.spending_profile(data()),
+        "wrapped (year)": lambda: wrapped.build_wrapped(db_session(), 1, "year", str(today.year), today),
+    }
+
+
+_sessions: List = []
+
+
+def db_session():
+    from backend.app import db
+
+    session = db.ReadSessionLocal()
+    _sessions.append(session)
+    return session
+
+
+def close_sessions():
+    while _sessions:
+        _sessions.pop().close()
+
+
+def measure(fn: Callable, runs: int) -> Tuple[float, float, float]:
+    """(median ms, peak MB, retained MB); allocations come from one extra traced run."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1000)
+        del result
+        close_sessions()
+    tracemalloc.start()
+    result = fn()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    close_sessions()
+    return statistics.median(times), peak / 1e6, retained / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000, help="expenses of the benchmark user")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_readmodel_")
+    os.environ["DB_FILE"] = os.path.join(workdir, "bench.db")
+    os.environ.setdefault("DB_SHARDS", "0")
+    sys.path.insert(0, ROOT)
+    from backend.app import db, readmodel
+
+    db.init_schema(db.engine)
+    today = date.today()
+    print(f"seeding {args.rows} expenses ...")
+    seed(args.rows, today)
+
+    tuples = readmodel.expense_rows
+    results = {}
+    for mode, loader in (("orm", orm_rows), ("tuples", tuples)):
+        readmodel.expense_rows = loader  # every analytics path reads through this function
+        for name, fn in workloads(today).items():
+            results[(mode, name)] = measure(fn, args.runs)
+    readmodel.expense_rows = tuples
+
+    print(f"\n{'workload':<22} {'orm ms':>9} {'tuple ms':>9} {'speedup':>8} "
+          f"{'orm peak MB':>12} {'tuple peak MB':>14} {'orm kept MB':>12} {'tuple kept MB':>14}")
+    for name in workloads(today):
+        o_ms, o_peak, o_kept = results[("orm", name)]
+        t_ms, t_peak, t_kept = results[("tuples", name)]
+        print(f"{name:<22} {o_ms:9.0f} {t_ms:9.0f} {o_ms / t_ms:7.1f}x "
+              f"{o_peak:12.1f} {t_peak:14.1f} {o_kept:12.1f} {t_kept:14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Write throughput vs. tenant shard count.
+
+For each shard count, starts writer processes that insert expenses for
+their users through ``crud.create_expense`` (one commit per write), against
+throwaway database files. Processes rather than threads, so writers
+contend on SQLite's file lock instead of the GIL. Each configuration runs
+in a fresh interpreter because the shard settings are read at import.
+
+Run from the repository root:
+    python backend/bench_shards.py [--shards 1 2 4 8] [--processes 8] [--writes 100]
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USERS_PER_PROCESS = 4
+
+
+def writer(proc: int, writes: int, ready, start, done):
+    sys.path.insert(0, ROOT)
+    from backend.app import crud, schemas
+    from backend.app.db import SessionLocal
+
+    users = []
+    for u in range(USERS_PER_PROCESS):
+        db = SessionLocal()
+        user = crud.get_or_create_user_by_clerk(db, f"bench-{proc}-{u}", f"bench-{proc}-{u}@example.com")
+        users.append((user.id, db))  # session stays pinned to the user's shard
+    ready.release()
+    start.wait()
+    for i in range(writes):
+        user_id, db = users[i % len(users)]
+        crud.create_expense(db, schemas.ExpenseCreate(
+            date=date(2025, 1, 1) + timedelta(days=i % 365), description=f"bench {i}",
+            amount=10 + i % 90, category=("Food", "Transport", "Shopping")[i % 3],
+        ), user_id)
+    for _, db in users:
+        db.close()
+    done.put(writes)
+
+
+def run_configuration(processes: int, writes: int) -> dict:
+    sys.path.insert(0, ROOT)
+    from backend.app.db import engine, init_schema
+    init_schema(engine)  # the directory; shards are created on first use
+
+    ctx = mp.get_context("spawn")
+    ready, start, done = ctx.Semaphore(0), ctx.Event(), ctx.Queue()
+    pool = [ctx.Process(target=writer, args=(p, writes, ready, start, done)) for p in range(processes)]
+    for p in pool:
+        p.start()
+    for _ in pool:
+        if not ready.acquire(timeout=120):
+            raise RuntimeError("writer process failed to start")
+    began = time.perf_counter()
+    start.set()
+    total = sum(done.get(timeout=600) for _ in pool)
+    elapsed = time.perf_counter() - began
+    for p in pool:
+        p.join()
+    return {"writes": total, "seconds": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=100, help="writes per process")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_configuration(args.processes, args.writes)))
+        return
+
+    for shards in args.shards:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DB_FILE=os.path.join(tmp, "directory.db"),
+                       DB_SHARD_DIR=os.path.join(tmp, "shards"), DB_SHARDS=str(shards))
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", "--processes", str(args.processes), "--writes", str(args.writes)],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+        rate = result["writes"] / result["seconds"]
+        print(f"{shards:>3} shards  {result['writes']:>7,} writes  {result['seconds']:7.2f}s  {rate:>9,.0f} writes/s")
+
+
+if __name__ == "__main__":
+    main()
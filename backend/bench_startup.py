@@ -0,0 +1,82 @@
+"""
+Startup cost: time to import ``backend.app.main`` in a fresh interpreter.
+
+Runs ``python -X importtime -c "import backend.app.main"`` a few times,
+reports the median cumulative import time and the slowest modules, and
+exits non-zero when the median exceeds the budget or when a module that is
+meant to load on first use (numpy, the Vision client, httpx) was imported.
+Schema creation runs in the app's startup event, so it is not part of the
+import.
+
+Run from the repository root:
+    python backend/bench_startup.py [--runs 5] [--budget-ms 750] [--top 15]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TARGET = "backend.app.main"
+# Loaded on first use (first write / forecast / simulation, first scan, cold JWKS cache)
+LAZY_MODULES = ("numpy", "google.cloud.vision", "httpx")
+
+
+def import_times() -> Tuple[Dict[str, int], List[Tuple[str, int, int]]]:
+    """One cold import; returns cumulative microseconds by module and (module, self, cumulative) rows."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {TARGET}"],
+        cwd=ROOT, check=True, capture_output=True, text=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return {name: cumulative for name, _, cumulative in rows}, rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=750.0, help="fail when the median import exceeds this")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    args = parser.parse_args()
+
+    totals, last = [], None
+    for _ in range(args.runs):
+        cumulative, rows = import_times()
+        totals.append(cumulative[TARGET] / 1000)
+        last = (cumulative, rows)
+    cumulative, rows = last
+    median = statistics.median(totals)
+
+    # Top-level packages and the app's own modules, by cumulative time
+    def interesting(name: str) -> bool:
+        return "." not in name or name.startswith("backend.app.")
+    print(f"{'module':<40} {'self ms':>9} {'cumulative ms':>14}")
+    for name, self_us, cumulative_us in sorted(rows, key=lambda r: -r[2]):
+        if name != TARGET and interesting(name):
+            print(f"{name:<40} {self_us / 1000:9.1f} {cumulative_us / 1000:14.1f}")
+            args.top -= 1
+            if not args.top:
+                break
+
+    print(f"\nimport {TARGET}: median {median:.0f} ms over {args.runs} runs "
+          f"(min {min(totals):.0f}, max {max(totals):.0f}), budget {args.budget_ms:.0f} ms")
+    failed = False
+    eager = [m for m in LAZY_MODULES if m in cumulative]
+    if eager:
+        print(f"FAIL: imported at startup, should load on first use: {', '.join(eager)}")
+        failed = True
+    if median > args.budget_ms:
+        print("FAIL: over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
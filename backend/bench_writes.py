@@ -0,0 +1,90 @@
+"""
+Write throughput benchmark: one commit per write vs. group commit.
+
+Runs concurrent writer threads inserting expenses through
+``crud.create_expense`` (a transaction and fsync each) and through the
+``writes.WriteCoordinator`` (one transaction per batch), against a
+throwaway SQLite file.
+
+Run from the repository root:
+    python backend/bench_writes.py [--threads 16] [--writes 100]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend.app import crud, models, schemas
+from backend.app.writes import WriteCoordinator
+
+
+def make_session_factory(path):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 30})
+    models.Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = factory()
+    for i in range(64):
+        db.add(models.User(email=f"bench{i}@example.com", google_id=f"bench{i}"))
+    db.commit()
+    db.close()
+    return factory
+
+
+def expense(i):
+    return schemas.ExpenseCreate(
+        date=date(2025, 1, 1) + timedelta(days=i % 365), description=f"bench {i}",
+        amount=10 + i % 90, category=("Food", "Transport", "Shopping")[i % 3],
+    )
+
+
+def run(label, threads, writes, worker):
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    total = threads * writes
+    print(f"{label:<28} {total:>7,} writes  {elapsed:7.2f}s  {total / elapsed:>9,.0f} writes/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=100, help="writes per thread")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        factory = make_session_factory(os.path.join(tmp, "per_write.db"))
+
+        def per_write(t):
+            db = factory()
+            try:
+                for i in range(args.writes):
+                    crud.create_expense(db, expense(i), user_id=t % 64 + 1)
+            finally:
+                db.close()
+
+        run("commit per write", args.threads, args.writes, per_write)
+
+        coordinator = WriteCoordinator(make_session_factory(os.path.join(tmp, "group.db")))
+
+        def grouped(t):
+            for i in range(args.writes):
+                coordinator.submit(crud.stage_create_expense, expense(i), t % 64 + 1).result()
+
+        run("group commit", args.threads, args.writes, grouped)
+        coordinator.stop()
+
+
+if __name__ == "__main__":
+    main()
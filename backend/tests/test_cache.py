@@ -0,0 +1,114 @@
+"""Cache against the local Redis-protocol stand-in (cache.StandInServer)."""
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from backend.app.cache import Cache, RedisBackend, StandInServer
+
+
+@pytest.fixture(scope="module")
+def server():
+    """A stand-in listening on a free port, served from a background event loop."""
+    stand_in = StandInServer()
+    loop = asyncio.new_event_loop()
+    srv = loop.run_until_complete(asyncio.start_server(stand_in.handle, "127.0.0.1", 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield stand_in, srv.sockets[0].getsockname()[1]
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    srv.close()
+    loop.close()
+
+
+@pytest.fixture
+def port(server):
+    stand_in, port = server
+    stand_in.store.clear()
+    return port
+
+
+def make_cache(port, **kwargs):
+    return Cache(RedisBackend("127.0.0.1", port), **kwargs)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_values_round_trip_as_json(port):
+    cache = make_cache(port)
+    cache.set("summary", "2024-01", {"total": 12.5, "days": [1, 2]})
+    assert cache.get("summary", "2024-01") == {"total": 12.5, "days": [1, 2]}
+    assert cache.get("summary", "2024-02", default="missing") == "missing"
+
+
+def test_entries_expire_after_ttl(port):
+    cache = make_cache(port)
+    cache.set("summary", "k", 1, ttl=0.2)
+    assert cache.get("summary", "k") == 1
+    time.sleep(0.3)
+    assert cache.get("summary", "k") is None
+
+
+def test_keys_are_namespaced(port):
+    cache = make_cache(port)
+    cache.set("summary", "k", "summary")
+    cache.set("report", "k", "report")
+    cache.set("summary", "k", "user 1", user_id=1)
+    cache.set("summary", "k", "user 2", user_id=2)
+    assert cache.get("summary", "k") == "summary"
+    assert cache.get("report", "k") == "report"
+    assert cache.get("summary", "k", user_id=1) == "user 1"
+    assert cache.get("summary", "k", user_id=2) == "user 2"
+    # Another prefix on the same server sees none of it
+    assert make_cache(port, prefix="other").get("summary", "k") is None
+
+
+def test_invalidate_user_reaches_every_instance(port):
+    worker_a, worker_b = make_cache(port), make_cache(port)
+    worker_a.set("summary", "k", "cached", user_id=1)
+    worker_a.set("summary", "k", "cached", user_id=2)
+    assert worker_b.get("summary", "k", user_id=1) == "cached"
+
+    worker_b.invalidate_user(1)
+    assert worker_a.get("summary", "k", user_id=1) is None
+    assert worker_a.get("summary", "k", user_id=2) == "cached"
+    assert worker_a.generation(1) != worker_a.generation(2)
+
+
+def test_concurrent_misses_compute_once(port):
+    workers = [make_cache(port), make_cache(port)]  # two processes' worth of instances
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"value": 42}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda c=workers[i % 2]: results.append(c.get_or_set("summary", "k", compute, user_id=1)))
+        for i in range(15)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == [{"value": 42}] * 15
+
+
+def test_unreachable_server_degrades_to_misses():
+    cache = make_cache(free_port())
+    cache.set("summary", "k", 1)  # dropped, not raised
+    assert cache.get("summary", "k", default="miss") == "miss"
+    assert cache.get_or_set("summary", "k", lambda: "computed", user_id=1) == "computed"
+    cache.invalidate_user(1)
+    assert cache.generation(1) is None
+    assert cache.claim("token", "nonce", 10) is False
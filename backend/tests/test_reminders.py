@@ -0,0 +1,129 @@
+"""Reminder timing wheel and scheduler, delivered to the MemorySender stand-in."""
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend.app import models
+from backend.app.reminders import MemorySender, ReminderScheduler, ReminderSender, TimingWheel, parse_slot
+
+DAY = datetime(2026, 10, 19)
+
+
+def at(hh_mm: str) -> datetime:
+    return DAY + timedelta(minutes=parse_slot(hh_mm))
+
+
+def test_update_adds_moves_and_removes_users():
+    wheel = TimingWheel()
+    wheel.update(1, "a@x.com", True, "07:30")
+    assert [r.user_id for r in wheel.due(parse_slot("07:30"))] == [1]
+
+    wheel.update(1, "a@x.com", True, "08:15")
+    assert wheel.due(parse_slot("07:30")) == []
+    assert [r.reminder_time for r in wheel.due(parse_slot("08:15"))] == ["08:15"]
+    assert len(wheel) == 1
+
+    wheel.update(1, "a@x.com", False, "08:15")
+    assert wheel.due(parse_slot("08:15")) == [] and len(wheel) == 0
+
+    wheel.update(2, "b@x.com", True, "25:00")  # invalid times are not scheduled
+    assert len(wheel) == 0
+
+
+def test_tick_catches_up_on_skipped_minutes():
+    wheel = TimingWheel()
+    for user_id, time in enumerate(("10:00", "10:01", "10:02", "10:03"), start=1):
+        wheel.update(user_id, f"{user_id}@x.com", True, time)
+    sender = MemorySender()
+    scheduler = ReminderScheduler(wheel, sender)
+
+    assert asyncio.run(scheduler.tick(now=at("09:59"))) == 0
+    # Woke up late: 10:00-10:02 are all still sent, once
+    assert asyncio.run(scheduler.tick(now=at("10:02"))) == 3
+    assert asyncio.run(scheduler.tick(now=at("10:02"))) == 0
+    assert sorted(r.user_id for r in sender.sent) == [1, 2, 3]
+
+
+def test_batches_respect_size_and_concurrency():
+    class SlowSender(ReminderSender):
+        def __init__(self):
+            self.batches, self.in_flight, self.max_in_flight = [], 0, 0
+
+        async def send_batch(self, reminders):
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(0.01)
+            self.batches.append(len(reminders))
+            self.in_flight -= 1
+
+    wheel = TimingWheel()
+    for user_id in range(10):
+        wheel.update(user_id, f"{user_id}@x.com", True, "20:00")
+    sender = SlowSender()
+    scheduler = ReminderScheduler(wheel, sender, batch_size=3, max_concurrency=2)
+
+    asyncio.run(scheduler.tick(now=at("19:59")))
+    assert asyncio.run(scheduler.tick(now=at("20:00"))) == 10
+    assert sorted(sender.batches) == [1, 3, 3, 3]
+    assert sender.max_in_flight == 2
+
+
+def test_tick_only_reads_due_buckets():
+    class CountingWheel(TimingWheel):
+        def __init__(self):
+            super().__init__()
+            self.read = []
+
+        def due(self, slot):
+            self.read.append(slot)
+            return super().due(slot)
+
+    wheel = CountingWheel()
+    for user_id in range(1000):
+        wheel.update(user_id, f"{user_id}@x.com", True, f"{user_id % 24:02d}:{user_id % 60:02d}")
+    scheduler = ReminderScheduler(wheel, MemorySender())
+
+    asyncio.run(scheduler.tick(now=at("12:00")))
+    wheel.read.clear()
+    sent = asyncio.run(scheduler.tick(now=at("12:01")))
+    assert wheel.read == [parse_slot("12:01")]
+    assert sent == sum(1 for u in range(1000) if (u % 24, u % 60) == (12, 1))
+
+
+def test_sync_applies_preference_changes_from_other_workers(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'reminders.db'}")
+    models.Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add_all([
+            models.User(id=1, email="a@x.com", reminder_enabled=True, reminder_time="07:30"),
+            models.User(id=2, email="b@x.com", reminder_enabled=True, reminder_time="09:00"),
+        ])
+        db.commit()
+
+    def change(user_id, **values):
+        # What crud.update_user_preferences does on whichever worker served the request
+        with Session() as db:
+            db.query(models.User).filter(models.User.id == user_id).update(
+                dict(values, reminder_updated_at=datetime.now())
+            )
+            db.commit()
+
+    async def run():
+        wheel = TimingWheel()
+        scheduler = ReminderScheduler(wheel, MemorySender())
+        scheduler.start(Session)
+        try:
+            assert len(wheel) == 2
+            change(1, reminder_time="08:15")
+            change(2, reminder_enabled=False)
+            scheduler.sync()
+            assert wheel.due(parse_slot("07:30")) == []
+            assert [r.user_id for r in wheel.due(parse_slot("08:15"))] == [1]
+            assert len(wheel) == 1
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(run())